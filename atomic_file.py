@@ -0,0 +1,43 @@
+import os # for the files paths and other useful stuffs
+import json # for the JSON files
+import threading # for the temporary names of the threads
+
+# CONSTANTS
+TEMPORARY_SUFFIX = ".tmp"
+
+
+# FUNCTIONS
+def write_text(path, text):
+    """
+    Replace the content of a file so that a crash never leaves it half written.
+
+    The text is written and synced to a temporary file next to it, then the temporary file takes its name. The temporary
+    name is different for every process and thread, so two writers of the same file never write into each other's file:
+    the last one to finish wins.
+    """
+    temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}{TEMPORARY_SUFFIX}"
+    try:
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        try:
+            os.remove(temporary_path)
+        except OSError:
+            pass
+        raise
+
+def write_json(path, data, indent=None):
+    """Replace the content of a JSON file, see write_text."""
+    write_text(path, json.dumps(data, indent=indent))
+
+def read_json_object(path):
+    """The JSON object of a file, an empty dict if the file is missing, can't be read or is not a JSON object."""
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
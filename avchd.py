@@ -0,0 +1,190 @@
+import os # for the files paths and other useful stuffs
+import struct # for reading the binary index files
+import datetime # for the recording timestamps
+import print_color # for the colored prints
+
+# CONSTANTS
+BDMV_PATH_FROM_ROOT = os.path.join("PRIVATE", "AVCHD", "BDMV")
+PLAYLIST_DIRECTORY = "PLAYLIST"
+STREAM_DIRECTORY = "STREAM"
+
+PLAYLIST_EXTENSION = ".MPL"
+STREAM_EXTENSION = ".MTS"
+
+PLAYLIST_TYPE_INDICATOR = b"MPLS"
+
+# connection condition of a play item with the previous one: 1 is a new recording,
+# 5 and 6 are seamless connections, used when the camcorder splits a long recording in several files
+SEAMLESS_CONNECTIONS = (5, 6)
+
+ENTRY_MARK = 1 # mark type of the marks at the start of a recording
+TIMESTAMP_LENGTH = 7 # record time and date of the marks: 7 BCD bytes, YYYY MM DD hh mm ss
+
+# ExtensionData: length, start of the data blocks, 3 reserved bytes, number of entries, then 12 bytes for every entry
+# (ID1, ID2, start of the block from the start of the ExtensionData, length of the block)
+EXTENSION_HEADER_LENGTH = 12
+EXTENSION_ENTRY_LENGTH = 12
+MARK_EXTENSION_IDS = (2, 2) # ID1, ID2 of the block with the record time and date of every mark
+# playlist marks extension: number of marks, then the same number of bytes for every mark, starting with the
+# time zone (1 byte) and the record time and date
+MARK_EXTENSION_TIMESTAMP_OFFSET = 1
+
+
+class Recording:
+    """A recording of the camcorder: the STREAM files it is made of (in order) and when it started, if known."""
+
+    def __init__(self, clip_names, start=None):
+        self.clip_names = clip_names
+        self.start = start
+
+    def __repr__(self):
+        return f"Recording({self.clip_names}, {self.start})"
+
+
+# FUNCTIONS
+def _decode_bcd_timestamp(data):
+    """Decode YYYY MM DD hh mm ss stored as 7 BCD bytes, None if the bytes are not a valid date."""
+    digits = []
+    for byte in data:
+        high, low = byte >> 4, byte & 0x0F
+        if high > 9 or low > 9:
+            return None
+        digits.append(high * 10 + low)
+    year = digits[0] * 100 + digits[1]
+    try:
+        timestamp = datetime.datetime(year, *digits[2:])
+    except ValueError:
+        return None
+    if not 2000 <= year <= 2099: # AVCHD dates the recordings of this century, anything else is a coincidence in the bytes
+        return None
+    return timestamp
+
+def _mark_timestamps(extension_data):
+    """
+    Return the record time and date of every playlist mark from the ExtensionData of a playlist.
+
+    :return: List with a datetime (or None if the mark has no valid date) for every mark, None if the playlist has no marks extension.
+    """
+    if len(extension_data) < EXTENSION_HEADER_LENGTH:
+        return None
+    length, = struct.unpack_from(">I", extension_data, 0)
+    if not length:
+        return None
+    number_of_entries = extension_data[11]
+    for index in range(number_of_entries):
+        id1, id2, block_start, block_length = struct.unpack_from(">HHII", extension_data, EXTENSION_HEADER_LENGTH + index * EXTENSION_ENTRY_LENGTH)
+        if (id1, id2) != MARK_EXTENSION_IDS:
+            continue
+        block = extension_data[block_start:block_start + block_length]
+        if len(block) < 2 or len(block) != block_length:
+            return None
+        number_of_marks, = struct.unpack_from(">H", block, 0)
+        if not number_of_marks:
+            return []
+        mark_length = (block_length - 2) // number_of_marks
+        if mark_length < MARK_EXTENSION_TIMESTAMP_OFFSET + TIMESTAMP_LENGTH:
+            return None
+        timestamps = []
+        for mark in range(number_of_marks):
+            timestamp_start = 2 + mark * mark_length + MARK_EXTENSION_TIMESTAMP_OFFSET
+            timestamps.append(_decode_bcd_timestamp(block[timestamp_start:timestamp_start + TIMESTAMP_LENGTH]))
+        return timestamps
+    return None
+
+def parse_playlist(data):
+    """
+    Parse a PLAYLIST (.MPL) file.
+
+    :param data: Content of the file.
+    :return: Tuple (play items, marks, extension data). A play item is (clip name, connection condition),
+             a mark is (mark type, play item index).
+    """
+    if data[:4] != PLAYLIST_TYPE_INDICATOR:
+        raise ValueError("not an AVCHD playlist")
+
+    playlist_start, marks_start, extension_start = struct.unpack_from(">III", data, 8)
+
+    # PlayList: length, reserved, number of play items, number of sub paths, then the play items
+    number_of_play_items, = struct.unpack_from(">H", data, playlist_start + 6)
+    play_items = []
+    offset = playlist_start + 10
+    for _ in range(number_of_play_items):
+        length, = struct.unpack_from(">H", data, offset)
+        clip_name = data[offset + 2:offset + 7].decode('ascii')
+        flags, = struct.unpack_from(">H", data, offset + 11)
+        connection_condition = flags & 0x0F
+        play_items.append((clip_name, connection_condition))
+        offset += 2 + length
+
+    # PlayListMark: length, number of marks, then 14 bytes for every mark
+    number_of_marks, = struct.unpack_from(">H", data, marks_start + 4)
+    marks = []
+    for index in range(number_of_marks):
+        mark_type, play_item = struct.unpack_from(">BH", data, marks_start + 6 + index * 14 + 1)
+        marks.append((mark_type, play_item))
+
+    extension_data = data[extension_start:] if extension_start else b""
+
+    return play_items, marks, extension_data
+
+def recordings_from_playlist(data):
+    """Group the play items of a playlist into recordings, with the start time when the index has it."""
+    play_items, marks, extension_data = parse_playlist(data)
+
+    recordings = []
+    first_play_items = [] # index of the first play item of every recording
+    for index, (clip_name, connection_condition) in enumerate(play_items):
+        if recordings and connection_condition in SEAMLESS_CONNECTIONS:
+            recordings[-1].clip_names.append(clip_name)
+        else:
+            recordings.append(Recording([clip_name]))
+            first_play_items.append(index)
+
+    # the marks extension of AVCHD has the record time and date of every mark, in the same order of the marks:
+    # use them only if it has all the marks, otherwise the file mtime stays the reference
+    timestamps = _mark_timestamps(extension_data)
+    if timestamps is not None and len(timestamps) == len(marks):
+        start_of_play_item = {}
+        for (mark_type, play_item), timestamp in zip(marks, timestamps):
+            if mark_type == ENTRY_MARK and timestamp:
+                start_of_play_item.setdefault(play_item, timestamp)
+        for recording, first_play_item in zip(recordings, first_play_items):
+            recording.start = start_of_play_item.get(first_play_item)
+
+    return recordings
+
+def read_recordings(root_camcorder, in_debug_mode=False):
+    """
+    Read the recordings of the camcorder from the AVCHD index files.
+
+    :param root_camcorder: Root folder of the camcorder (the one containing PRIVATE).
+    :return: Dictionary clip name (e.g. "00012") -> Recording, None if the index can't be read.
+    """
+    playlist_directory = os.path.join(root_camcorder, BDMV_PATH_FROM_ROOT, PLAYLIST_DIRECTORY)
+
+    try:
+        playlist_names = sorted(name for name in os.listdir(playlist_directory) if name.upper().endswith(PLAYLIST_EXTENSION))
+    except OSError:
+        if in_debug_mode:
+            print_color.purple(f"No AVCHD playlists in {playlist_directory}, the splitted videos are recognized by their size")
+        return None
+
+    recordings = {}
+    for playlist_name in playlist_names:
+        try:
+            with open(os.path.join(playlist_directory, playlist_name), 'rb') as file:
+                playlist_recordings = recordings_from_playlist(file.read())
+        except (OSError, ValueError, struct.error, UnicodeDecodeError) as e:
+            print_color.yellow(f"The AVCHD playlist {playlist_name} can't be read ({e}), the splitted videos are recognized by their size")
+            return None
+        for recording in playlist_recordings:
+            for clip_name in recording.clip_names:
+                recordings.setdefault(clip_name, recording) # a clip can be in several playlists, the first one wins
+
+    if not recordings:
+        return None
+
+    if in_debug_mode:
+        print_color.purple(f"Recordings read from the AVCHD index: {sorted(set(map(repr, recordings.values())))}")
+
+    return recordings
@@ -0,0 +1,230 @@
+"""
+Stand-in for the ffmpeg executable, used by the benchmarks.
+
+It understands the commands the program runs: the queries of the encoders, the concatenation with the concat demuxer
+(the parts are joined byte by byte) and the transcoding (every output gets a small file, the progress is written on
+stdout when asked with -progress pipe:1). The environment variable FAKE_FFMPEG_ENCODE_SPEED (bytes of input per second,
+0 for no wait) simulates the time taken by the encoders.
+
+It is also the stand-in ffprobe, for ffmpeg-python. The clips of the card are videos of FRAME_RATE frames per second with
+a keyframe every KEYFRAME_INTERVAL frames, their duration comes from their size. A transcoded output records its frames,
+its duration and its audio, following the input -ss and -t, -an and the concat demuxer with its duration lines, so the
+outputs of the segmented transcoding can be compared with the ones of a single ffmpeg process.
+"""
+import os # for the files paths and other useful stuffs
+import sys # for the arguments and the exit code
+import time # for simulating the encoding time
+import json # for the fake videos and the ffprobe output
+
+# CONSTANTS
+FLAGS_WITHOUT_VALUE = {"-y", "-n", "-hide_banner", "-nostats", "-nostdin", "-an", "-vn", "-sn", "-dn", "-copyts"}
+ENCODERS = ["libx264", "libx265"] # a machine without GPU
+COPY_BLOCK = 8 * 1024 * 1024
+PROGRESS_STEPS = 10 # blocks written on the -progress output during a transcoding
+BYTES_PER_SECOND_OF_VIDEO = 3 * 1024 * 1024 # about the bitrate of AVCHD, gives a duration to the fake videos
+FRAME_RATE = 25
+KEYFRAME_INTERVAL = 12 # frames of a group of pictures of the clips
+SOURCE_START_TIME = 1.4 # first timestamp of the clips, the MPEG-TS files of the camcorders don't start at 0
+FAKE_VIDEO_MAGIC = b"FAKEVIDEO\n" # start of the outputs, followed by their frames, duration and audio in JSON
+TIME_EPSILON = 1e-6
+
+
+# FUNCTIONS
+def install(bin_directory):
+    """Write the ffmpeg and ffprobe launchers in bin_directory, put bin_directory first in the PATH to use them."""
+    os.makedirs(bin_directory, exist_ok=True)
+    script = os.path.abspath(__file__)
+    for name, mode in (("ffmpeg", ""), ("ffprobe", " --ffprobe")):
+        if os.name == "nt":
+            launcher = os.path.join(bin_directory, f"{name}.bat")
+            with open(launcher, 'w') as file:
+                file.write(f'@"{sys.executable}" "{script}"{mode} %*\n')
+        else:
+            launcher = os.path.join(bin_directory, name)
+            with open(launcher, 'w') as file:
+                file.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}"{mode} "$@"\n')
+            os.chmod(launcher, 0o755)
+    return bin_directory
+
+def parse_arguments(arguments):
+    """Split the arguments of ffmpeg in options (name -> list of values, in order) and positional arguments (the outputs)."""
+    options = []
+    positional = []
+    index = 0
+    while index < len(arguments):
+        argument = arguments[index]
+        if argument in FLAGS_WITHOUT_VALUE:
+            options.append((argument, None))
+            index += 1
+        elif argument.startswith("-") and argument != "-" and index + 1 < len(arguments):
+            options.append((argument, arguments[index + 1]))
+            index += 2
+        else:
+            positional.append(argument)
+            index += 1
+    return options, positional
+
+def parse_command(arguments):
+    """
+    Split the arguments of ffmpeg by file.
+
+    :return: Tuple (inputs, outputs): inputs is a list of (path, dict of the options before it), outputs a list of
+             (path, list of (name, value) of the options since the previous file).
+    """
+    inputs = []
+    outputs = []
+    options = []
+    index = 0
+    while index < len(arguments):
+        argument = arguments[index]
+        if argument in FLAGS_WITHOUT_VALUE:
+            options.append((argument, None))
+            index += 1
+        elif argument.startswith("-") and argument != "-" and index + 1 < len(arguments):
+            if argument == "-i":
+                inputs.append((arguments[index + 1], dict(options)))
+                options = []
+            else:
+                options.append((argument, arguments[index + 1]))
+            index += 2
+        else:
+            outputs.append((argument, options))
+            options = []
+            index += 1
+    return inputs, outputs
+
+def read_media(path):
+    """Frames, duration, start time and audio duration (None without audio) of a fake video or of a clip of the card."""
+    with open(path, 'rb') as file:
+        if file.read(len(FAKE_VIDEO_MAGIC)) == FAKE_VIDEO_MAGIC:
+            return json.loads(file.read())
+    frames = int(os.path.getsize(path) / BYTES_PER_SECOND_OF_VIDEO * FRAME_RATE)
+    return {"frames": frames, "duration": frames / FRAME_RATE, "start_time": SOURCE_START_TIME, "audio": frames / FRAME_RATE}
+
+def write_media(path, frames, duration, audio):
+    with open(path, 'wb') as file:
+        file.write(FAKE_VIDEO_MAGIC + json.dumps({"frames": frames, "duration": duration, "start_time": 0.0, "audio": audio}).encode('utf-8'))
+
+def read_concat_list(list_path):
+    """List of (path, duration line or None) of a concat demuxer list."""
+    entries = []
+    with open(list_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if line.startswith("file "):
+                entries.append([line[len("file "):].strip("'").replace("'\\''", "'"), None])
+            elif line.startswith("duration ") and entries:
+                entries[-1][1] = float(line[len("duration "):])
+    return [tuple(entry) for entry in entries]
+
+def concat(inputs, output_path, output_options):
+    entries = read_concat_list(inputs[0][0])
+    if entries and all(_is_fake_video(path) for path, _ in entries):
+        # encoded segments: every entry lasts its duration line (its own duration for the last one), the audio comes from the second input
+        medias = [read_media(path) for path, _ in entries]
+        duration = sum(entry_duration if entry_duration is not None and index < len(entries) - 1 else media["duration"]
+                       for index, ((_, entry_duration), media) in enumerate(zip(entries, medias)))
+        maps = [value for name, value in output_options if name == "-map"]
+        audio = read_media(inputs[1][0])["audio"] if len(inputs) > 1 and any(value.startswith("1:a") for value in maps) else None
+        write_media(output_path, sum(media["frames"] for media in medias), duration, audio)
+        return
+    with open(output_path, 'wb') as output_file:
+        for path, _ in entries:
+            with open(path, 'rb') as input_file:
+                while True:
+                    block = input_file.read(COPY_BLOCK)
+                    if not block:
+                        break
+                    output_file.write(block)
+
+def _is_fake_video(path):
+    with open(path, 'rb') as file:
+        return file.read(len(FAKE_VIDEO_MAGIC)) == FAKE_VIDEO_MAGIC
+
+def transcode(inputs, outputs, progress_output=None):
+    input_path, input_options = inputs[0]
+    media = read_media(input_path)
+
+    # accurate seek: the frames before -ss are decoded and dropped, -t stops the input that many seconds after -ss
+    seek = float(input_options.get("-ss", 0))
+    limit = float(input_options["-t"]) if "-t" in input_options else None
+    frames = sum(1 for frame in range(media["frames"])
+                 if frame / FRAME_RATE >= seek - TIME_EPSILON and (limit is None or frame / FRAME_RATE < seek + limit - TIME_EPSILON))
+    duration = frames / FRAME_RATE
+
+    encode_speed = float(os.environ.get("FAKE_FFMPEG_ENCODE_SPEED", "0"))
+    input_size = os.path.getsize(input_path) * frames / max(1, media["frames"])
+    for step in range(1, PROGRESS_STEPS + 1):
+        if encode_speed > 0:
+            time.sleep(input_size / encode_speed / PROGRESS_STEPS)
+        if progress_output:
+            speed = f"{BYTES_PER_SECOND_OF_VIDEO / encode_speed:.2f}x" if encode_speed > 0 else "N/A"
+            progress_output.write(f"fps=25.0\nout_time_us={int(duration * step / PROGRESS_STEPS * 1_000_000)}\nspeed={speed}\n")
+            progress_output.write(f"progress={'end' if step == PROGRESS_STEPS else 'continue'}\n")
+            progress_output.flush()
+    for output_path, output_options in outputs:
+        option_names = [name for name, _ in output_options]
+        maps = [value for name, value in output_options if name == "-map"]
+        with_audio = media["audio"] is not None and "-an" not in option_names and (not maps or any(value.startswith("0:a") for value in maps))
+        write_media(output_path, frames, duration, duration if with_audio else None)
+
+def ffprobe(arguments):
+    """Print the JSON of ffprobe -show_format -show_streams, with the video packets when -show_entries asks for them."""
+    options, positional = parse_arguments(arguments)
+    if not positional or not os.path.exists(positional[-1]):
+        print("fake ffprobe: no such file", file=sys.stderr)
+        return 1
+    media = read_media(positional[-1])
+    result = {
+        "format": {"filename": positional[-1], "duration": f"{media['duration']:.6f}", "start_time": f"{media['start_time']:.6f}"},
+        "streams": [{"index": 0, "codec_type": "video", "nb_frames": str(media["frames"]), "start_time": f"{media['start_time']:.6f}", "duration": f"{media['duration']:.6f}"}],
+    }
+    if media["audio"] is not None:
+        result["streams"].append({"index": 1, "codec_type": "audio", "start_time": f"{media['start_time']:.6f}", "duration": f"{media['audio']:.6f}"})
+    if any(name == "-show_entries" and "packet" in value for name, value in options):
+        result["packets"] = [{"pts_time": f"{media['start_time'] + frame / FRAME_RATE:.6f}", "flags": "K_" if frame % KEYFRAME_INTERVAL == 0 else "__"}
+                             for frame in range(media["frames"])]
+    print(json.dumps(result))
+    return 0
+
+def main(arguments):
+    if arguments[:1] == ["--ffprobe"]:
+        return ffprobe(arguments[1:])
+    options, positional = parse_arguments(arguments)
+    option_names = [name for name, _ in options]
+
+    if "-encoders" in arguments:
+        print("Encoders:")
+        print(" V..... = Video")
+        for encoder in ENCODERS:
+            print(f" V....D {encoder}              fake {encoder}")
+        return 0
+    if "-hwaccels" in arguments:
+        print("Hardware acceleration methods:")
+        return 0
+
+    inputs = [value for name, value in options if name == "-i"]
+    formats = [value for name, value in options if name == "-f"]
+    encoders = [value for name, value in options if name in ("-c:v", "-vcodec")]
+
+    if "lavfi" in formats:
+        # test encode of a backend: only the software encoders work here
+        return 0 if all(encoder in ENCODERS for encoder in encoders) else 1
+    if not inputs:
+        print("fake ffmpeg: no input", file=sys.stderr)
+        return 1
+    command_inputs, command_outputs = parse_command(arguments)
+    if "concat" in formats:
+        concat(command_inputs, *command_outputs[-1])
+        return 0
+    if "-map" in option_names or encoders:
+        progress_targets = [value for name, value in options if name == "-progress"]
+        transcode(command_inputs, command_outputs, sys.stdout if "pipe:1" in progress_targets else None)
+        return 0
+
+    print(f"fake ffmpeg: unsupported command {arguments}", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,133 @@
+import os # for the files paths and other useful stuffs
+import sys # for importing the modules of the program
+import struct # for writing the AVCHD playlist
+import datetime # for the dates of the recordings
+import subprocess # for the clips encoded by ffmpeg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import avchd # for the paths of the AVCHD tree
+
+# CONSTANTS
+FIRST_RECORDING = datetime.datetime(2024, 6, 15, 10, 0, 0)
+SECONDS_BETWEEN_RECORDINGS = 600
+WRITE_BLOCK = 1024 * 1024
+SYNC_CLIP_DURATION = 10 # seconds of the clips encoded by ffmpeg
+SYNC_CLIP_FRAME_RATE = 25
+SYNC_CLIP_KEYFRAME_INTERVAL = 12 # frames of a group of pictures, like the camcorders
+SYNC_MARKS = (1.5, 3.5, 5.5, 7.5, 9.5) # seconds from the start of the clip where a white flash and a beep start together
+SYNC_MARK_LENGTH = 0.2
+
+
+# FUNCTIONS
+def _write_clip(path, size, seed):
+    """Write a clip of the given size, the content depends on the seed so every clip is different."""
+    block = (seed.to_bytes(4, 'big') * (WRITE_BLOCK // 4))
+    with open(path, 'wb') as file:
+        remaining = size
+        while remaining > 0:
+            file.write(block[:min(remaining, WRITE_BLOCK)])
+            remaining -= WRITE_BLOCK
+
+def _bcd(number, digits=2):
+    text = f"{number:0{digits}d}"
+    return bytes(int(text[index]) << 4 | int(text[index + 1]) for index in range(0, digits, 2))
+
+def playlist_bytes(recordings):
+    """
+    Build an AVCHD playlist (.MPL) with the play items of the recordings and the record time and date of their entry marks.
+
+    :param recordings: List of (clip names, start datetime).
+    """
+    play_items = b""
+    marks = [] # index of the first play item of every recording
+    number_of_play_items = 0
+    for clip_names, _ in recordings:
+        marks.append(number_of_play_items)
+        number_of_play_items += len(clip_names)
+        for index, clip_name in enumerate(clip_names):
+            connection_condition = 6 if index else 1 # the parts after the first one continue the recording
+            body = clip_name.encode('ascii') + b"M2TS" + struct.pack(">HBII", connection_condition, 0, 0, 0) + bytes(20)
+            play_items += struct.pack(">H", len(body)) + body
+    playlist = struct.pack(">IHHH", 0, 0, number_of_play_items, 0) + play_items
+    playlist_marks = struct.pack(">IH", 0, len(marks)) + b"".join(struct.pack(">BBHIHI", 0, avchd.ENTRY_MARK, play_item, 0, 0, 0) for play_item in marks)
+    # ExtensionData with a single block, the marks extension: time zone, record time and date and 8 bytes of maker data for every mark
+    marks_extension = struct.pack(">H", len(marks)) + b"".join(b"\x00" + _bcd(start.year, 4) + b"".join(_bcd(value) for value in (start.month, start.day, start.hour, start.minute, start.second)) + bytes(8) for _, start in recordings)
+    block_start = avchd.EXTENSION_HEADER_LENGTH + avchd.EXTENSION_ENTRY_LENGTH
+    extension_header = struct.pack(">II3xB", block_start + len(marks_extension) - 4, block_start, 1)
+    extension_entry = struct.pack(">HHII", *avchd.MARK_EXTENSION_IDS, block_start, len(marks_extension))
+    extension_data = extension_header + extension_entry + marks_extension
+
+    playlist_start = 40
+    marks_start = playlist_start + len(playlist)
+    extension_start = marks_start + len(playlist_marks)
+    header = avchd.PLAYLIST_TYPE_INDICATOR + b"0100" + struct.pack(">III", playlist_start, marks_start, extension_start) + bytes(20)
+    return header + playlist + playlist_marks + extension_data
+
+def make_card(root, clips=20, clip_size=8 * 1024 * 1024, split_every=5, split_parts=3, split_part_size=None, with_index=True):
+    """
+    Build a synthetic AVCHD card.
+
+    :param root: Root folder of the card (the one that will contain PRIVATE).
+    :param clips: Number of recordings.
+    :param clip_size: Size of a recording that is not splitted.
+    :param split_every: Every split_every recordings one is splitted in split_parts files (0 for none).
+    :param split_part_size: Size of the parts of a splitted recording (all but the last one), twice clip_size if None,
+                            so that a size_limit equal to clip_size recognizes them without the index.
+    :param with_index: Write the PLAYLIST index, otherwise only the sizes tell the splitted recordings.
+    :return: Dictionary with the stream directory, the list of the recordings and the total bytes.
+    """
+    bdmv = os.path.join(root, avchd.BDMV_PATH_FROM_ROOT)
+    stream_directory = os.path.join(bdmv, avchd.STREAM_DIRECTORY)
+    os.makedirs(stream_directory, exist_ok=True)
+
+    split_part_size = split_part_size or 2 * clip_size
+    recordings = []
+    clip_number = 0
+    total_bytes = 0
+    for recording_number in range(clips):
+        start = FIRST_RECORDING + datetime.timedelta(seconds=recording_number * SECONDS_BETWEEN_RECORDINGS)
+        parts = split_parts if split_every and recording_number % split_every == split_every - 1 else 1
+        clip_names = []
+        for part in range(parts):
+            clip_name = f"{clip_number:05d}"
+            path = os.path.join(stream_directory, clip_name + avchd.STREAM_EXTENSION)
+            size = split_part_size if part < parts - 1 else clip_size // 2 if parts > 1 else clip_size
+            _write_clip(path, size, clip_number)
+            mtime = (start + datetime.timedelta(seconds=part * 60)).timestamp()
+            os.utime(path, (mtime, mtime))
+            clip_names.append(clip_name)
+            clip_number += 1
+            total_bytes += size
+        recordings.append((clip_names, start))
+
+    if with_index:
+        playlist_directory = os.path.join(bdmv, avchd.PLAYLIST_DIRECTORY)
+        os.makedirs(playlist_directory, exist_ok=True)
+        with open(os.path.join(playlist_directory, "00000" + avchd.PLAYLIST_EXTENSION), 'wb') as file:
+            file.write(playlist_bytes(recordings))
+
+    return {"stream_directory": stream_directory, "recordings": recordings, "total_bytes": total_bytes, "files": clip_number}
+
+def make_sync_clip(path, audio_lead):
+    """
+    Encode with ffmpeg an MPEG-TS clip like the ones of the camcorders (H.264 and AC-3), black and silent but for a white
+    flash and a beep at the same time at every one of SYNC_MARKS.
+
+    :param audio_lead: Seconds the audio starts before the video, negative when the video starts first.
+    """
+    video_delay = max(0.0, audio_lead)
+    audio_delay = max(0.0, -audio_lead)
+    # the marks are in the time of the clip, every stream counts from its own start
+    flashes = "+".join(f"between(t,{mark - video_delay:.3f},{mark + SYNC_MARK_LENGTH - video_delay - 0.001:.3f})" for mark in SYNC_MARKS)
+    beeps = "+".join(f"between(t,{mark - audio_delay:.3f},{mark + SYNC_MARK_LENGTH - audio_delay:.3f})" for mark in SYNC_MARKS)
+    command = [
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-itsoffset', f"{video_delay:.3f}", '-f', 'lavfi',
+        '-i', f"color=black:size=320x240:rate={SYNC_CLIP_FRAME_RATE}:duration={SYNC_CLIP_DURATION},drawbox=color=white:t=fill:enable='{flashes}'",
+        '-itsoffset', f"{audio_delay:.3f}", '-f', 'lavfi',
+        '-i', f"aevalsrc='0.5*sin(2*PI*1000*t)*({beeps})':s=48000:d={SYNC_CLIP_DURATION}",
+        '-map', '0:v', '-map', '1:a',
+        '-c:v', 'libx264', '-g', str(SYNC_CLIP_KEYFRAME_INTERVAL), '-bf', '2', '-c:a', 'ac3',
+        '-f', 'mpegts', path,
+    ]
+    subprocess.run(command, check=True)
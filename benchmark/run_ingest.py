@@ -0,0 +1,376 @@
+"""
+Ingest benchmark: builds a synthetic AVCHD card and measures every stage of the transfer.
+
+The stages are measured one by one (scan, fingerprint, copy, verify, concat, rename), then the whole transfer and the
+transcoding run end to end with the stand-in ffmpeg of fake_ffmpeg.py. The longest clip is also transcoded in a single
+ffmpeg process and in segments: the joined outputs must have the same frames, end at the same time and keep the audio.
+The stand-in only models the frames, so with --real-ffmpeg the same comparison also runs with the ffmpeg and ffprobe of
+the PATH, on clips encoded by ffmpeg whose audio starts before or after the video: their flashes must stay with their beeps.
+The results are saved as JSON in the results folder and compared with the last run with the same parameters: a throughput
+drop bigger than the tolerance is a regression.
+
+Usage: python benchmark/run_ingest.py [--clips 20] [--clip-size-mb 8] [--split-every 5] [--split-parts 3] [--no-index] [--real-ffmpeg]
+
+The card is on the same disk as the destination and its files are in the page cache after being written,
+so the numbers measure the program and not a card reader: compare runs made on the same machine.
+"""
+import os # for the files paths and other useful stuffs
+import re # for the flashes and beeps found by ffmpeg
+import sys # for importing the modules of the program and the exit code
+import time # for measuring the stages
+import json # for the results
+import copy # for the preferences of the benchmark
+import shutil # for cleaning the working folder
+import tempfile # for the working folder
+import subprocess # for the filters of the real ffmpeg
+import argparse # for the command line
+import platform # for describing the machine in the results
+import datetime # for the name of the results
+import ffmpeg # for reading the frames and the duration of the transcoded videos
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIRECTORY))
+
+import fixtures # for the synthetic card
+import fake_ffmpeg # for the stand-in ffmpeg
+import print_color # for the colored prints
+import preferences # for the default preferences
+import ledger # for the copied files ledger of the stages
+import file_copy # for the copy and verify stages
+import video # for the stages of the transfer
+import camcorder # for the end to end transfer
+import encoders # for the backend of the segmented transcoding
+
+# CONSTANTS
+RESULTS_DIRECTORY = os.path.join(BENCHMARK_DIRECTORY, "results")
+DEFAULT_TOLERANCE = 0.10 # a throughput 10% lower than the last run is a regression
+SEGMENT_DURATION = 1 # seconds of the segments of the segmented transcoding, the clips of the card last a few seconds
+REAL_SEGMENT_DURATION = 2 # seconds of the segments of the clips encoded by the real ffmpeg
+SYNC_CLIP_AUDIO_LEAD = 0.2 # seconds between the start of the audio and the one of the video in the clips encoded by the real ffmpeg
+MB = 1024 * 1024
+
+
+# FUNCTIONS
+def measure(name, items, function, bytes_of=None):
+    """Run function on every item, return the statistics of the stage."""
+    latencies = []
+    total_bytes = 0
+    start = time.perf_counter()
+    for item in items:
+        item_start = time.perf_counter()
+        function(item)
+        latencies.append(time.perf_counter() - item_start)
+        if bytes_of:
+            total_bytes += bytes_of(item)
+    seconds = time.perf_counter() - start
+    return stage_result(name, seconds, len(latencies), total_bytes, latencies)
+
+def stage_result(name, seconds, files, total_bytes, latencies=None):
+    latencies = latencies or []
+    return {
+        "stage": name,
+        "seconds": seconds,
+        "files": files,
+        "bytes": total_bytes,
+        "MB_per_s": total_bytes / MB / seconds if seconds and total_bytes else None,
+        "files_per_s": files / seconds if seconds and files else None,
+        "latency_mean_ms": 1000 * sum(latencies) / len(latencies) if latencies else None,
+        "latency_max_ms": 1000 * max(latencies) if latencies else None,
+    }
+
+def benchmark_preferences(card_root, destination, size_limit, use_index):
+    session_preferences = copy.deepcopy(preferences.DEFAULT_PREFERENCES)
+    session_preferences.update(root_camcorder=card_root, destination_folder=destination, size_limit=size_limit, use_avchd_index=use_index, in_debug_mode=False)
+    return session_preferences
+
+def run_stages(card, work_directory):
+    """Measure the stages of the transfer one by one."""
+    stream_directory = card["stream_directory"]
+    destination = os.path.join(work_directory, "stages")
+    os.makedirs(destination)
+    stages = []
+
+    start = time.perf_counter()
+    video_files = video.files_in(stream_directory, camcorder.EXTENSION)
+    stages.append(stage_result("scan", time.perf_counter() - start, len(video_files), 0))
+
+    sizes = {video_path: os.path.getsize(video_path) for video_path in video_files}
+    hashes = {}
+    stages.append(measure("fingerprint", video_files, lambda video_path: hashes.__setitem__(video_path, video.calculate_file_hash(video_path))))
+    stages.append(measure("fingerprint_sampled", video_files, lambda video_path: video.calculate_sampled_hash(video_path, sizes[video_path])))
+
+    copied = {video_path: os.path.join(destination, os.path.basename(video_path)) for video_path in video_files}
+    stages.append(measure("copy", video_files, lambda video_path: file_copy.stream_copy(video_path, copied[video_path]), sizes.get))
+    stages.append(measure("verify", video_files, lambda video_path: file_copy.file_digest(copied[video_path]), sizes.get))
+
+    # the copy of the transfers without secure mode: no digest, the kernel copies the files
+    kernel_directory = os.path.join(work_directory, "copy_kernel")
+    os.makedirs(kernel_directory)
+    stages.append(measure("copy_kernel", video_files, lambda video_path: file_copy.stream_copy(video_path, os.path.join(kernel_directory, os.path.basename(video_path)), with_digest=False), sizes.get))
+
+    # the recordings made of several clips are concatenated, the others renamed
+    clip_paths = {os.path.splitext(os.path.basename(video_path))[0]: video_path for video_path in video_files}
+    groups = [[clip_paths[clip_name] for clip_name in clip_names] for clip_names, _ in card["recordings"] if len(clip_names) > 1]
+    singles = [clip_paths[clip_names[0]] for clip_names, _ in card["recordings"] if len(clip_names) == 1]
+
+    concat_directory = os.path.join(work_directory, "concat")
+    with ledger.CopiedFilesLedger(concat_directory) as concat_ledger:
+        stages.append(measure("concat", groups, lambda group: video.concat(group, concat_directory, [hashes[video_path] for video_path in group], concat_ledger), lambda group: sum(sizes[video_path] for video_path in group)))
+    stages.append(measure("rename", singles, lambda video_path: video.rename_copied_file(os.path.basename(video_path), destination, in_debug_mode=False)))
+
+    return stages
+
+def run_end_to_end(card_root, work_directory, size_limit, use_index, total_bytes, files):
+    """Run the whole transfer and the transcoding of its videos."""
+    destination = os.path.join(work_directory, "end_to_end")
+    session_preferences = benchmark_preferences(card_root, destination, size_limit, use_index)
+
+    start = time.perf_counter()
+    transferred_videos = camcorder.start_transfer(session_preferences=session_preferences)
+    transfer_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    video.transcode_list_of_videos(transferred_videos, session_preferences, in_debug_mode=False)
+    transcode_seconds = time.perf_counter() - start
+
+    return [
+        stage_result("transfer", transfer_seconds, files, total_bytes),
+        stage_result("transcode", transcode_seconds, len(transferred_videos), sum(os.path.getsize(path) for path in transferred_videos)),
+    ]
+
+def media_summary(video_path):
+    """Frames, start and end of the video of a file and start and end of its audio (None without audio), read with ffprobe."""
+    probe = ffmpeg.probe(video_path)
+    video_stream = next(stream for stream in probe["streams"] if stream["codec_type"] == "video")
+    audio_stream = next((stream for stream in probe["streams"] if stream["codec_type"] == "audio"), None)
+    video_start = float(video_stream.get("start_time") or 0)
+    summary = {"frames": int(video_stream["nb_frames"]), "video_start": video_start, "video_end": video_start + float(video_stream["duration"]),
+               "audio_start": None, "audio_end": None}
+    if audio_stream:
+        summary["audio_start"] = float(audio_stream.get("start_time") or 0)
+        summary["audio_end"] = summary["audio_start"] + float(audio_stream["duration"])
+    return summary
+
+def sync_offsets(video_path):
+    """Seconds between every white flash of a clip of fixtures.make_sync_clip and its beep, found by the filters of ffmpeg."""
+    command = ['ffmpeg', '-hide_banner', '-nostats', '-i', video_path, '-vf', 'blackdetect=d=0.03:pix_th=0.5', '-af', 'silencedetect=n=-30dB:d=0.05', '-f', 'null', '-']
+    log = subprocess.run(command, capture_output=True, text=True).stderr
+    # the end of a black part is a flash and the end of a silence a beep, the last ones are the end of the streams
+    flashes = [float(time) for time in re.findall(r"black_end:\s*([\d.]+)", log)][:len(fixtures.SYNC_MARKS)]
+    beeps = [float(time) for time in re.findall(r"silence_end:\s*([\d.]+)", log)][:len(fixtures.SYNC_MARKS)]
+    return [flash - beep for flash, beep in zip(flashes, beeps)]
+
+def compare_outputs(single_path, segmented_path, with_sync_marks=False):
+    """
+    Differences between the output of a single ffmpeg process and the one of the segmented transcoding.
+
+    The segmented output must have the same frames (none missing or repeated at the cuts), end at the same time and keep
+    the audio of the source. A single process can fill the time before a late first frame with copies of it, so the frames
+    are compared from the start of the segmented video.
+
+    :param with_sync_marks: The source is a clip of fixtures.make_sync_clip, its flashes must stay with their beeps.
+    """
+    output_name = os.path.basename(segmented_path)
+    if not os.path.exists(single_path) or not os.path.exists(segmented_path):
+        return [f"{output_name}: not transcoded"]
+    single = media_summary(single_path)
+    segmented = media_summary(segmented_path)
+    frame_duration = (single["video_end"] - single["video_start"]) / single["frames"] if single["frames"] else 0
+
+    differences = []
+    filled_frames = round((segmented["video_start"] - single["video_start"]) / frame_duration) if frame_duration else 0
+    if segmented["frames"] != single["frames"] - filled_frames:
+        differences.append(f"{output_name}: {segmented['frames']} frames in segments from {segmented['video_start']:.3f} s, {single['frames']} in a single process from {single['video_start']:.3f} s")
+    if abs(segmented["video_end"] - single["video_end"]) > frame_duration / 2:
+        differences.append(f"{output_name}: the video ends at {segmented['video_end']:.3f} s in segments, {single['video_end']:.3f} s in a single process")
+    for bound in ("audio_start", "audio_end"):
+        if segmented[bound] is None or single[bound] is None or abs(segmented[bound] - single[bound]) > frame_duration / 2:
+            differences.append(f"{output_name}: {bound.replace('_', ' ')} at {segmented[bound]} s in segments, {single[bound]} s in a single process")
+    if with_sync_marks:
+        single_offsets = sync_offsets(single_path)
+        offsets = sync_offsets(segmented_path)
+        if len(offsets) != len(fixtures.SYNC_MARKS) or len(single_offsets) != len(fixtures.SYNC_MARKS) \
+                or any(abs(offset - single_offset) > frame_duration / 2 for offset, single_offset in zip(offsets, single_offsets)):
+            differences.append(f"{output_name}: flashes {', '.join(f'{offset:+.3f}' for offset in offsets)} s from their beeps in segments, "
+                               f"{', '.join(f'{offset:+.3f}' for offset in single_offsets)} s in a single process")
+    return differences
+
+def transcode_single_and_segmented(source, segment_duration):
+    """
+    Transcode a video in a single ffmpeg process, then in segments, next to it.
+
+    :return: Tuple (stage results, list of (single process output, segmented output)).
+    """
+    backend = encoders.select_backend()
+    segment_options = dict(preferences.DEFAULT_PREFERENCES["segment_transcode"], enabled=True, min_duration=0, segment_duration=segment_duration)
+    stages = []
+    outputs = {}
+    for name, options in (("transcode_single", None), ("transcode_segmented", segment_options)):
+        output_directory = os.path.join(os.path.dirname(source), name)
+        os.makedirs(output_directory)
+        outputs[name] = [video.H264_fixed_output(source, output_directory, "4M", backend), video.H265_CRF_output(source, output_directory, 23, backend)]
+        start = time.perf_counter()
+        video.transcode_multi_output(source, outputs[name], in_debug_mode=False, backend=backend, segment_options=options)
+        stages.append(stage_result(name, time.perf_counter() - start, 1, os.path.getsize(source)))
+    return stages, [(single_path, segmented_path) for (single_path, _), (segmented_path, _) in zip(outputs["transcode_single"], outputs["transcode_segmented"])]
+
+def run_segmented(card, work_directory):
+    """
+    Transcode the longest clip in a single ffmpeg process, then in segments, and compare the outputs.
+
+    :return: Tuple (stage results, list of the differences between the outputs).
+    """
+    source_directory = os.path.join(work_directory, "segmented")
+    os.makedirs(source_directory)
+    longest_clip = max(video.files_in(card["stream_directory"], camcorder.EXTENSION), key=os.path.getsize)
+    source = os.path.join(source_directory, os.path.basename(longest_clip))
+    shutil.copyfile(longest_clip, source)
+
+    stages, output_pairs = transcode_single_and_segmented(source, SEGMENT_DURATION)
+    differences = []
+    for single_path, segmented_path in output_pairs:
+        differences += compare_outputs(single_path, segmented_path)
+    return stages, differences
+
+def run_segmented_real(work_directory):
+    """
+    Compare the segmented transcoding with a single ffmpeg process using the ffmpeg and ffprobe of the PATH, on clips
+    encoded by ffmpeg whose audio starts before and after the video.
+
+    :return: List of the differences between the outputs.
+    """
+    if not shutil.which("ffmpeg") or not shutil.which("ffprobe"):
+        return ["ffmpeg and ffprobe are not in the PATH"]
+    differences = []
+    for name, audio_lead in (("audio_first", SYNC_CLIP_AUDIO_LEAD), ("video_first", -SYNC_CLIP_AUDIO_LEAD)):
+        source_directory = os.path.join(work_directory, "segmented_real", name)
+        os.makedirs(source_directory)
+        source = os.path.join(source_directory, f"{name}{camcorder.EXTENSION}")
+        fixtures.make_sync_clip(source, audio_lead)
+        _, output_pairs = transcode_single_and_segmented(source, REAL_SEGMENT_DURATION)
+        for single_path, segmented_path in output_pairs:
+            differences += [f"{name}: {difference}" for difference in compare_outputs(single_path, segmented_path, with_sync_marks=True)]
+
+    # the stand-in ffmpeg has other encoders, the ones of the real ffmpeg must be probed again
+    for probe in (encoders.available_encoders, encoders.available_hwaccels, encoders.encoder_works, encoders.backend_available):
+        probe.cache_clear()
+    return differences
+
+def last_result(parameters):
+    """The most recent saved result with the same parameters, None if there isn't one."""
+    if not os.path.isdir(RESULTS_DIRECTORY):
+        return None
+    for name in sorted(os.listdir(RESULTS_DIRECTORY), reverse=True):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(RESULTS_DIRECTORY, name), 'r') as file:
+            result = json.load(file)
+        if result.get("parameters") == parameters:
+            return result
+    return None
+
+def compare(current, previous, tolerance):
+    """Print the stages against the previous run, return the list of the stages that regressed."""
+    previous_stages = {stage["stage"]: stage for stage in previous["stages"]} if previous else {}
+    regressions = []
+    for stage in current["stages"]:
+        line = f"{stage['stage']:<12} {stage['seconds']:8.3f} s"
+        if stage["MB_per_s"]:
+            line += f" {stage['MB_per_s']:10.1f} MB/s"
+        if stage["files_per_s"]:
+            line += f" {stage['files_per_s']:10.1f} files/s"
+        if stage["latency_mean_ms"] is not None:
+            line += f"   latency mean {stage['latency_mean_ms']:.2f} ms, max {stage['latency_max_ms']:.2f} ms"
+
+        before = previous_stages.get(stage["stage"])
+        metric = "MB_per_s" if stage["MB_per_s"] else "files_per_s"
+        if before and before.get(metric) and stage.get(metric):
+            change = stage[metric] / before[metric] - 1
+            line += f"   {change:+.1%} vs {previous['date']}"
+            if change < -tolerance:
+                regressions.append(stage["stage"])
+                print_color.red(line)
+                continue
+        print(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest benchmark on a synthetic AVCHD card.")
+    parser.add_argument("--clips", type=int, default=20, help="number of recordings on the card")
+    parser.add_argument("--clip-size-mb", type=float, default=8, help="size of a recording that is not splitted")
+    parser.add_argument("--split-every", type=int, default=5, help="one recording every N is splitted (0 for none)")
+    parser.add_argument("--split-parts", type=int, default=3, help="files of a splitted recording")
+    parser.add_argument("--no-index", action="store_true", help="don't write the AVCHD playlist, splitted recordings are recognized by size")
+    parser.add_argument("--encode-speed-mb", type=float, default=0, help="simulated encoding speed of the stand-in ffmpeg in MB/s (0 for instant)")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="throughput drop reported as a regression")
+    parser.add_argument("--work-dir", help="folder for the card and the destinations (a temporary folder by default)")
+    parser.add_argument("--keep", action="store_true", help="keep the working folder")
+    parser.add_argument("--no-save", action="store_true", help="don't save the results")
+    parser.add_argument("--real-ffmpeg", action="store_true", help="also compare the segmented transcoding with a single process using the ffmpeg and ffprobe of the PATH")
+    arguments = parser.parse_args()
+
+    clip_size = int(arguments.clip_size_mb * MB)
+    parameters = {
+        "clips": arguments.clips,
+        "clip_size": clip_size,
+        "split_every": arguments.split_every,
+        "split_parts": arguments.split_parts,
+        "with_index": not arguments.no_index,
+        "encode_speed_mb": arguments.encode_speed_mb,
+    }
+
+    work_directory = arguments.work_dir or tempfile.mkdtemp(prefix="camcorder_benchmark_")
+    os.makedirs(work_directory, exist_ok=True)
+
+    segment_differences = []
+    try:
+        if arguments.real_ffmpeg:
+            print("Comparing the segmented transcoding with a single process, with the real ffmpeg...")
+            segment_differences += run_segmented_real(work_directory)
+
+        # the stand-in ffmpeg goes first in the PATH, for ffmpeg-python and for the transcoding
+        os.environ["PATH"] = fake_ffmpeg.install(os.path.join(work_directory, "bin")) + os.pathsep + os.environ.get("PATH", "")
+        os.environ["FAKE_FFMPEG_ENCODE_SPEED"] = str(arguments.encode_speed_mb * MB)
+
+        card_root = os.path.join(work_directory, "card")
+        print("Building the synthetic card...")
+        card = fixtures.make_card(card_root, arguments.clips, clip_size, arguments.split_every, arguments.split_parts, with_index=not arguments.no_index)
+        print(f"{card['files']} files, {card['total_bytes'] / MB:.1f} MB")
+
+        stages = run_stages(card, work_directory)
+        stages += run_end_to_end(card_root, work_directory, clip_size, not arguments.no_index, card["total_bytes"], card["files"])
+        segmented_stages, differences = run_segmented(card, work_directory)
+        stages += segmented_stages
+        segment_differences += differences
+    finally:
+        if not arguments.keep:
+            shutil.rmtree(work_directory, ignore_errors=True)
+
+    result = {
+        "date": datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S'),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "parameters": parameters,
+        "stages": stages,
+    }
+
+    print()
+    regressions = compare(result, last_result(parameters), arguments.tolerance)
+
+    if not arguments.no_save:
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        result_path = os.path.join(RESULTS_DIRECTORY, f"ingest_{result['date']}.json")
+        with open(result_path, 'w') as file:
+            json.dump(result, file, indent=4)
+        print(f"Results saved to {result_path}")
+
+    for difference in segment_differences:
+        print_color.red(f"Segmented transcoding differs from the single process: {difference}")
+    if regressions:
+        print_color.red(f"Throughput regression in: {', '.join(regressions)}")
+    if regressions or segment_differences:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
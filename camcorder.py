@@ -2,6 +2,21 @@ import os # for the files paths and other useful stuffs
 import print_color # for the colored prints
 import video # for the functions calculate_file_hash, files_in and copy_file
 import preferences # for the functions load_preferences, save_preferences, validate_preferences and preferences_routine
+import ledger # for the index of the copied files
+import threading # for the scan thread and the locks shared by the copy workers
+import queue # for passing the scanned files to the copy stage
+import concurrent.futures # for the pool of copy workers
+import avchd # for the recordings in the AVCHD index files
+import metrics # for the timing of the stages
+import contextlib # for running without metrics
+import time # for the time the copies wait for the device slots
+import card_scan # for the single pass scan of the card
+import file_copy # for the size of the samples of the sampled fingerprint and the copy methods
+import progress # for the progress of the transfer in bytes
+import hashlib # for the staging prefix of the cards
+import datetime # for the recording dates written in the journal
+import journal # for the recovery of the transfers interrupted by a crash
+import catalog # for the names of the videos in the destination folder
 
 # CONSTANTS
 # Calculate the path of the videos on the camcorder
@@ -12,106 +27,410 @@ VIDEO_PATH_FROM_ROOT = os.path.join("PRIVATE", "AVCHD", "BDMV", "STREAM")
 
 EXTENSION = ".MTS"
 
+SCAN_AHEAD = 64 # maximum number of files hashed but not yet handed to the copy stage
 
 
 
-# FUNCTIONS
-def to_integer_for_progressbar(current_video, total_videos, min_value=0, max_value=100):
-    return min_value + int((max_value - min_value) * current_video / total_videos)
-
-
-def start_transfer(update_progress=None):
-
-    transferred_videos = [] # list of the videos that have been transferred
-
-    global to_be_concatenated
-    to_be_concatenated = []
-    global hash_to_be_concatenated
-    hash_to_be_concatenated = []
-
-    global current_preferences
-    current_preferences = preferences.preferences_routine() # load the preferences in the global variable and ask the user for the root camcorder path if it is not set
-
-    global COPIED_FILES_LOG
-    COPIED_FILES_LOG = os.path.join(current_preferences["destination_folder"], "copied_files.txt")
-
 
-    # Iterate over all files in the directory
-    video_files = video.files_in(os.path.join(current_preferences["root_camcorder"], VIDEO_PATH_FROM_ROOT), EXTENSION)
-
-    print (f"Found {len(video_files)} video files:")
-    for video_path in video_files:
-        print(os.path.basename(video_path))
-
-    # calculate the ash of every file and copy the ones that haven't been copied yet
-    print("Calculating the hash of the files...")
+# FUNCTIONS
+failed_videos = [] # files of the camcorder that couldn't be copied or concatenated by the last start_transfer
+
+
+def _scan_ahead(scanned_files, scanned_queue, fingerprint_mode):
+    """Calculate the hash of the files in order, ahead of the copy stage, and the legacy size and date hash in the sampled mode."""
+    try:
+        for scanned_file in scanned_files:
+            with metrics.stage("fingerprint", scanned_file.name, min(scanned_file.size, 3 * file_copy.SAMPLE_SIZE) if fingerprint_mode == video.FINGERPRINT_SAMPLED else 0):
+                hash_file = video.calculate_fingerprint(scanned_file.path, fingerprint_mode, scanned_file.size, scanned_file.mtime)
+            legacy_hash = video.calculate_file_hash(scanned_file.path, scanned_file.size, scanned_file.mtime) if fingerprint_mode != video.FINGERPRINT_METADATA else None
+            scanned_queue.put((scanned_file, hash_file, legacy_hash))
+    except Exception as e:
+        scanned_queue.put(e)
+    finally:
+        scanned_queue.put(None) # end of the scan
+
+
+def staging_prefix_of(root_camcorder):
+    """Prefix of the files of a camcorder while they are copied, the same card always gets the same one so its copies can be resumed."""
+    return "." + hashlib.blake2b(card_scan.device_key(root_camcorder).encode('utf-8'), digest_size=4).hexdigest() + "_"
+
+
+class TransferSession:
+    """
+    Transfer of the videos of one camcorder (one source root) to the destination folder.
+
+    All the state of the transfer lives in the session, so several sessions can run at the same time in the same process,
+    one per card. Every session limits the concurrent reads of its card with its own slots, the sessions writing to the same
+    destination share the copied files ledger (and the destination slots and catalog, if given) so a clip is recognized whatever card it was copied from.
+    The files are copied under a name prefixed for the card, so two cards with the same clip names never write the same file.
+    The copies and the concatenations are written in a journal of the card, the steps interrupted by a crash are finished
+    or undone at the start of the next transfer of the card.
+    """
+
+    def __init__(self, session_preferences, copied_files_ledger=None, destination_slots=None, destination_catalog=None):
+        """
+        :param session_preferences: Preferences of the transfer, root_camcorder is the source of this session.
+        :param copied_files_ledger: Ledger shared with the other sessions, None to open one for this session only.
+        :param destination_slots: Semaphore shared by the sessions writing the same destination, None for slots of this session only.
+        :param destination_catalog: Catalog of the destination shared with the other sessions, None to open one for this session only.
+        """
+        self.preferences = session_preferences
+        self.root_camcorder = session_preferences["root_camcorder"]
+        self.destination_folder = session_preferences["destination_folder"]
+        self.in_debug_mode = session_preferences["in_debug_mode"]
+
+        self.copied_files_ledger = copied_files_ledger
+        self._owns_ledger = copied_files_ledger is None
+        self.destination_catalog = destination_catalog
+        self._owns_catalog = destination_catalog is None
+        self.source_slots = threading.BoundedSemaphore(session_preferences["source_io_workers"])
+        self.destination_slots = destination_slots or threading.BoundedSemaphore(session_preferences["destination_io_workers"])
+        self.staging_prefix = staging_prefix_of(self.root_camcorder)
+        self.journal = journal.SessionJournal(self.destination_folder, self.staging_prefix, self.in_debug_mode)
+
+        # how the files are copied, the same for all the files of the card
+        copy_method = session_preferences["copy_method"]
+        if copy_method not in file_copy.COPY_METHODS:
+            print_color.red(f"Unknown copy method '{copy_method}', choosing one automatically.")
+            copy_method = file_copy.COPY_AUTO
+        self.copy_options = {
+            "copy_method": copy_method,
+            "chunk_size": session_preferences["copy_chunk_size"],
+            "readahead": session_preferences["copy_readahead"],
+            "drop_cache": session_preferences["copy_drop_cache"],
+        }
+
+        self.transferred_videos = [] # videos in the destination folder, in the order of the files on the camcorder
+        self.failed_videos = [] # files of the camcorder that couldn't be copied or concatenated
+
+        self.to_be_concatenated = [] # parts of the splitted video being collected
+        self.hash_to_be_concatenated = []
+        self.bytes_to_be_concatenated = 0
+        self.pending_recording = None # recording of the files in to_be_concatenated, when the AVCHD index is used
+
+    def run(self, update_progress=None, on_video_transferred=None):
+        """
+        Transfer the videos of the camcorder not transferred yet.
+
+        :param update_progress: Called with the percentage of the bytes to copy already copied, and the keyword arguments
+                                throughput (bytes per second of the last seconds) and eta (seconds left), None if unknown.
+        :param on_video_transferred: Called with the path of every video as soon as it is in the destination folder.
+        :return: List of the transferred videos, in the order of the files on the camcorder.
+        """
+        with metrics.stage("transfer", self.root_camcorder) as transfer_record:
+            if self._owns_ledger:
+                self.copied_files_ledger = ledger.CopiedFilesLedger(self.destination_folder, in_debug_mode=self.in_debug_mode) # loaded once, every lookup is an exact match
+            if self._owns_catalog:
+                self.destination_catalog = catalog.DestinationCatalog(self.destination_folder, self.in_debug_mode) # the folder is listed once, the names are given in memory
+            try:
+                self._recover(on_video_transferred)
+                self._transfer_videos(update_progress, on_video_transferred)
+            finally:
+                # write the keys still buffered in the ledger
+                if self._owns_ledger:
+                    self.copied_files_ledger.close()
+                else:
+                    self.copied_files_ledger.flush()
+                if self._owns_catalog:
+                    self.destination_catalog.close()
+                self.journal.close()
+            # every operation is finished and in the ledger, the journal is kept only if the transfer stopped with an error
+            self.journal.clear()
+            transfer_record.bytes_moved = sum(os.path.getsize(transferred_video) for transferred_video in self.transferred_videos)
+
+        if self.in_debug_mode:
+            print_color.purple(f"Transferred videos: {self.transferred_videos}")
+        return self.transferred_videos
+
+    # -- internal helpers --
+    def _recover(self, on_video_transferred):
+        """Finish or undo the operations of the last transfer of the card interrupted by a crash, as written in its journal."""
+        operations = self.journal.operations()
+        recovered_videos = []
+        for operation in operations:
+            steps = operation["steps"]
+            hashes = operation["hashes"]
+            if journal.STEP_DONE in steps:
+                # the video has its final name, only the ledger may have missed its keys
+                self.copied_files_ledger.add_many(hashes)
+            elif operation["step"] == journal.STEP_COPY:
+                staging_path = os.path.join(self.destination_folder, operation["staging"])
+                # the key is added to the ledger only after the copy has been verified
+                if journal.STEP_COPIED in steps or any(hash_file in self.copied_files_ledger for hash_file in hashes):
+                    if os.path.exists(staging_path):
+                        recording_date = datetime.datetime.fromisoformat(operation["recording_date"]) if operation["recording_date"] else None
+                        recovered_videos.append(video.rename_copied_file(operation["staging"], self.destination_folder, self.in_debug_mode, recording_date=recording_date, destination_catalog=self.destination_catalog, fingerprints=hashes))
+                    self.copied_files_ledger.add_many(hashes)
+                elif os.path.exists(staging_path):
+                    os.remove(staging_path) # not verified, copied again (the interrupted copies resume from their checkpoint)
+            elif operation["step"] == journal.STEP_CONCAT:
+                partial_path = os.path.join(self.destination_folder, operation["partial"])
+                if journal.STEP_CONCATENATED in steps:
+                    if os.path.exists(partial_path):
+                        recovered_videos.append(video.publish_concatenated(partial_path, self.destination_folder, operation["output"], self.destination_catalog, hashes))
+                    self.copied_files_ledger.add_many(hashes)
+                elif os.path.exists(partial_path):
+                    os.remove(partial_path) # ffmpeg didn't finish, concatenated again
+        if not operations:
+            return
+
+        # the recovered state is saved before the journal is started again
+        self.copied_files_ledger.flush()
+        self.journal.clear()
+        print_color.yellow(f"The last transfer of {self.root_camcorder} was interrupted, {len(recovered_videos)} videos recovered from its journal.")
+        for recovered_video in recovered_videos:
+            self.transferred_videos.append(recovered_video)
+            if on_video_transferred:
+                on_video_transferred(recovered_video)
+
+    def _transfer_videos(self, update_progress, on_video_transferred):
+        copied_files_ledger = self.copied_files_ledger
+
+        # Read the recordings from the AVCHD index (which clips are parts of the same recording and when it started)
+        recordings = avchd.read_recordings(self.root_camcorder, self.in_debug_mode) if self.preferences["use_avchd_index"] else None
+
+        # Iterate over all files in the directory (a single pass, with their size and modification time)
+        scanned_files = card_scan.scan_directory(os.path.join(self.root_camcorder, VIDEO_PATH_FROM_ROOT), EXTENSION)
+
+        print (f"Found {len(scanned_files)} video files:")
+        for scanned_file in scanned_files:
+            print(scanned_file.name)
+
+        # calculate the ash of every file and copy the ones that haven't been copied yet
+        print("Calculating the hash of the files...")
+
+        # the scan runs in its own thread and stays ahead of the copies, the copies run in a pool limited by the device slots
+        scanned_queue = queue.Queue(maxsize=SCAN_AHEAD)
+        scan_thread = threading.Thread(target=_scan_ahead, args=(scanned_files, scanned_queue, self.preferences["fingerprint_mode"]), daemon=True)
+        scan_thread.start()
+
+        max_workers = max(self.preferences["source_io_workers"], self.preferences["destination_io_workers"])
+
+        jobs = [] # futures of the copies and the concatenations, in the order of the files on the camcorder
+        job_sources = [] # files of the camcorder of every job
+
+        # the progress counts the bytes copied, against the bytes of the files that may need to be copied
+        def report_progress(transfer_progress):
+            if update_progress:
+                update_progress(transfer_progress.percentage, throughput=transfer_progress.throughput, eta=transfer_progress.eta)
+        transfer_progress = progress.TransferProgress(sum(scanned_file.size for scanned_file in scanned_files), report_progress)
+
+        def video_ready(job):
+            # hand the video to the next stage (e.g. the transcoding) as soon as it is in the destination folder
+            if not job.cancelled() and job.exception() is None and job.result():
+                on_video_transferred(job.result())
+
+        def submit(function, *arguments, sources):
+            job = executor.submit(function, *arguments, time.perf_counter(), transfer_progress)
+            if on_video_transferred:
+                job.add_done_callback(video_ready)
+            jobs.append(job)
+            job_sources.append(sources)
+
+        def submit_concat():
+            recording_date = self.pending_recording.start if self.pending_recording else None
+            submit(self._concat_group, self.to_be_concatenated, self.bytes_to_be_concatenated, self.hash_to_be_concatenated, recording_date, sources=self.to_be_concatenated)
+
+            self.to_be_concatenated = [] # reset the list of files to be concatenated
+            self.hash_to_be_concatenated = [] # reset the list of hash of the files to be concatenated
+            self.bytes_to_be_concatenated = 0
+            self.pending_recording = None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                scanned = scanned_queue.get()
+                if scanned is None:
+                    break
+                if isinstance(scanned, Exception):
+                    raise scanned
+                scanned_file, hash_file, legacy_hash = scanned
+                video_path, file_size = scanned_file.path, scanned_file.size
+
+                if self.in_debug_mode:
+                    print_color.purple(f"The SHA-256 hash of the file {os.path.basename(video_path)} is: {hash_file}")
+                # a file copied before the change of fingerprint mode is in the log with its size and modification date:
+                # its new key is added, so it is recognized even if its modification date changes later
+                if legacy_hash is not None and hash_file not in copied_files_ledger and legacy_hash in copied_files_ledger:
+                    copied_files_ledger.add(hash_file)
+
+                # check if the file has already been copied (looking in the copied files ledger)
+                if hash_file in copied_files_ledger:
+                    print_color.green(f"The file {os.path.basename(video_path)} has already been copied")
+                    transfer_progress.skip(file_size)
+                    continue
+                # the same clip can be on another card being transferred at the same time, only one session copies it
+                if not copied_files_ledger.claim(hash_file):
+                    print_color.green(f"The file {os.path.basename(video_path)} is being copied from another camcorder")
+                    transfer_progress.skip(file_size)
+                    continue
 
-    for video_path in video_files:
-        hash_file = video.calculate_file_hash(video_path)
-        if current_preferences["in_debug_mode"]:
-            print_color.purple(f"The SHA-256 hash of the file {os.path.basename(video_path)} is: {hash_file}")
-        # check if the file has already been copied (looking in the COPIED_FILES_LOG)
-        if not os.path.exists(COPIED_FILES_LOG):
-            # Create the destination directory if it doesn't exist
-            if not os.path.exists(current_preferences["destination_folder"]):
-                os.makedirs(current_preferences["destination_folder"])
-            # Create the COPIED_FILES_LOG file if it doesn't exist
-            with open(COPIED_FILES_LOG, 'w') as file:
-                pass
-        with open(COPIED_FILES_LOG, 'r') as file:
-            if hash_file in file.read():
-                print_color.green(f"The file {os.path.basename(video_path)} has already been copied")
-            else:
                 print(f"The file {os.path.basename(video_path)} has not been copied yet")
 
-
-
-                if os.path.getsize(video_path) > current_preferences["size_limit"]:
-                    to_be_concatenated.append(video_path)
-                    hash_to_be_concatenated.append(hash_file)
-
-                    if current_preferences["in_debug_mode"]:
+                clip_name = os.path.splitext(os.path.basename(video_path))[0]
+                if recordings is not None:
+                    # the AVCHD index tells which recording the clip belongs to
+                    recording = recordings.get(clip_name)
+                    if self.to_be_concatenated and recording is not self.pending_recording:
+                        # the other clips of the pending recording are already copied or missing, concatenate what is there
+                        submit_concat()
+                    is_splitted = recording is not None and len(recording.clip_names) > 1
+                    is_part = is_splitted and clip_name != recording.clip_names[-1]
+                    is_final_part = is_splitted and clip_name == recording.clip_names[-1] and len(self.to_be_concatenated) > 0
+                else:
+                    # without the index a splitted video is recognized by the size of its parts
+                    recording = None
+                    is_part = file_size > self.preferences["size_limit"]
+                    is_final_part = not is_part and len(self.to_be_concatenated) > 0
+
+                if is_part:
+                    self.to_be_concatenated.append(video_path)
+                    self.hash_to_be_concatenated.append(hash_file)
+                    self.bytes_to_be_concatenated += file_size
+                    self.pending_recording = recording
+
+                    if self.in_debug_mode:
                         print_color.purple(f"The file {video_path} have been recognized as part of a splitted video, added to the concatenation list")
                     else:
                         print(f"{os.path.basename(video_path)}: part of a splitted video")
-                else:
-                    if len(to_be_concatenated) > 0:
-                        to_be_concatenated.append(video_path)
-                        hash_to_be_concatenated.append(hash_file)
-
-                        if current_preferences["in_debug_mode"]:
-                            print_color.purple(f"The file {video_path} have been recognized as the final part of a splitted video, added to the concatenation list")
-                        else:
-                            print(f"{os.path.basename(video_path)}: final part of a splitted video")
-
-                        # concatenate the files in to_be_concatenated with the output in the destination folder
-                        transferred_video = video.concat(to_be_concatenated, current_preferences["destination_folder"], hash_to_be_concatenated, COPIED_FILES_LOG, current_preferences["in_debug_mode"])
-
-                        transferred_videos.append(transferred_video) # add the transferred video to the list of transferred videos
+                elif is_final_part:
+                    self.to_be_concatenated.append(video_path)
+                    self.hash_to_be_concatenated.append(hash_file)
+                    self.bytes_to_be_concatenated += file_size
 
-                        to_be_concatenated = [] # reset the list of files to be concatenated
-                        hash_to_be_concatenated = [] # reset the list of hash of the files to be concatenated
+                    if self.in_debug_mode:
+                        print_color.purple(f"The file {video_path} have been recognized as the final part of a splitted video, added to the concatenation list")
                     else:
-                        video.copy_file(video_path, current_preferences["destination_folder"], hash_file, COPIED_FILES_LOG, current_preferences["in_secure_mode"], current_preferences["in_debug_mode"])
-                        # rename the copied video file in a descriptive way (based on the date and time of the video (YYYY-MM-DD_HH-MM-SS.MTS))
-                        transferred_video = video.rename_copied_file(os.path.basename(video_path), current_preferences["destination_folder"], current_preferences["in_debug_mode"])
+                        print(f"{os.path.basename(video_path)}: final part of a splitted video")
 
-                        transferred_videos.append(transferred_video) # add the transferred video to the list of transferred videos
-
-        if update_progress:
-            update_progress(to_integer_for_progressbar(video_files.index(video_path)+1, len(video_files)))
+                    submit_concat()
+                else:
+                    submit(self._copy_and_rename, video_path, file_size, hash_file, recording.start if recording else None, sources=[video_path])
 
+        # parts still waiting for their final part (not on the camcorder yet) are not copied
+        transfer_progress.skip(self.bytes_to_be_concatenated)
+        copied_files_ledger.release(self.hash_to_be_concatenated)
 
+        # collect the results in the order of the files on the camcorder
+        for job, sources in zip(jobs, job_sources):
+            transferred_video = job.result()
+            if transferred_video:
+                self.transferred_videos.append(transferred_video) # add the transferred video to the list of transferred videos
+            else:
+                self.failed_videos.extend(sources)
+
+
+    def _copy_and_rename(self, video_path, file_size, hash_file, recording_date, submitted, transfer_progress):
+        copied_bytes = 0
+        def chunk_copied(bytes_copied):
+            nonlocal copied_bytes
+            copied_bytes += bytes_copied
+            transfer_progress.advance(bytes_copied)
+
+        staging_name = self.staging_prefix + os.path.basename(video_path)
+        operation = self.journal.begin(journal.STEP_COPY, staging=staging_name, hashes=[hash_file], recording_date=recording_date.isoformat() if recording_date else None)
+
+        # a copy keeps busy both the camcorder and the destination
+        try:
+            with self.source_slots, self.destination_slots:
+                queue_wait = time.perf_counter() - submitted
+                has_been_copied = video.copy_file(video_path, self.destination_folder, hash_file, self.copied_files_ledger, self.preferences["in_secure_mode"], self.in_debug_mode, queue_wait, self.preferences["fingerprint_mode"], chunk_copied, staging_name, self.copy_options)
+        finally:
+            self.copied_files_ledger.release([hash_file])
+        # the bytes not copied (resumed from a checkpoint, or failed) are done as well
+        transfer_progress.advance(file_size - copied_bytes, file_complete=True)
+
+        if not has_been_copied:
+            return None
+        self.journal.mark(operation, journal.STEP_COPIED)
+
+        # rename the copied video file in a descriptive way (based on the date and time of the video (YYYY-MM-DD_HH-MM-SS.MTS))
+        renamed_video = video.rename_copied_file(staging_name, self.destination_folder, self.in_debug_mode, recording_date=recording_date, destination_catalog=self.destination_catalog, fingerprints=[hash_file])
+        self.journal.mark(operation, journal.STEP_DONE)
+        return renamed_video
+
+    def _concat_group(self, video_paths, group_size, hashes, recording_date, submitted, transfer_progress):
+        # concatenate the files (in the order they have on the camcorder) with the output in the destination folder
+        output_file_name, partial_file_name = video.concat_file_names(video_paths, recording_date, self.staging_prefix)
+        operation = self.journal.begin(journal.STEP_CONCAT, partial=partial_file_name, output=output_file_name, hashes=hashes)
+        try:
+            with self.source_slots, self.destination_slots:
+                queue_wait = time.perf_counter() - submitted
+                concatenated_video = video.concat(video_paths, self.destination_folder, hashes, self.copied_files_ledger, self.in_debug_mode, recording_date, queue_wait, self.staging_prefix,
+                                                  on_concatenated=lambda partial_file_path: self.journal.mark(operation, journal.STEP_CONCATENATED), destination_catalog=self.destination_catalog)
+            if concatenated_video:
+                self.journal.mark(operation, journal.STEP_DONE)
+            return concatenated_video
+        finally:
+            self.copied_files_ledger.release(hashes)
+            transfer_progress.advance(group_size, file_complete=True) # ffmpeg doesn't report the bytes while it concatenates
+
+
+def start_transfer(update_progress=None, on_video_transferred=None, session_preferences=None):
+    """
+    Transfer the videos of the camcorder not transferred yet to the destination folder.
+
+    :param update_progress: Called with the percentage of the bytes to copy already copied, and the keyword arguments
+                            throughput (bytes per second of the last seconds) and eta (seconds left), None if unknown.
+    :param on_video_transferred: Called with the path of every video as soon as it is in the destination folder.
+    :param session_preferences: Preferences for this transfer only, the preferences file is neither read nor saved.
+    :return: List of the transferred videos, in the order of the files on the camcorder. The files that failed are left in failed_videos.
+    """
+    global failed_videos
+
+    if session_preferences is None:
+        current_preferences = preferences.preferences_routine() # load the preferences and ask the user for the root camcorder path if it is not set
+    else:
+        current_preferences = session_preferences
+
+    # record the timing of the stages, written in the destination folder at the end of the session
+    transfer_session = TransferSession(current_preferences)
+    try:
+        with metrics.session(current_preferences["destination_folder"], current_preferences["in_debug_mode"]) if current_preferences["record_metrics"] else contextlib.nullcontext():
+            transferred_videos = transfer_session.run(update_progress, on_video_transferred)
+    finally:
+        failed_videos = transfer_session.failed_videos
 
     # save the preferences
-    preferences.save_preferences(current_preferences)
-    if current_preferences["in_debug_mode"]:
-        print_color.purple("Preferences saved to file.")
-
-    if current_preferences["in_debug_mode"]:
-        print_color.purple(f"Transferred videos: {transferred_videos}")
+    if session_preferences is None:
+        preferences.save_preferences(current_preferences)
+        if current_preferences["in_debug_mode"]:
+            print_color.purple("Preferences saved to file.")
 
     return transferred_videos
 
+
+def transfer_cards(roots_camcorder, session_preferences, update_progress=None, on_video_transferred=None):
+    """
+    Transfer several camcorders (or cards) at the same time to the same destination folder, one TransferSession each.
+
+    The sessions share the copied files ledger, the destination catalog and the destination slots, every card has its own source slots.
+
+    :param roots_camcorder: Root folders of the camcorders.
+    :param update_progress: Called with the root folder of the camcorder, then like the update_progress of start_transfer.
+    :param on_video_transferred: Called with the path of every video as soon as it is in the destination folder (from several threads).
+    :return: List of the TransferSession, in the order of the roots. Their transferred_videos and failed_videos tell the result of each card.
+    """
+    transfer_sessions = []
+    with ledger.CopiedFilesLedger(session_preferences["destination_folder"], in_debug_mode=session_preferences["in_debug_mode"]) as copied_files_ledger, \
+         catalog.DestinationCatalog(session_preferences["destination_folder"], session_preferences["in_debug_mode"]) as destination_catalog:
+        destination_slots = threading.BoundedSemaphore(session_preferences["destination_io_workers"])
+        for root_camcorder in roots_camcorder:
+            card_preferences = dict(session_preferences, root_camcorder=root_camcorder)
+            transfer_sessions.append(TransferSession(card_preferences, copied_files_ledger, destination_slots, destination_catalog))
+
+        def run(transfer_session):
+            card_progress = (lambda percentage, **status: update_progress(transfer_session.root_camcorder, percentage, **status)) if update_progress else None
+            return transfer_session.run(card_progress, on_video_transferred)
+
+        with metrics.session(session_preferences["destination_folder"], session_preferences["in_debug_mode"]) if session_preferences["record_metrics"] else contextlib.nullcontext():
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(transfer_sessions) or 1) as executor:
+                # the errors of a card don't stop the others, they are raised when all the cards are done
+                jobs = [executor.submit(run, transfer_session) for transfer_session in transfer_sessions]
+                errors = [job.exception() for job in jobs if job.exception() is not None]
+        if errors:
+            raise errors[0]
+
+    return transfer_sessions
+
 if __name__ == "__main__":
     start_transfer()
\ No newline at end of file
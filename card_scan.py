@@ -0,0 +1,34 @@
+import os # for the files paths and other useful stuffs
+
+
+class ScannedFile:
+    """A file found on the card, with the size and the modification time read by the directory scan."""
+
+    def __init__(self, path, size, mtime):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.size = size
+        self.mtime = mtime
+
+    def __repr__(self):
+        return f"ScannedFile({self.name}, {self.size}, {self.mtime})"
+
+
+# FUNCTIONS
+def device_key(root_camcorder):
+    """Key of a card: the normalized path where it is mounted."""
+    return os.path.normcase(os.path.abspath(root_camcorder))
+
+def scan_directory(directory, extension):
+    """
+    List the files of a directory with the given extension in a single pass.
+
+    :return: List of ScannedFile sorted by name, the order of the clips is needed to recognize the splitted videos.
+    """
+    scanned_files = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(extension) and entry.is_file():
+                entry_stat = entry.stat() # cached by scandir on Windows, a single call elsewhere
+                scanned_files.append(ScannedFile(entry.path, entry_stat.st_size, entry_stat.st_mtime))
+    return sorted(scanned_files, key=lambda scanned_file: scanned_file.name)
@@ -0,0 +1,148 @@
+import os # for the files paths and other useful stuffs
+import re # for the date in the names of the videos
+import json # for the catalog file
+import threading # for the names taken by several copy workers
+import atomic_file # for the catalog file written without half written states
+import ledger # for the lock shared with the other processes
+import print_color # for the colored prints
+
+# CONSTANTS
+CATALOG_FILE_NAME = "destination_catalog.json" # in the destination folder, next to the copied files log
+DATED_NAME = re.compile(r"^(\d{4}-\d{2}-\d{2})_\d{2}-\d{2}-\d{2}(?:_\d+)?\.") # names given to the videos: YYYY-MM-DD_HH-MM-SS[_number].ext
+
+
+class DestinationCatalog:
+    """
+    Names of the files of the destination folder, with the fingerprints and the size of the archived videos.
+
+    The folder is listed once when the catalog is opened, then the free names are found in memory: the numbered names
+    (e.g. 2021-01-01_12-00-00_1.MTS) don't cost a stat each, which is slow on a network share. The names are reserved
+    when they are given, so the copy workers and the transfers of several cards never get the same one.
+    """
+
+    def __init__(self, destination_folder, in_debug_mode=False):
+        self.destination_folder = destination_folder
+        self.path = os.path.join(destination_folder, CATALOG_FILE_NAME)
+        self.in_debug_mode = in_debug_mode
+
+        self._taken = set() # normalized names of all the files of the folder, and of the names reserved
+        self._videos = {} # name -> {"fingerprints": keys in the copied files log, "size": bytes}
+        self._by_date = {} # YYYY-MM-DD -> set of the names of the videos recorded that day
+        self._next_number = {} # name without extension -> next number to try, so a free name is found without going through the taken ones
+        self._reserved = {} # reserved name -> name without extension and number it has been made from
+        self._lock = threading.Lock()
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                recorded_videos = json.load(file)
+            if not isinstance(recorded_videos, dict):
+                raise ValueError("not a JSON object")
+        except FileNotFoundError:
+            recorded_videos = {}
+        except ValueError as e:
+            print_color.yellow(f"The destination catalog {self.path} can't be read ({e}), it is rebuilt from the folder.")
+            recorded_videos = {}
+
+        # the folder is the reference: the files deleted since are forgotten, the ones added by hand are cataloged without fingerprint
+        if os.path.isdir(destination_folder):
+            with os.scandir(destination_folder) as entries:
+                for entry in entries:
+                    self._taken.add(os.path.normcase(entry.name))
+                    if DATED_NAME.match(entry.name) and entry.is_file():
+                        video = recorded_videos.get(entry.name) or {"fingerprints": [], "size": entry.stat().st_size}
+                        self._add_video(entry.name, video)
+
+        if self.in_debug_mode:
+            print_color.purple(f"Destination catalog loaded: {len(self._taken)} files, {len(self._videos)} videos")
+
+    def __contains__(self, file_name):
+        with self._lock:
+            return os.path.normcase(file_name) in self._taken
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def reserve_name(self, file_name, extension):
+        """
+        Reserve file_name + extension, or with a number added if the name is taken (e.g. 2021-01-01_12-00-00_1.MTS).
+
+        :return: The reserved name, to be passed to record once the file has it or to release if it is not used.
+        """
+        with self._lock:
+            number = self._next_number.get(file_name, 0)
+            new_file_name = f"{file_name}_{number}{extension}" if number else f"{file_name}{extension}"
+            while os.path.normcase(new_file_name) in self._taken:
+                number += 1
+                new_file_name = f"{file_name}_{number}{extension}"
+            self._next_number[file_name] = number + 1
+            self._taken.add(os.path.normcase(new_file_name))
+            self._reserved[new_file_name] = file_name
+            return new_file_name
+
+    def release(self, file_name):
+        """Give back a reserved name that has not been used."""
+        with self._lock:
+            self._taken.discard(os.path.normcase(file_name))
+            base_name = self._reserved.pop(file_name, None)
+            if base_name is not None:
+                self._next_number[base_name] = 0 # the numbers are tried again from the start
+
+    def mark_taken(self, file_name):
+        """Keep a reserved name taken: another process has created a file with that name."""
+        with self._lock:
+            self._taken.add(os.path.normcase(file_name))
+            self._reserved.pop(file_name, None)
+
+    def record(self, file_name, fingerprints=(), size=None):
+        """Catalog a video that has taken its name in the destination folder."""
+        if size is None:
+            size = os.path.getsize(os.path.join(self.destination_folder, file_name))
+        with self._lock:
+            self._taken.add(os.path.normcase(file_name))
+            self._reserved.pop(file_name, None)
+            self._add_video(file_name, {"fingerprints": list(fingerprints), "size": size})
+
+    def videos_of(self, date):
+        """
+        Videos already archived for a day.
+
+        :param date: datetime.date or YYYY-MM-DD string.
+        :return: Dict name -> {"fingerprints", "size"} of the videos recorded that day.
+        """
+        day = date if isinstance(date, str) else date.strftime('%Y-%m-%d')
+        with self._lock:
+            return {name: dict(self._videos[name]) for name in sorted(self._by_date.get(day, ()))}
+
+    def save(self):
+        """
+        Write the catalog, with the videos recorded since by the other processes writing in the same folder.
+
+        The file is read, merged and written under the lock shared with the other processes, so their videos are kept.
+        """
+        try:
+            with ledger.ProcessLock(ledger.lock_path_of(self.path)):
+                # the videos of the other processes still in the folder, the ones deleted since the catalog was loaded are dropped
+                recorded_videos = {file_name: video for file_name, video in atomic_file.read_json_object(self.path).items()
+                                   if file_name not in self._videos and isinstance(video, dict) and os.path.exists(os.path.join(self.destination_folder, file_name))}
+                with self._lock:
+                    for file_name, video in recorded_videos.items():
+                        if file_name not in self._videos:
+                            self._taken.add(os.path.normcase(file_name))
+                            self._add_video(file_name, video)
+                    videos = dict(self._videos)
+                atomic_file.write_json(self.path, videos)
+        except OSError as e:
+            print_color.red(f"Error saving the destination catalog {self.path}: {e}")
+
+    def close(self):
+        self.save()
+
+    # -- internal helpers --
+    def _add_video(self, file_name, video):
+        self._videos[file_name] = video
+        match = DATED_NAME.match(file_name)
+        if match:
+            self._by_date.setdefault(match.group(1), set()).add(file_name)
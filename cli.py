@@ -0,0 +1,224 @@
+"""
+Command line entry point: transfer and transcode the videos without the GUI.
+
+Usage: python cli.py [--preferences config/preferences.json] [--camcorder ROOT ...] [--destination FOLDER]
+                     [--set KEY=VALUE ...] [--debug] {transfer,transcode,all} [videos ...]
+
+Several --camcorder are transferred at the same time into the same destination. The preferences file is read but never saved, the overrides are valid only for this run. The exit code is one of the
+EXIT_* constants, so scripts and cron jobs can tell a failed video from a wrong command line.
+"""
+import os # for the files paths and other useful stuffs
+import sys # for the exit code
+import copy # for keeping the default preferences untouched
+import json # for the values of the overrides
+import queue # for the videos passed from the transfer to the transcoding
+import argparse # for the command line
+import threading # for the transcoding running during the transfer
+import contextlib # for running without metrics
+import print_color # for the colored prints
+import preferences # for the preferences file
+import camcorder # for the transfer
+import video # for the transcoding
+import file_copy # for the copy methods
+import scheduler # for the transcode priorities
+import encoders # for the encoder backends
+import metrics # for the timing of the session
+import progress # for the throughput and the ETA of the transfer
+
+# CONSTANTS
+EXIT_OK = 0 # everything has been transferred and transcoded
+EXIT_FAILED = 1 # some videos couldn't be transferred or some transcoding jobs failed
+EXIT_USAGE = 2 # wrong command line or preferences (same code as the argparse errors)
+EXIT_ERROR = 3 # the transfer or the transcoding stopped with an unexpected error
+
+COMMANDS = ["transfer", "transcode", "all"]
+
+# smallest value of the numeric preferences, 0 is allowed where it means automatic
+MINIMUM_VALUES = {
+    "size_limit": 1,
+    "source_io_workers": 1,
+    "destination_io_workers": 1,
+    "copy_chunk_size": 1,
+    "copy_readahead": 0, # the kernel decides
+    "transcode_thread_budget": 0, # all the cores
+    "transcode_workers": 0, # sized on the thread budget
+    "segment_transcode.min_duration": 0,
+    "segment_transcode.segment_duration": 1,
+    "segment_transcode.workers": 0, # sized on the thread budget
+    **{f"encoder_threads_per_job.{backend}": 0 for backend in encoders.BACKENDS}, # scheduler.THREADS_PER_JOB
+}
+ALLOWED_VALUES = {
+    "fingerprint_mode": video.FINGERPRINT_MODES,
+    "copy_method": file_copy.COPY_METHODS,
+    "transcode_priority": [scheduler.PRIORITY_FIFO, scheduler.PRIORITY_SHORTEST_FIRST] + video.PROFILES,
+    "encoder_backend": [encoders.BACKEND_AUTO] + list(encoders.BACKENDS),
+}
+
+
+# FUNCTIONS
+def parse_override(override):
+    """
+    Split a KEY=VALUE override, the key can be nested with dots (e.g. H264_low.bitrate=6M).
+
+    :return: Tuple (list of keys, value). The value is a string if the default preference is a string,
+             otherwise it is read as JSON when possible (numbers, true/false, objects).
+    """
+    key, separator, value = override.partition("=")
+    if not separator or not key:
+        raise ValueError(f"'{override}' is not in the form KEY=VALUE")
+    keys = key.split(".")
+
+    default_value = preferences.DEFAULT_PREFERENCES
+    for key in keys:
+        default_value = default_value.get(key) if isinstance(default_value, dict) else None
+    if keys[0] not in preferences.DEFAULT_PREFERENCES:
+        raise ValueError(f"unknown preference '{keys[0]}'")
+
+    if not isinstance(default_value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+    return keys, value
+
+def apply_overrides(session_preferences, overrides):
+    for override in overrides:
+        keys, value = parse_override(override)
+        target = session_preferences
+        for key in keys[:-1]:
+            if not isinstance(target.get(key), dict):
+                raise ValueError(f"'{key}' is not a group of preferences")
+            target = target[key]
+        target[keys[-1]] = value
+
+def check_preference_values(session_preferences):
+    """Raise ValueError if a numeric preference is out of its range or a preference has an unknown value."""
+    for key, minimum in MINIMUM_VALUES.items():
+        value = session_preferences
+        for name in key.split("."):
+            value = value.get(name) if isinstance(value, dict) else None
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+            automatic = " (0 for automatic)" if minimum == 0 else ""
+            raise ValueError(f"{key} should be an integer of at least {minimum}{automatic}, not {value!r}")
+    for key, values in ALLOWED_VALUES.items():
+        if session_preferences[key] not in values:
+            raise ValueError(f"{key} should be one of {', '.join(values)}, not {session_preferences[key]!r}")
+
+def load_session_preferences(arguments):
+    """Preferences of the file with the overrides of the command line, validated. Raise ValueError if they can't be used."""
+    session_preferences = copy.deepcopy(preferences.load_preferences(arguments.preferences))
+
+    apply_overrides(session_preferences, arguments.set)
+    if arguments.camcorder:
+        for root_camcorder in arguments.camcorder:
+            if not os.path.isdir(root_camcorder):
+                raise ValueError(f"the camcorder root folder '{root_camcorder}' doesn't exist")
+        session_preferences["root_camcorder"] = arguments.camcorder[0]
+    if arguments.destination is not None:
+        session_preferences["destination_folder"] = arguments.destination
+        os.makedirs(arguments.destination, exist_ok=True)
+    if arguments.debug:
+        session_preferences["in_debug_mode"] = True
+
+    session_preferences = preferences.validate_preferences(session_preferences)
+    check_preference_values(session_preferences)
+
+    if arguments.command in ("transfer", "all"):
+        if not session_preferences["root_camcorder"]:
+            raise ValueError("the camcorder root folder is not set (--camcorder or root_camcorder in the preferences)")
+        if not session_preferences["destination_folder"]:
+            raise ValueError("the destination folder is not set (--destination or destination_folder in the preferences)")
+    return session_preferences
+
+def videos_to_transcode(paths):
+    """The videos given on the command line, a folder stands for all its videos."""
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            videos += video.files_in(path, camcorder.EXTENSION)
+        elif os.path.isfile(path):
+            videos.append(path)
+        else:
+            raise ValueError(f"'{path}' is not a video or a folder")
+    return videos
+
+def print_transfer_progress(root_camcorder, percentage, throughput=None, eta=None):
+    status = f" ({progress.format_throughput(throughput)}, ETA {progress.format_eta(eta)})" if throughput else ""
+    print(f"Transfer of {root_camcorder}: {percentage:.0f}%" + status)
+
+def transfer(session_preferences, roots_camcorder, on_video_transferred=None):
+    """Transfer the camcorders at the same time, return the files that couldn't be transferred."""
+    transfer_sessions = camcorder.transfer_cards(roots_camcorder, session_preferences, print_transfer_progress, on_video_transferred)
+    return [failed_video for transfer_session in transfer_sessions for failed_video in transfer_session.failed_videos]
+
+def run_transfer(session_preferences, roots_camcorder):
+    return EXIT_FAILED if transfer(session_preferences, roots_camcorder) else EXIT_OK
+
+def run_transcode(session_preferences, videos):
+    failed_jobs = video.transcode_list_of_videos(videos, session_preferences, overwrite=False, in_debug_mode=session_preferences["in_debug_mode"])
+    return EXIT_FAILED if failed_jobs else EXIT_OK
+
+def run_all(session_preferences, roots_camcorder):
+    # every video is transcoded as soon as it has been transferred, while the next ones are still copying
+    to_be_transcoded = queue.Queue() # videos to be transcoded, None marks the end of the transfer
+    failed_jobs = None
+    def transcode():
+        nonlocal failed_jobs
+        failed_jobs = video.transcode_queue_of_videos(to_be_transcoded, session_preferences, overwrite=False, in_debug_mode=session_preferences["in_debug_mode"])
+    transcode_thread = threading.Thread(target=transcode)
+    transcode_thread.start()
+    failed_videos = []
+    try:
+        failed_videos = transfer(session_preferences, roots_camcorder, to_be_transcoded.put)
+    finally:
+        # wait for the videos already transferred to be transcoded
+        to_be_transcoded.put(None)
+        transcode_thread.join()
+
+    if failed_jobs is None: # the transcoding thread stopped with an error, already printed
+        return EXIT_ERROR
+    return EXIT_FAILED if failed_videos or failed_jobs else EXIT_OK
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transfer the videos of the camcorder and transcode them, without the GUI.")
+    parser.add_argument("command", choices=COMMANDS, help="transfer the new videos, transcode the given videos, or transfer and transcode the new videos")
+    parser.add_argument("videos", nargs="*", help="videos or folders of videos to transcode (transcode command only)")
+    parser.add_argument("--preferences", default=preferences.DEFAULT_PREFERENCES_PATH, help="preferences file, read but never saved")
+    parser.add_argument("--camcorder", action="append", help="root folder of the camcorder, overrides root_camcorder (repeat it to transfer several cards at the same time)")
+    parser.add_argument("--destination", help="destination folder, overrides destination_folder")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="override a preference for this run (e.g. --set multi_output=false --set H264_low.bitrate=6M)")
+    parser.add_argument("--debug", action="store_true", help="print the debug messages")
+    arguments = parser.parse_args(argv)
+
+    if arguments.videos and arguments.command != "transcode":
+        parser.error(f"the {arguments.command} command doesn't take videos")
+    if not arguments.videos and arguments.command == "transcode":
+        parser.error("the transcode command needs the videos to transcode")
+
+    try:
+        session_preferences = load_session_preferences(arguments)
+        videos = videos_to_transcode(arguments.videos)
+    except ValueError as e:
+        print_color.red(f"Error: {e}")
+        return EXIT_USAGE
+
+    roots_camcorder = arguments.camcorder or [session_preferences["root_camcorder"]]
+
+    # one metrics session for the whole run, written in the destination folder (or next to the videos to transcode)
+    metrics_folder = session_preferences["destination_folder"] or (os.path.dirname(os.path.abspath(videos[0])) if videos else "")
+    try:
+        with metrics.session(metrics_folder, session_preferences["in_debug_mode"]) if session_preferences["record_metrics"] and metrics_folder else contextlib.nullcontext():
+            if arguments.command == "transfer":
+                return run_transfer(session_preferences, roots_camcorder)
+            if arguments.command == "transcode":
+                return run_transcode(session_preferences, videos)
+            return run_all(session_preferences, roots_camcorder)
+    except Exception as e:
+        print_color.red(f"Error: {e}")
+        return EXIT_ERROR
+
+
+if __name__ == "__main__":
+    sys.exit(main())
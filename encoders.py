@@ -0,0 +1,124 @@
+import functools # for caching the capabilities of ffmpeg
+import subprocess # for the ffmpeg command execution
+import print_color # for the colored prints
+
+# CONSTANTS
+BACKEND_AUTO = "auto"
+
+# every backend knows its encoders, the hardware acceleration for decoding and how to translate a profile into ffmpeg flags
+BACKENDS = {
+    "nvenc": {
+        "encoders": {"h264": "h264_nvenc", "h265": "hevc_nvenc"},
+        "hwaccel": "cuda",
+        "default_preset": "p4", # NVENC preset (e.g., p1 to p7, p4 is "medium")
+        "hardware": True,
+        "max_sessions": 3, # encoders open at the same time, the limit of the consumer GPUs
+    },
+    "software": {
+        "encoders": {"h264": "libx264", "h265": "libx265"},
+        "hwaccel": None,
+        "default_preset": "medium", # x264/x265 preset (ultrafast to veryslow)
+        "hardware": False,
+        "max_sessions": None,
+    },
+}
+AUTO_ORDER = ["nvenc", "software"] # backends tried by "auto", the first available wins
+
+
+# FUNCTIONS
+def _run_ffmpeg_query(arguments):
+    try:
+        result = subprocess.run(['ffmpeg', '-hide_banner', *arguments], capture_output=True, text=True)
+    except OSError:
+        return ""
+    return result.stdout
+
+@functools.lru_cache(maxsize=None)
+def available_encoders():
+    """Names of the video encoders compiled in ffmpeg, probed once per process."""
+    encoders = set()
+    for line in _run_ffmpeg_query(['-encoders']).splitlines():
+        parts = line.split()
+        # the lines of the encoders start with the flags, e.g. " V....D libx264  ..."
+        if len(parts) >= 2 and parts[0].startswith("V") and len(parts[0]) == 6:
+            encoders.add(parts[1])
+    return frozenset(encoders)
+
+@functools.lru_cache(maxsize=None)
+def available_hwaccels():
+    """Hardware accelerations supported by ffmpeg, probed once per process."""
+    lines = _run_ffmpeg_query(['-hwaccels']).splitlines()
+    return frozenset(line.strip() for line in lines[1:] if line.strip()) # the first line is the title
+
+@functools.lru_cache(maxsize=None)
+def encoder_works(encoder):
+    """Encode a few frames of a test pattern, a hardware encoder can be compiled in ffmpeg without the device being present."""
+    command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-f', 'lavfi', '-i', 'color=size=256x256:duration=0.1', '-c:v', encoder, '-f', 'null', '-']
+    try:
+        return subprocess.run(command, capture_output=True).returncode == 0
+    except OSError:
+        return False
+
+@functools.lru_cache(maxsize=None)
+def backend_available(name):
+    backend = BACKENDS[name]
+    encoders = backend["encoders"].values()
+    if not all(encoder in available_encoders() for encoder in encoders):
+        return False
+    if backend["hardware"]:
+        return all(encoder_works(encoder) for encoder in encoders)
+    return True
+
+def select_backend(name=BACKEND_AUTO, in_debug_mode=False):
+    """
+    Return the name of the backend to use.
+
+    :param name: A key of BACKENDS or "auto" for the first available of AUTO_ORDER.
+    """
+    if name != BACKEND_AUTO:
+        if name not in BACKENDS:
+            print_color.red(f"Unknown encoder backend '{name}', choosing one automatically.")
+        elif not backend_available(name):
+            print_color.yellow(f"The encoder backend '{name}' is not available on this machine, choosing one automatically.")
+        else:
+            return name
+
+    for candidate in AUTO_ORDER:
+        if backend_available(candidate):
+            if in_debug_mode:
+                print_color.purple(f"Encoder backend: {candidate}")
+            return candidate
+
+    # nothing could be probed (e.g. ffmpeg not in the PATH), the software encoders are the most likely to be there
+    print_color.yellow("No encoder backend could be verified, using the software encoders.")
+    return "software"
+
+def input_arguments(backend_name):
+    """ffmpeg arguments to put before the input."""
+    hwaccel = BACKENDS[backend_name]["hwaccel"]
+    if hwaccel and hwaccel in available_hwaccels():
+        return ['-hwaccel', hwaccel] # hardware decoding
+    return []
+
+def encoder_arguments(backend_name, codec, bitrate=None, crf=None, preset=None):
+    """
+    Translate a profile into the ffmpeg encoder arguments of a backend.
+
+    :param codec: "h264" or "h265".
+    :param bitrate: Fixed bitrate (e.g. "8M"), used when crf is None.
+    :param crf: Constant quality value, translated to the rate control of the backend.
+    :param preset: Speed/quality preset of the backend, None for its default.
+    """
+    backend = BACKENDS[backend_name]
+    arguments = ['-c:v', backend["encoders"][codec]]
+
+    if crf is not None:
+        if backend_name == "nvenc":
+            arguments += ['-rc', 'vbr', '-cq', str(crf), '-b:v', '0'] # NVENC has no -crf, constant quality is -cq with VBR
+        else:
+            arguments += ['-crf', str(crf)]
+    else:
+        arguments += ['-b:v', bitrate]
+
+    arguments += ['-preset', preset or backend["default_preset"]]
+    return arguments
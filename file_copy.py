@@ -0,0 +1,343 @@
+import hashlib # for the content digest computed during the copy
+import shutil # for copying the metadata
+import os # for the files paths and other useful stuffs
+import json # for the checkpoint files
+import mmap # for the page aligned copy buffer
+import errno # for recognizing the copy primitives not supported by a file system
+import threading # for the methods found unsupported by the copy workers
+import print_color # for the colored prints
+import atomic_file # for the checkpoint files
+
+if os.name != "nt":
+    import fcntl # for the reflinks on Linux
+
+# CONSTANTS
+CHUNK_SIZE = 8 * 1024 * 1024 # 8 MiB, large reads keep the card reader streaming
+DIGEST_SIZE = 32 # bytes of the BLAKE2b digest
+CHECKPOINT_INTERVAL = 256 * 1024 * 1024 # 256 MiB written between two checkpoints
+READAHEAD = 32 * 1024 * 1024 # bytes of the source the kernel is asked to read ahead of the copy
+
+# copy methods, "auto" tries them in this order and falls back to the next one when the file systems don't support it
+COPY_AUTO = "auto"
+COPY_REFLINK = "reflink" # the destination shares the blocks of the source, nothing is copied (btrfs, XFS, ... on the same file system)
+COPY_FILE_RANGE = "copy_file_range" # the kernel copies the bytes (or the server, on a network share that supports it)
+COPY_SENDFILE = "sendfile" # the kernel copies the bytes between any two files
+COPY_BUFFERED = "buffered" # read and write through a buffer, the only method that can calculate the digest during the copy
+COPY_METHODS = [COPY_AUTO, COPY_REFLINK, COPY_FILE_RANGE, COPY_SENDFILE, COPY_BUFFERED]
+
+FICLONE = 0x40049409 # ioctl of Linux cloning a whole file
+UNSUPPORTED_ERRORS = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.ENOTSOCK, errno.EBADF, errno.ETXTBSY, errno.EPERM}
+
+TS_PACKET_SIZE = 192 # packets of the AVCHD transport stream (188 bytes with a 4 bytes timestamp)
+SAMPLE_SIZE = 1024 * TS_PACKET_SIZE # 192 KiB read at the head, the middle and the tail for the sampled digest
+
+PARTIAL_SUFFIX = ".partial" # the copy is written here and renamed only when it is complete
+CHECKPOINT_SUFFIX = ".checkpoint" # offset and digest of the bytes of the partial file already on disk
+
+
+# the methods that failed between two devices are not tried again for the next files
+_unsupported_methods = set() # (device of the source, device of the destination, method)
+_unsupported_lock = threading.Lock()
+
+
+class _Unsupported(Exception):
+    """The copy method doesn't work between these two files, the next one is tried."""
+
+
+class _Copy:
+    """
+    Copy loop of stream_copy with any of the methods, from the offset reached so far to the end of the source.
+
+    A checkpoint is written every checkpoint_interval bytes. The pages of the source are dropped from the cache as soon
+    as they are copied, the ones of the destination once they are on disk.
+    """
+
+    def __init__(self, source_file, destination_file, source_stat, checkpoint_path, checkpoint_interval, chunk_size, readahead, drop_cache, on_progress, in_debug_mode):
+        self.source_file = source_file
+        self.destination_file = destination_file
+        self.source_stat = source_stat
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.chunk_size = chunk_size
+        self.readahead = readahead
+        self.drop_cache = drop_cache
+        self.on_progress = on_progress
+        self.in_debug_mode = in_debug_mode
+
+        self.offset = 0 # bytes of the source already copied
+        self.digest = None # digest of the bytes already copied, None without the digest
+        self._written_since_checkpoint = 0
+        self._dropped_offset = 0 # the pages of the source before this offset are out of the cache
+
+    def run(self, method, offset, digest):
+        """Copy the bytes from offset to the end of the source. Raise _Unsupported if the method fails before the first byte."""
+        self.offset, self.digest = offset, digest
+        self._dropped_offset = offset
+        self.source_file.seek(offset)
+        self.destination_file.seek(offset)
+        try:
+            if method == COPY_REFLINK:
+                self._reflink()
+            elif method == COPY_BUFFERED:
+                self._buffered()
+            else:
+                self._kernel(method)
+        except OSError as e:
+            # the buffered copy is the last resort, its errors are real ones
+            if method != COPY_BUFFERED and self.offset == offset and e.errno in UNSUPPORTED_ERRORS:
+                raise _Unsupported() from e
+            raise
+
+    def sync(self):
+        """Put the bytes copied so far on disk, then their pages can leave the cache."""
+        self.destination_file.flush()
+        os.fsync(self.destination_file.fileno())
+        if self.drop_cache:
+            _advise(self.destination_file.fileno(), 0, 0, "POSIX_FADV_DONTNEED")
+
+    # -- internal helpers --
+    def _reflink(self):
+        # the clone replaces the whole destination, it can't resume a copy
+        if os.name == "nt" or self.offset:
+            raise _Unsupported()
+        self.destination_file.flush()
+        fcntl.ioctl(self.destination_file.fileno(), FICLONE, self.source_file.fileno())
+        self._advance(self.source_stat.st_size)
+
+    def _kernel(self, method):
+        if not hasattr(os, "copy_file_range" if method == COPY_FILE_RANGE else "sendfile"):
+            raise _Unsupported()
+        source_fd, destination_fd = self.source_file.fileno(), self.destination_file.fileno()
+        self.destination_file.flush() # the file position of sendfile is the one of the descriptor
+        while True:
+            if method == COPY_FILE_RANGE:
+                copied_bytes = os.copy_file_range(source_fd, destination_fd, self.chunk_size, self.offset, self.offset)
+            else:
+                copied_bytes = os.sendfile(destination_fd, source_fd, self.offset, self.chunk_size)
+            if not copied_bytes:
+                return
+            self._advance(copied_bytes)
+
+    def _buffered(self):
+        _advise(self.source_file.fileno(), 0, 0, "POSIX_FADV_SEQUENTIAL") # larger readahead window of the kernel
+        buffer = mmap.mmap(-1, self.chunk_size) # anonymous memory, aligned on a page
+        view = memoryview(buffer)
+        try:
+            while True:
+                if self.readahead:
+                    _advise(self.source_file.fileno(), self.offset + self.chunk_size, self.readahead, "POSIX_FADV_WILLNEED")
+                read_bytes = self.source_file.readinto(view)
+                if not read_bytes:
+                    return
+                if self.digest is not None:
+                    self.digest.update(view[:read_bytes])
+                self.destination_file.write(view[:read_bytes])
+                self._advance(read_bytes)
+        finally:
+            view.release()
+            buffer.close()
+
+    def _advance(self, copied_bytes):
+        self.offset += copied_bytes
+        self._written_since_checkpoint += copied_bytes
+        if self.drop_cache:
+            _advise(self.source_file.fileno(), self._dropped_offset, self.offset - self._dropped_offset, "POSIX_FADV_DONTNEED")
+            self._dropped_offset = self.offset
+        if self.on_progress:
+            self.on_progress(copied_bytes)
+
+        if self._written_since_checkpoint >= self.checkpoint_interval:
+            # the data must be on disk before the checkpoint that points past it
+            self.sync()
+            _write_checkpoint(self.checkpoint_path, self.source_stat, self.offset, self.digest)
+            self._written_since_checkpoint = 0
+            if self.in_debug_mode:
+                print_color.purple(f"Checkpoint of {os.path.basename(self.source_file.name)} at {self.offset} bytes")
+
+
+# FUNCTIONS
+def new_digest():
+    return hashlib.blake2b(digest_size=DIGEST_SIZE)
+
+def stream_copy(source, destination, chunk_size=CHUNK_SIZE, checkpoint_interval=CHECKPOINT_INTERVAL, in_debug_mode=False, on_progress=None,
+                with_digest=True, copy_method=COPY_AUTO, readahead=READAHEAD, drop_cache=True):
+    """
+    Copy a file in large chunks, hashing every chunk while it is written.
+
+    The source is read only once, so the digest comes at almost no extra cost compared to a plain copy.
+    The bytes are written to a partial file with a checkpoint (offset and digest) every checkpoint_interval bytes,
+    if the copy is interrupted the next call resumes from the last checkpoint instead of starting from zero.
+
+    Without the digest the bytes don't need to pass through the program: the copy is done by the kernel (reflink,
+    copy_file_range or sendfile, the first one the two file systems support). The pages of the copied bytes are dropped
+    from the cache once they are on disk, so a whole card doesn't evict the files of the other programs.
+
+    :param source: Path of the file to copy.
+    :param destination: Path of the new file (not a directory).
+    :param chunk_size: Size of the blocks read from the source (rounded to whole memory pages).
+    :param checkpoint_interval: Bytes written between two checkpoints.
+    :param on_progress: Called with the number of bytes of every chunk written.
+    :param with_digest: Calculate the digest of the copied bytes, it needs the buffered copy.
+    :param copy_method: One of COPY_METHODS, COPY_AUTO for the fastest one that works.
+    :param readahead: Bytes of the source the kernel is asked to read ahead of the buffered copy, 0 to let it decide.
+    :param drop_cache: Drop from the cache the pages of the bytes already copied.
+    :return: Hex BLAKE2b digest of the copied bytes, None without the digest.
+    """
+    if copy_method not in COPY_METHODS:
+        raise ValueError(f"unknown copy method '{copy_method}', should be one of {COPY_METHODS}")
+    partial_path = destination + PARTIAL_SUFFIX
+    checkpoint_path = partial_path + CHECKPOINT_SUFFIX
+    source_stat = os.stat(source)
+    chunk_size = max(1, -(-chunk_size // mmap.PAGESIZE)) * mmap.PAGESIZE
+
+    digest, offset = _resume_point(source_stat, partial_path, checkpoint_path, chunk_size, with_digest)
+    if offset:
+        print_color.yellow(f"Resuming the copy of {os.path.basename(source)} from {offset} bytes.")
+
+    # only the buffered copy sees the bytes, the other methods are tried first when the digest is not needed
+    if with_digest or copy_method == COPY_BUFFERED:
+        methods = [COPY_BUFFERED]
+    elif copy_method == COPY_AUTO:
+        methods = [COPY_REFLINK, COPY_FILE_RANGE, COPY_SENDFILE, COPY_BUFFERED]
+    else:
+        methods = [copy_method, COPY_BUFFERED]
+
+    with open(source, 'rb') as source_file, open(partial_path, 'r+b' if offset else 'wb') as destination_file:
+        destination_file.truncate(offset) # drop the bytes written after the last checkpoint
+        copy = _Copy(source_file, destination_file, source_stat, checkpoint_path, checkpoint_interval, chunk_size, readahead, drop_cache, on_progress, in_debug_mode)
+        devices = (source_stat.st_dev, os.fstat(destination_file.fileno()).st_dev)
+        for method in methods:
+            if (*devices, method) in _unsupported_methods:
+                continue
+            try:
+                copy.run(method, offset, digest)
+                break
+            except _Unsupported:
+                if method != COPY_REFLINK or not offset: # a reflink can still work for a copy that is not resumed
+                    with _unsupported_lock:
+                        _unsupported_methods.add((*devices, method))
+                if in_debug_mode:
+                    print_color.purple(f"The copy method {method} doesn't work from {source} to {destination}, trying the next one")
+        copy.sync()
+
+    # a method that stops early (a 0 returned by copy_file_range or sendfile before the end) must not publish a truncated file,
+    # the partial file and its checkpoint are kept for the next try
+    if copy.offset != source_stat.st_size:
+        raise OSError(f"the copy of {source} stopped at {copy.offset} of {source_stat.st_size} bytes")
+
+    # preserve the metadata like shutil.copy2, the modification date is used to rename the file
+    shutil.copystat(source, partial_path)
+
+    # the complete file takes the final name, then the checkpoint is not needed anymore
+    os.replace(partial_path, destination)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    return digest.hexdigest() if with_digest else None
+
+
+def _advise(file_descriptor, offset, length, advice):
+    """Give an access pattern hint to the kernel, where posix_fadvise exists (not on Windows and macOS)."""
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(file_descriptor, offset, length, getattr(os, advice))
+        except OSError:
+            pass # only a hint, some file systems don't take it
+
+def _resume_point(source_stat, partial_path, checkpoint_path, chunk_size, with_digest=True):
+    """Return the digest and the offset to restart from, (empty digest, 0) if the partial file can't be trusted."""
+    restart = (new_digest() if with_digest else None, 0)
+    try:
+        with open(checkpoint_path, 'r') as file:
+            checkpoint = json.load(file)
+        offset = checkpoint["offset"]
+
+        # the checkpoint is valid only for the same source file and if the partial file still has the bytes
+        if checkpoint["source_size"] != source_stat.st_size or checkpoint["source_mtime"] != source_stat.st_mtime:
+            return restart
+        if os.path.getsize(partial_path) < offset:
+            return restart
+        if not with_digest:
+            return None, offset
+        if checkpoint["digest"] is None:
+            return restart # written by a copy without digest, nothing to verify the partial file with
+
+        # re-read the partial file (on the destination, not on the camcorder) to rebuild the digest and verify it
+        digest = _digest_of_prefix(partial_path, offset, chunk_size)
+        if digest.hexdigest() != checkpoint["digest"]:
+            return restart
+        return digest, offset
+    except (FileNotFoundError, ValueError, KeyError, TypeError):
+        return restart
+
+def _digest_of_prefix(file_path, length, chunk_size):
+    digest = new_digest()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+
+    with open(file_path, 'rb') as file:
+        while length > 0:
+            read_bytes = file.readinto(view[:min(chunk_size, length)])
+            if not read_bytes:
+                break
+            digest.update(view[:read_bytes])
+            length -= read_bytes
+
+    return digest
+
+def _write_checkpoint(checkpoint_path, source_stat, offset, digest):
+    checkpoint = {
+        "source_size": source_stat.st_size,
+        "source_mtime": source_stat.st_mtime,
+        "offset": offset,
+        "digest": digest.hexdigest() if digest is not None else None,
+    }
+    atomic_file.write_json(checkpoint_path, checkpoint)
+
+def file_digest(file_path, chunk_size=CHUNK_SIZE, drop_cache=False):
+    """
+    Hex BLAKE2b digest of the whole content of a file.
+
+    :param drop_cache: Drop from the cache the pages already read, also the ones that were there before.
+    """
+    digest = new_digest()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+
+    with open(file_path, 'rb') as file:
+        _advise(file.fileno(), 0, 0, "POSIX_FADV_SEQUENTIAL")
+        offset = 0
+        while True:
+            read_bytes = file.readinto(buffer)
+            if not read_bytes:
+                break
+            digest.update(view[:read_bytes])
+            if drop_cache:
+                _advise(file.fileno(), offset, read_bytes, "POSIX_FADV_DONTNEED")
+            offset += read_bytes
+
+    return digest.hexdigest()
+
+def sampled_digest(file_path, file_size=None, sample_size=SAMPLE_SIZE):
+    """
+    Hex BLAKE2b digest of the head, the middle and the tail of a file.
+
+    The cost is the same for every file (three reads of sample_size bytes), whatever its length.
+    The middle sample starts on a transport stream packet, a file smaller than the three samples is read whole.
+    """
+    if file_size is None:
+        file_size = os.path.getsize(file_path)
+
+    if file_size <= 3 * sample_size:
+        samples = [(0, file_size)]
+    else:
+        middle = (file_size // 2 - sample_size // 2) // TS_PACKET_SIZE * TS_PACKET_SIZE
+        samples = [(0, sample_size), (middle, sample_size), (file_size - sample_size, sample_size)]
+
+    digest = new_digest()
+    with open(file_path, 'rb') as file:
+        for offset, length in samples:
+            file.seek(offset)
+            digest.update(file.read(length))
+
+    return digest.hexdigest()
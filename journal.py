@@ -0,0 +1,101 @@
+import os # for the files paths and other useful stuffs
+import json # for the records of the journal
+import threading # for the records written by several copy workers
+import print_color # for the colored prints
+
+# CONSTANTS
+JOURNAL_FILE_NAME = "journal.jsonl" # in the destination folder, after the staging prefix of the card
+
+# steps of the operations, every operation is recorded when it begins and after each of its steps
+STEP_COPY = "copy" # begin of the copy of a clip under its staging name
+STEP_COPIED = "copied" # the copy has been verified, the clip can be renamed
+STEP_CONCAT = "concat" # begin of the concatenation of the parts of a splitted video
+STEP_CONCATENATED = "concatenated" # ffmpeg succeeded, the temporary output is complete
+STEP_DONE = "done" # the video has its final name
+
+
+class SessionJournal:
+    """
+    Write-ahead journal of the copies and concatenations of a transfer.
+
+    Every operation is written (and synced) before it starts and after each step, so after a crash the journal tells which
+    files of the destination folder are complete and which ones must be removed. The journal is read at the start of
+    the next transfer and cleared at the end of a transfer, once the copied files ledger has been written.
+    """
+
+    def __init__(self, destination_folder, name_prefix="", in_debug_mode=False):
+        self.path = os.path.join(destination_folder, name_prefix + JOURNAL_FILE_NAME)
+        self.in_debug_mode = in_debug_mode
+        self._next_operation = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def begin(self, step, **fields):
+        """Record the begin of an operation, return its identifier for the next steps."""
+        with self._lock:
+            operation = self._next_operation
+            self._next_operation += 1
+            self._write({"operation": operation, "step": step, **fields})
+        return operation
+
+    def mark(self, operation, step):
+        """Record that a step of an operation is complete."""
+        with self._lock:
+            self._write({"operation": operation, "step": step})
+
+    def operations(self):
+        """
+        Operations recorded in the journal by the last transfer.
+
+        :return: List of the records of the begin of the operations, in order, each with the set of its completed steps in "steps".
+        """
+        operations = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    if not line.endswith("\n"):
+                        break # record interrupted by the crash, its step didn't happen
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    if record["operation"] in operations:
+                        operations[record["operation"]]["steps"].add(record["step"])
+                    else:
+                        operations[record["operation"]] = dict(record, steps=set())
+        except FileNotFoundError:
+            pass
+        return list(operations.values())
+
+    def clear(self):
+        """Remove the journal, all its operations are finished or undone."""
+        with self._lock:
+            self._close_file()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self._next_operation = 0
+
+    def close(self):
+        with self._lock:
+            self._close_file()
+
+    # -- internal helpers --
+    def _write(self, record):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno()) # the record must be on disk before the step it announces
+        if self.in_debug_mode:
+            print_color.purple(f"Journal: {record}")
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
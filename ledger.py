@@ -0,0 +1,216 @@
+import os # for the files paths and other useful stuffs
+import time # for the retries of the file lock on Windows
+import errno # for recognizing a file lock held by another process
+import threading # for the in-process lock
+import atomic_file # for the migration of the log
+import print_color # for the colored prints
+
+if os.name == "nt":
+    import msvcrt # for the file lock on Windows
+    import ctypes # for hiding the lock files on Windows
+else:
+    import fcntl # for the file lock on Linux and macOS
+
+# CONSTANTS
+LEDGER_FILE_NAME = "copied_files.txt" # same file used by the previous versions, so the existing ledgers keep working
+LOCK_FILE_SUFFIX = ".lock" # the lock files are hidden next to the file they protect (e.g. .copied_files.txt.lock)
+LOCK_RETRY_INTERVAL = 0.1 # seconds between two tries of a file lock held by another process, on Windows
+FILE_ATTRIBUTE_HIDDEN = 0x2
+BATCH_SIZE = 32 # number of keys kept in memory before being written to the file
+
+
+# FUNCTIONS
+def lock_path_of(path):
+    """Path of the hidden lock file of a file shared by several processes."""
+    return os.path.join(os.path.dirname(path), "." + os.path.basename(path) + LOCK_FILE_SUFFIX)
+
+def _lock_file(file):
+    """Block until the exclusive lock on the (already opened) lock file is acquired."""
+    if os.name == "nt":
+        file.seek(0)
+        # LK_LOCK gives up with an error after 10 tries a second apart, a slow share or the migration of a large log can keep it longer
+        while True:
+            try:
+                msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+                return
+            except OSError as e:
+                if e.errno not in (errno.EACCES, errno.EDEADLOCK):
+                    raise
+            time.sleep(LOCK_RETRY_INTERVAL)
+    else:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+
+def _unlock_file(file):
+    if os.name == "nt":
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+class CopiedFilesLedger:
+    """
+    In-memory index of the copied files log.
+
+    The log is read once when the ledger is opened, then every lookup is an exact match on a set.
+    New keys are buffered and appended in batches while holding a lock file, so two processes
+    that share the same destination folder never interleave their writes.
+    """
+
+    def __init__(self, destination_folder, file_name=LEDGER_FILE_NAME, batch_size=BATCH_SIZE, in_debug_mode=False):
+        self.path = os.path.join(destination_folder, file_name)
+        self.lock_path = lock_path_of(self.path)
+        self.batch_size = batch_size
+        self.in_debug_mode = in_debug_mode
+
+        self._keys = set()
+        self._pending = [] # keys added but not written to the file yet
+        self._claimed = set() # keys of the copies running, not in the ledger yet
+        self._read_offset = 0 # bytes of the log already loaded in memory
+        self._thread_lock = threading.RLock()
+
+        # Create the destination directory if it doesn't exist
+        if not os.path.exists(destination_folder):
+            os.makedirs(destination_folder)
+
+        with self._process_lock():
+            self._migrate()
+            self._load_new_entries()
+
+        if self.in_debug_mode:
+            print_color.purple(f"Copied files ledger loaded from {self.path}: {len(self._keys)} entries")
+
+    def __contains__(self, key):
+        with self._thread_lock:
+            return key in self._keys
+
+    def __len__(self):
+        with self._thread_lock:
+            return len(self._keys)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, key):
+        """Add a key to the ledger, it is written to the file when the batch is full or on flush."""
+        self.add_many([key])
+
+    def add_many(self, keys):
+        with self._thread_lock:
+            for key in keys:
+                if key not in self._keys:
+                    self._keys.add(key)
+                    self._pending.append(key)
+                    if self.in_debug_mode:
+                        print_color.purple(f"The hash {key} has been added to the copied files log")
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def claim(self, key):
+        """
+        Reserve a key for a copy about to start.
+
+        :return: False if the key is already in the ledger or reserved by another copy (e.g. the same clip on another card).
+        """
+        with self._thread_lock:
+            if key in self._keys or key in self._claimed:
+                return False
+            self._claimed.add(key)
+            return True
+
+    def release(self, keys):
+        """End the reservation of keys, the ones of a copy that failed can be claimed again."""
+        with self._thread_lock:
+            self._claimed.difference_update(keys)
+
+    def flush(self):
+        """Write the buffered keys to the log file."""
+        with self._thread_lock:
+            if not self._pending:
+                return
+            with self._process_lock():
+                # another process may have appended keys since the last read, load them first so the offset stays correct
+                self._load_new_entries()
+                with open(self.path, 'a', encoding='utf-8') as file:
+                    file.write("".join(f"{key}\n" for key in self._pending))
+                    file.flush()
+                    os.fsync(file.fileno())
+                    self._read_offset = file.tell()
+            self._pending = []
+
+    def reload(self):
+        """Load the keys appended by other processes since the last read."""
+        with self._thread_lock:
+            with self._process_lock():
+                self._load_new_entries()
+
+    def close(self):
+        self.flush()
+
+    # -- internal helpers --
+    def _process_lock(self):
+        return ProcessLock(self.lock_path)
+
+    def _load_new_entries(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as file:
+            file.seek(self._read_offset)
+            for line in file:
+                if not line.endswith("\n"):
+                    break # incomplete line, it will be read at the next load
+                key = line.strip()
+                if key:
+                    self._keys.add(key)
+                self._read_offset += len(line.encode('utf-8'))
+
+    def _migrate(self):
+        """Normalize a log written by the previous versions (duplicates, blank lines, missing final newline)."""
+        if not os.path.exists(self.path):
+            with open(self.path, 'w', encoding='utf-8'):
+                pass
+            return
+
+        with open(self.path, 'r', encoding='utf-8') as file:
+            content = file.read()
+
+        keys = []
+        seen = set()
+        for line in content.splitlines():
+            key = line.strip()
+            if key and key not in seen:
+                seen.add(key)
+                keys.append(key)
+
+        normalized = "".join(f"{key}\n" for key in keys)
+        if normalized == content:
+            return
+
+        atomic_file.write_text(self.path, normalized)
+        print_color.yellow(f"The copied files log {self.path} has been migrated ({len(keys)} unique entries).")
+
+
+class ProcessLock:
+    """Exclusive lock on a side file, shared by all the processes writing the same file (the ledger, the destination catalog)."""
+
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+        self._file = None
+
+    def __enter__(self):
+        is_new = not os.path.exists(self.lock_path)
+        self._file = open(self.lock_path, 'a+')
+        if is_new and os.name == "nt":
+            ctypes.windll.kernel32.SetFileAttributesW(self.lock_path, FILE_ATTRIBUTE_HIDDEN) # the dot doesn't hide it on Windows
+        _lock_file(self._file)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            _unlock_file(self._file)
+        finally:
+            self._file.close()
+            self._file = None
@@ -6,75 +6,160 @@ import camcorder
 import video
 import sys
 import threading
+import queue
+import metrics # for the timing of the session
+import contextlib # for running without metrics
+import progress # for the throughput and the ETA of the transfer and the transcoding
 
 # Initialize global variable
 current_preferences = {}
 
+# CONSTANTS
+OUTPUT_DRAIN_INTERVAL = 100 # milliseconds between two updates of the output widget
+OUTPUT_MAX_LINES = 5000 # lines kept in the output widget, the oldest ones are removed
+WIDGET_UPDATE_INTERVAL = 100 # milliseconds between two updates of the progress widgets
+
+# widget updates asked by the transfer and transcoding threads, applied by the Tk event loop
+widget_updates = queue.SimpleQueue()
+
 # Custom Text widget to capture stdout
 class RedirectText(tk.Text):
+    """
+    Text widget showing what is written on stdout and stderr.
+
+    write can be called from any thread: the text is put in a queue, and the Tk event loop moves it to the widget
+    in batches every OUTPUT_DRAIN_INTERVAL milliseconds. Only the last OUTPUT_MAX_LINES lines are kept.
+    """
+
     def __init__(self, *args, **kwargs):
         tk.Text.__init__(self, *args, **kwargs)
         self.configure(state=tk.DISABLED)
+        self._pending = queue.SimpleQueue() # text written and not shown yet
+        self.after(OUTPUT_DRAIN_INTERVAL, self._drain)
         
     def write(self, text):
         # Write on console
         sys.__stdout__.write(text)
 
-        # Write on the text widget
-        self.configure(state=tk.NORMAL)
-        self.insert(tk.END, text)
-        self.configure(state=tk.DISABLED)
-        self.yview(tk.END)  # Scroll to the end
+        # The widget is updated by the Tk thread
+        self._pending.put(text)
     
     def flush(self):
         # Flushing is not needed for this application
         pass
 
+    def _drain(self):
+        chunks = []
+        while True:
+            try:
+                chunks.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+
+        if chunks:
+            text = "".join(chunks)
+            if text.count("\n") > OUTPUT_MAX_LINES:
+                text = "\n".join(text.split("\n")[-OUTPUT_MAX_LINES - 1:]) # a flood would be removed right after being inserted
+
+            # Write on the text widget, then drop the oldest lines
+            self.configure(state=tk.NORMAL)
+            self.insert(tk.END, text)
+            lines = int(self.index("end-1c").split(".")[0])
+            if lines > OUTPUT_MAX_LINES:
+                self.delete("1.0", f"{lines - OUTPUT_MAX_LINES + 1}.0")
+            self.configure(state=tk.DISABLED)
+            self.yview(tk.END)  # Scroll to the end
+
+        self.after(OUTPUT_DRAIN_INTERVAL, self._drain)
+
 # FUNCTIONS
 
-def update_progress(value):
-    """Function to update the progress bar."""
+def on_tk_loop(function):
+    """
+    Make a function that updates the widgets callable from any thread.
+
+    The call is put in a queue and run by the Tk event loop (see drain_widget_updates). When the same function is
+    called several times between two drains, only its last call is run.
+    """
+    def call_on_tk_loop(*args, **kwargs):
+        widget_updates.put((function, args, kwargs))
+    return call_on_tk_loop
+
+def drain_widget_updates():
+    """Run the widget updates asked by the other threads, on the Tk event loop."""
+    last_calls = {} # function -> (args, kwargs) of its last call, in the order of the first call
+    while True:
+        try:
+            function, args, kwargs = widget_updates.get_nowait()
+        except queue.Empty:
+            break
+        last_calls[function] = (args, kwargs)
+
+    for function, (args, kwargs) in last_calls.items():
+        function(*args, **kwargs)
+
+    root.after(WIDGET_UPDATE_INTERVAL, drain_widget_updates)
+
+@on_tk_loop
+def update_progress(value, throughput=None, eta=None):
+    """Function to update the progress bar, with the throughput of the copies and the time left if known."""
     progress_bar['value'] = value
     # Update the percentage label
-    progress_label.config(text=f"Transferring the files: {value:.0f}% completed")
-
-def update_H264_low_progress(value):
-    """Function to update the progress bar."""
+    status = f" ({progress.format_throughput(throughput)}, ETA {progress.format_eta(eta)})" if throughput else ""
+    progress_label.config(text=f"Transferring the files: {value:.0f}% completed" + status)
+
+def encoding_status(fps=None, eta=None):
+    """Text with the fps and the ETA of the transcoding, empty if they are unknown."""
+    status = []
+    if fps:
+        status.append(f"{fps:.0f} fps")
+    if eta is not None:
+        status.append(f"ETA {progress.format_eta(eta)}")
+    return f" ({', '.join(status)})" if status else ""
+
+@on_tk_loop
+def update_H264_low_progress(value, fps=None, eta=None):
+    """Function to update the progress bar, with the speed of the running encoding and the time left if known."""
     progress_bar_h264_4M['value'] = value
     # Update the percentage label
-    label_progress_h264_4M.config(text=f"Transcoding to H264 low bitrate: {value:.0f}% completed")
+    label_progress_h264_4M.config(text=f"Transcoding to H264 low bitrate: {value:.0f}% completed" + encoding_status(fps, eta))
 
-def update_H264_high_progress(value):
-    """Function to update the progress bar."""
+@on_tk_loop
+def update_H264_high_progress(value, fps=None, eta=None):
+    """Function to update the progress bar, with the speed of the running encoding and the time left if known."""
     progress_bar_h264_8M['value'] = value
     # Update the percentage label
-    label_progress_h264_8M.config(text=f"Transcoding to H264 high bitrate: {value:.0f}% completed")
+    label_progress_h264_8M.config(text=f"Transcoding to H264 high bitrate: {value:.0f}% completed" + encoding_status(fps, eta))
 
-def update_H265_progress(value):
-    """Function to update the progress bar."""
+@on_tk_loop
+def update_H265_progress(value, fps=None, eta=None):
+    """Function to update the progress bar, with the speed of the running encoding and the time left if known."""
     progress_bar_h265_CRF_23['value'] = value
     # Update the percentage label
-    label_progress_h265_CRF_23.config(text=f"Transcoding to H265 variable bitrate: {value:.0f}% completed")
+    label_progress_h265_CRF_23.config(text=f"Transcoding to H265 variable bitrate: {value:.0f}% completed" + encoding_status(fps, eta))
 
 
 
 def threaded_transfer():
     """Function to perform the transfer in a separate thread."""
     def run_transfer():
-        to_be_transcoded = [] # list of videos to be transcoded
-        try:
-            to_be_transcoded = camcorder.start_transfer(update_progress)
-        except Exception as e:
-            messagebox.showerror("Error", f"Transfer failed: {e}")
-        finally:
-            # transcode the videos
-            if to_be_transcoded:
-                # call the function to transcode the videos
-                video.transcode_list_of_videos(to_be_transcoded, preferences=current_preferences, update_H264_low_progress=update_H264_low_progress, update_H264_high_progress=update_H264_high_progress, update_H265_progress=update_H265_progress, overwrite=False, in_debug_mode=current_preferences["in_debug_mode"])
-
-
-            # Re-enable the start button
-            button_start_transfer.config(state=tk.NORMAL)
+        # every video is transcoded as soon as it has been transferred, while the next ones are still copying
+        to_be_transcoded = queue.Queue() # videos to be transcoded, None marks the end of the transfer
+        transcode_thread = threading.Thread(target=video.transcode_queue_of_videos, args=(to_be_transcoded,), kwargs=dict(preferences=current_preferences, update_H264_low_progress=update_H264_low_progress, update_H264_high_progress=update_H264_high_progress, update_H265_progress=update_H265_progress, overwrite=False, in_debug_mode=current_preferences["in_debug_mode"]))
+        transcode_thread.start()
+        # one metrics session for the transfer and the transcoding, closed when both are finished
+        with metrics.session(current_preferences["destination_folder"], current_preferences["in_debug_mode"]) if current_preferences["record_metrics"] else contextlib.nullcontext():
+            try:
+                camcorder.start_transfer(update_progress, on_video_transferred=to_be_transcoded.put)
+            except Exception as e:
+                on_tk_loop(messagebox.showerror)("Error", f"Transfer failed: {e}")
+            finally:
+                # wait for the videos already transferred to be transcoded
+                to_be_transcoded.put(None)
+                transcode_thread.join()
+
+                # Re-enable the start button
+                on_tk_loop(button_start_transfer.config)(state=tk.NORMAL)
     
     # Run the transfer function in a new thread
     transfer_thread = threading.Thread(target=run_transfer)
@@ -442,5 +527,8 @@ sys.stderr = output_text
 # Load preferences on application start
 on_open()
 
+# Apply the progress reported by the transfer and transcoding threads
+root.after(WIDGET_UPDATE_INTERVAL, drain_widget_updates)
+
 # Start the main loop of the application
 root.mainloop()
@@ -0,0 +1,155 @@
+import os # for the files paths and other useful stuffs
+import json # for the metrics file
+import time # for measuring the stages
+import datetime # for the date of the session
+import threading # for the records written by several workers
+import contextlib # for the session context manager
+import print_color # for the colored prints
+
+# CONSTANTS
+METRICS_FILE_NAME = "session_metrics.jsonl" # one JSON record per line, appended in the destination folder
+MB = 1024 * 1024
+
+
+class StageRecord:
+    """Timing of one stage on one clip, filled by the stage context manager."""
+
+    def __init__(self, stage, clip=None, bytes_moved=0, queue_wait=None):
+        self.stage = stage
+        self.clip = clip
+        self.bytes_moved = bytes_moved
+        self.queue_wait = queue_wait
+        self.error = None
+        self.start = time.time()
+        self.seconds = None
+
+    def fail(self, error="failed"):
+        """Mark the stage as failed, for the functions that handle their errors without raising."""
+        self.error = str(error)
+
+    def as_dict(self):
+        return {
+            "stage": self.stage,
+            "clip": self.clip,
+            "start": self.start,
+            "seconds": self.seconds,
+            "bytes": self.bytes_moved,
+            "MB_per_s": self.bytes_moved / MB / self.seconds if self.bytes_moved and self.seconds else None,
+            "queue_wait": self.queue_wait,
+            "error": self.error,
+        }
+
+
+class MetricsSession:
+    """Records of the stages of a session, written as JSON lines with a summary at the end."""
+
+    def __init__(self, metrics_path, in_debug_mode=False):
+        self.metrics_path = metrics_path
+        self.in_debug_mode = in_debug_mode
+        self.start = time.time()
+        self.records = []
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def summary(self):
+        """Statistics of every stage: count, errors, wall time, bytes, MB/s and queue wait."""
+        stages = {}
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            stage = stages.setdefault(record.stage, {"count": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0, "bytes": 0, "queue_wait": 0.0})
+            stage["count"] += 1
+            stage["errors"] += 1 if record.error else 0
+            stage["seconds"] += record.seconds or 0
+            stage["max_seconds"] = max(stage["max_seconds"], record.seconds or 0)
+            stage["bytes"] += record.bytes_moved or 0
+            stage["queue_wait"] += record.queue_wait or 0
+        for stage in stages.values():
+            # throughput of a single worker: bytes over the time spent in the stage
+            stage["MB_per_s"] = stage["bytes"] / MB / stage["seconds"] if stage["bytes"] and stage["seconds"] else None
+            stage["mean_seconds"] = stage["seconds"] / stage["count"]
+        return stages
+
+    def close(self):
+        """Append the records and the summary to the metrics file and print the summary."""
+        summary = self.summary()
+        session = {
+            "session": datetime.datetime.fromtimestamp(self.start).strftime('%Y-%m-%d_%H-%M-%S'),
+            "wall_seconds": time.time() - self.start,
+        }
+
+        try:
+            os.makedirs(os.path.dirname(self.metrics_path) or ".", exist_ok=True)
+            with open(self.metrics_path, 'a', encoding='utf-8') as file:
+                with self._lock:
+                    for record in self.records:
+                        file.write(json.dumps({**session, **record.as_dict()}) + "\n")
+                file.write(json.dumps({**session, "summary": summary}) + "\n")
+        except OSError as e:
+            print_color.red(f"Error writing the metrics to {self.metrics_path}: {e}")
+
+        print(f"Session metrics ({session['wall_seconds']:.1f} s):")
+        for name, stage in summary.items():
+            line = f"  {name}: {stage['count']} in {stage['seconds']:.1f} s (max {stage['max_seconds']:.1f} s)"
+            if stage["MB_per_s"]:
+                line += f", {stage['bytes'] / MB:.0f} MB at {stage['MB_per_s']:.1f} MB/s"
+            if stage["queue_wait"]:
+                line += f", waited {stage['queue_wait']:.1f} s in queue"
+            if stage["errors"]:
+                print_color.red(line + f", {stage['errors']} errors")
+            else:
+                print(line)
+        if self.in_debug_mode:
+            print_color.purple(f"Metrics written to {self.metrics_path}")
+
+
+# the session of the current transfer/transcoding, the instrumented functions record into it
+_current_session = None
+_session_lock = threading.Lock()
+
+
+# FUNCTIONS
+@contextlib.contextmanager
+def session(destination_folder, in_debug_mode=False):
+    """
+    Record the stages run inside the block, then write them to the metrics file of the destination folder.
+
+    A session opened while another one is active joins it, so the transfer and the transcoding of the GUI are one session.
+    """
+    global _current_session
+    with _session_lock:
+        owner = _current_session is None
+        if owner:
+            _current_session = MetricsSession(os.path.join(destination_folder, METRICS_FILE_NAME), in_debug_mode)
+        current = _current_session
+    try:
+        yield current
+    finally:
+        if owner:
+            with _session_lock:
+                _current_session = None
+            current.close()
+
+@contextlib.contextmanager
+def stage(name, clip=None, bytes_moved=0, queue_wait=None):
+    """
+    Measure the wall time of a stage on a clip, an exception raised inside the block counts as an error.
+
+    :param bytes_moved: Bytes read or written by the stage, can be set later on the yielded record.
+    :param queue_wait: Seconds the clip waited before the stage could start.
+    """
+    record = StageRecord(name, clip, bytes_moved, queue_wait)
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record.fail(e)
+        raise
+    finally:
+        record.seconds = time.perf_counter() - started
+        current = _current_session
+        if current is not None:
+            current.add(record)
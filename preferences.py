@@ -11,6 +11,34 @@ DEFAULT_PREFERENCES = {
     "in_debug_mode": True,
     "root_camcorder": "",
     "size_limit": 2124000000,
+    "use_avchd_index": True,
+    "fingerprint_mode": "metadata",
+    "record_metrics": True,
+    "source_io_workers": 2,
+    "destination_io_workers": 2,
+    "copy_method": "auto",
+    "copy_chunk_size": 8388608,
+    "copy_readahead": 33554432,
+    "copy_drop_cache": True,
+    "transcode_thread_budget": 0,
+    "transcode_workers": 0,
+    "transcode_priority": "shortest_first",
+    "multi_output": True,
+    "segment_transcode": {
+        "enabled": False,
+        "min_duration": 1200,
+        "segment_duration": 120,
+        "workers": 0
+    },
+    "encoder_backend": "auto",
+    "encoder_presets": {
+        "nvenc": "p4",
+        "software": "medium"
+    },
+    "encoder_threads_per_job": {
+        "nvenc": 2,
+        "software": 8
+    },
     "H264_low": {
         "enabled": True,
         "bitrate": "4M"
@@ -0,0 +1,185 @@
+import time # for the throughput of the transfer
+import threading # for the bytes reported by several copy workers
+import collections # for the recent samples of the throughput
+
+# CONSTANTS
+PROGRESS_ARGUMENTS = ['-progress', 'pipe:1', '-nostats'] # ffmpeg writes key=value blocks on stdout instead of the status line
+
+THROUGHPUT_WINDOW = 10.0 # seconds of the recent bytes used for the throughput of the transfer
+REPORT_INTERVAL = 0.25 # minimum seconds between two reports of the transfer progress
+MB = 1024 * 1024
+
+
+class EncodeProgress:
+    """
+    Position of a running ffmpeg process, read from the key=value blocks of its -progress output.
+
+    fraction and eta are None when the duration of the source is unknown.
+    """
+
+    def __init__(self, duration=None):
+        self.duration = duration # seconds of the source
+        self.out_time = 0.0 # seconds of the source already encoded
+        self.fps = None # frames encoded per second
+        self.speed = None # seconds of the source encoded per second
+        self.finished = False
+
+    @property
+    def fraction(self):
+        if self.finished:
+            return 1.0
+        if not self.duration:
+            return None
+        return min(1.0, self.out_time / self.duration)
+
+    @property
+    def eta(self):
+        """Seconds left to the end of the encoding."""
+        if self.finished:
+            return 0.0
+        if not self.duration or not self.speed:
+            return None
+        return max(0.0, self.duration - self.out_time) / self.speed
+
+    def update(self, key, value):
+        """Apply a key=value line, return True at the end of a block."""
+        if key == "out_time_us":
+            if value != "N/A":
+                self.out_time = int(value) / 1_000_000
+        elif key == "fps":
+            self.fps = float(value)
+        elif key == "speed":
+            # e.g. "1.53x", "N/A" at the start
+            self.speed = float(value.rstrip("x")) if value.rstrip("x") not in ("N/A", "") else None
+        elif key == "progress":
+            self.finished = value == "end"
+            return True
+        return False
+
+    def as_dict(self):
+        return {
+            "duration": self.duration,
+            "out_time": self.out_time,
+            "fraction": self.fraction,
+            "fps": self.fps,
+            "speed": self.speed,
+            "eta": self.eta,
+            "finished": self.finished,
+        }
+
+    def __repr__(self):
+        fraction = f"{self.fraction * 100:.1f}%" if self.fraction is not None else f"{self.out_time:.1f} s"
+        return f"EncodeProgress({fraction}, {self.fps} fps, eta {self.eta})"
+
+
+class TransferProgress:
+    """
+    Bytes of a transfer already copied against the bytes planned, with the throughput of the last seconds and the ETA.
+
+    advance and skip can be called from several copy workers. on_progress is called with the TransferProgress at most
+    every REPORT_INTERVAL seconds, and every time a file is complete.
+    """
+
+    def __init__(self, total_bytes, on_progress=None, window=THROUGHPUT_WINDOW, report_interval=REPORT_INTERVAL):
+        self.total_bytes = total_bytes
+        self.done_bytes = 0
+        self.on_progress = on_progress
+        self.window = window
+        self.report_interval = report_interval
+        self._samples = collections.deque([(time.perf_counter(), 0)]) # (time, bytes done) of the last window seconds
+        self._last_report = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def fraction(self):
+        with self._lock:
+            return min(1.0, self.done_bytes / self.total_bytes) if self.total_bytes else 1.0
+
+    @property
+    def percentage(self):
+        return self.fraction * 100
+
+    @property
+    def throughput(self):
+        """Bytes per second over the last window seconds, None before the first bytes."""
+        with self._lock:
+            (first_time, first_bytes), (last_time, last_bytes) = self._samples[0], self._samples[-1]
+        if last_time <= first_time or last_bytes <= first_bytes:
+            return None
+        return (last_bytes - first_bytes) / (last_time - first_time)
+
+    @property
+    def eta(self):
+        """Seconds left to the end of the transfer at the current throughput."""
+        throughput = self.throughput
+        with self._lock:
+            remaining = max(0, self.total_bytes - self.done_bytes)
+        if not remaining:
+            return 0.0
+        return remaining / throughput if throughput else None
+
+    def advance(self, bytes_done, file_complete=False):
+        """Count bytes copied, report the progress if the last report is old enough or a file is complete."""
+        now = time.perf_counter()
+        with self._lock:
+            self.done_bytes += bytes_done
+            self._samples.append((now, self.done_bytes))
+            while len(self._samples) > 2 and self._samples[1][0] < now - self.window:
+                self._samples.popleft()
+            report = file_complete or now - self._last_report >= self.report_interval
+            if report:
+                self._last_report = now
+        if report and self.on_progress:
+            self.on_progress(self)
+
+    def skip(self, bytes_skipped):
+        """Remove from the plan the bytes of a file that doesn't need to be copied."""
+        with self._lock:
+            self.total_bytes = max(0, self.total_bytes - bytes_skipped)
+        self.advance(0, file_complete=True)
+
+    def as_dict(self):
+        return {
+            "total_bytes": self.total_bytes,
+            "done_bytes": self.done_bytes,
+            "fraction": self.fraction,
+            "throughput": self.throughput,
+            "eta": self.eta,
+        }
+
+    def __repr__(self):
+        return f"TransferProgress({self.percentage:.1f}%, {format_throughput(self.throughput)}, eta {self.eta})"
+
+
+# FUNCTIONS
+def read_progress(lines, encode_progress, on_progress=None):
+    """
+    Parse the -progress output of ffmpeg until it ends, calling on_progress with encode_progress after every block.
+
+    :param lines: Iterable of the text lines written by ffmpeg (e.g. the stdout of the process).
+    """
+    for line in lines:
+        key, separator, value = line.strip().partition("=")
+        if not separator:
+            continue
+        try:
+            end_of_block = encode_progress.update(key, value.strip())
+        except ValueError:
+            continue # a value ffmpeg could not compute yet
+        if end_of_block and on_progress:
+            on_progress(encode_progress)
+    return encode_progress
+
+def format_eta(seconds):
+    """ETA as H:MM:SS, "--:--" when unknown."""
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+def format_throughput(bytes_per_second):
+    """Throughput as MB/s, "-- MB/s" when unknown."""
+    if bytes_per_second is None:
+        return "-- MB/s"
+    return f"{bytes_per_second / MB:.1f} MB/s"
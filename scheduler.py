@@ -0,0 +1,184 @@
+import os # for the number of cores and the size of the videos
+import queue # for the jobs waiting to be run
+import threading # for the workers
+import itertools # for the order of submission of the jobs
+import time # for the time the jobs wait in the queue
+import metrics # for the timing of the jobs
+import print_color # for the colored prints
+
+# CONSTANTS
+THREADS_PER_JOB = 4 # threads given to every ffmpeg process when the number of workers is automatic
+
+PRIORITY_FIFO = "fifo" # the jobs run in the order they are submitted
+PRIORITY_SHORTEST_FIRST = "shortest_first" # the smallest videos run first
+# any profile name (e.g. "H265_VBR") as priority runs the jobs of that profile first, then the shortest ones
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+# FUNCTIONS
+def split_thread_budget(thread_budget=0, workers=0, threads_per_job=0, max_sessions=None, outputs_per_job=1):
+    """
+    Return the number of concurrent ffmpeg processes and the threads each of them can use.
+
+    :param thread_budget: Threads for all the ffmpeg processes together, 0 uses all the cores of the machine.
+    :param workers: Number of concurrent ffmpeg processes, 0 sizes it on the thread budget.
+    :param threads_per_job: Threads wanted by every ffmpeg process when the workers are automatic, 0 for THREADS_PER_JOB.
+    :param max_sessions: Encoders the backend can open at the same time (see encoders.BACKENDS), None if unlimited.
+                         The workers are limited so that all their encoders fit, even when set by the user.
+    :param outputs_per_job: Encoders opened by every job, one per output.
+    """
+    if thread_budget <= 0:
+        thread_budget = os.cpu_count() or 1
+    if workers <= 0:
+        workers = max(1, thread_budget // (threads_per_job or THREADS_PER_JOB))
+    if max_sessions:
+        workers = min(workers, max(1, max_sessions // outputs_per_job))
+    threads_per_job = max(1, thread_budget // workers)
+    return workers, threads_per_job
+
+
+class TranscodeJob:
+    """
+    A video to transcode with one profile (or several joined by "+").
+
+    run is called with the number of threads it can use, a callback for the progress.EncodeProgress of the encoding and the
+    number of encoders it can open at the same time (None if unlimited).
+    """
+
+    def __init__(self, video, profile, run):
+        self.video = video
+        self.profile = profile
+        self.run = run
+        self.status = JOB_QUEUED
+        self.submitted = None # time of the submission, to measure the wait in the queue
+        self.progress = None # last progress.EncodeProgress reported while the job runs
+
+    def __repr__(self):
+        return f"TranscodeJob({self.profile}: {os.path.basename(self.video)}, {self.status})"
+
+
+class TranscodeScheduler:
+    """
+    Pool of workers running transcode jobs in priority order.
+
+    The global thread budget is split between the workers, so the concurrent ffmpeg processes don't fight for the same cores.
+    The encoder sessions of a hardware backend are split the same way, so the workers never open more encoders than the device allows.
+    on_job_status is called with the job every time its status changes, on_job_progress with the job every time its encoding
+    reports a progress. on_profile_progress is called with the profile, the percentage of its jobs already encoded (counting the
+    running ones by their position) and the keyword arguments fps and eta (seconds left for the jobs submitted so far).
+    """
+
+    def __init__(self, thread_budget=0, workers=0, threads_per_job=0, priority=PRIORITY_SHORTEST_FIRST, on_job_status=None, on_profile_progress=None, in_debug_mode=False, on_job_progress=None,
+                 max_sessions=None, outputs_per_job=1):
+        self.workers, self.threads_per_job = split_thread_budget(thread_budget, workers, threads_per_job, max_sessions, outputs_per_job)
+        self.sessions_per_job = max(1, max_sessions // self.workers) if max_sessions else None
+        self.priority = priority
+        self.on_job_status = on_job_status
+        self.on_profile_progress = on_profile_progress
+        self.on_job_progress = on_job_progress
+        self.in_debug_mode = in_debug_mode
+
+        self.failed_jobs = []
+
+        self._jobs = queue.PriorityQueue()
+        self._sequence = itertools.count() # keeps the jobs with the same priority in submission order
+        self._lock = threading.Lock()
+        self._submitted = {} # jobs submitted for every profile
+        self._completed = {} # jobs completed (done or failed) for every profile
+        self._running = {} # jobs running for every profile
+        self._started = {} # time the first job of every profile started, for its ETA
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(self.workers)]
+
+        if self.in_debug_mode:
+            sessions = f" and {self.sessions_per_job} encoder sessions" if self.sessions_per_job else ""
+            print_color.purple(f"Transcode scheduler: {self.workers} workers with {self.threads_per_job} threads{sessions} each, priority {self.priority}")
+
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, job):
+        with self._lock:
+            self._submitted[job.profile] = self._submitted.get(job.profile, 0) + 1
+            self._completed.setdefault(job.profile, 0)
+        job.submitted = time.perf_counter()
+        self._jobs.put((self._priority_of(job), next(self._sequence), job))
+        self._set_status(job, JOB_QUEUED)
+
+    def close(self):
+        """No more jobs will be submitted, the workers stop when the queue is empty."""
+        for _ in self._threads:
+            self._jobs.put(((float("inf"),), next(self._sequence), None))
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    # -- internal helpers --
+    def _priority_of(self, job):
+        if self.priority == PRIORITY_FIFO:
+            return (0,)
+        try:
+            size = os.path.getsize(job.video)
+        except OSError:
+            size = 0
+        if self.priority == PRIORITY_SHORTEST_FIRST:
+            return (size,)
+        return (0 if self.priority in job.profile.split("+") else 1, size)
+
+    def _set_status(self, job, status):
+        job.status = status
+        if self.on_job_status:
+            self.on_job_status(job)
+
+    def _work(self):
+        while True:
+            _, _, job = self._jobs.get()
+            if job is None:
+                break
+
+            self._set_status(job, JOB_RUNNING)
+            with self._lock:
+                self._running.setdefault(job.profile, set()).add(job)
+                self._started.setdefault(job.profile, time.perf_counter())
+            queue_wait = time.perf_counter() - job.submitted
+            try:
+                video_size = os.path.getsize(job.video)
+            except OSError:
+                video_size = 0
+            with metrics.stage("transcode", f"{os.path.basename(job.video)} ({job.profile})", video_size, queue_wait) as record:
+                try:
+                    succeeded = job.run(self.threads_per_job, lambda encode_progress, job=job: self._job_progress(job, encode_progress), self.sessions_per_job)
+                except Exception as e:
+                    print_color.red(f"Error during the transcoding of {job.video}: {e}")
+                    succeeded = False
+                if not succeeded:
+                    record.fail()
+            self._set_status(job, JOB_DONE if succeeded else JOB_FAILED)
+
+            with self._lock:
+                if not succeeded:
+                    self.failed_jobs.append(job)
+                self._running[job.profile].discard(job)
+                self._completed[job.profile] += 1
+            self._report_profile_progress(job.profile)
+
+    def _job_progress(self, job, encode_progress):
+        job.progress = encode_progress
+        if self.on_job_progress:
+            self.on_job_progress(job)
+        self._report_profile_progress(job.profile, encode_progress.fps)
+
+    def _report_profile_progress(self, profile, fps=None):
+        with self._lock:
+            # a running job counts for the part already encoded, when the duration of its video is known
+            encoded = self._completed[profile] + sum((running_job.progress.fraction or 0) for running_job in self._running.get(profile, ()) if running_job.progress)
+            submitted = self._submitted[profile]
+            elapsed = time.perf_counter() - self._started[profile]
+        percentage = encoded / submitted * 100
+        eta = elapsed * (submitted - encoded) / encoded if encoded else None
+        if self.on_profile_progress:
+            self.on_profile_progress(profile, percentage, fps=fps, eta=eta)
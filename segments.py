@@ -0,0 +1,366 @@
+"""
+Segment-parallel transcoding of the long recordings.
+
+The source is cut on its keyframes into segments of about segment_duration seconds, every segment is encoded by its
+own ffmpeg process (several at the same time), then the encoded segments are joined without re-encoding and the audio
+is copied from the source in the same pass. A segment goes from a keyframe to the next cut keyframe, and its entry in the
+join lasts exactly the time between the two keyframes: the concat demuxer puts the first frame of every segment at the
+time it had in the source, and the audio never goes through the segments, so the output has no drift and no missing or
+repeated frame. The join keeps the times of the source: the concat demuxer starts the video at 0, so it is delayed by the
+time its first frame had in the source, and the audio is put back at its own start. The audio and the video of the
+camcorders rarely start together, a single ffmpeg process keeps the gap and so does the join.
+
+The segments are kept in a folder named after the source and the encode parameters, with a checkpoint of the segments
+already encoded. After an interruption, the next run encodes only the missing segments, and the outputs are joined only
+once all the segments are present.
+"""
+import os # for the files paths and other useful stuffs
+import json # for the checkpoint of the segments
+import shutil # for the folder of the segments, removed once the outputs are joined
+import tempfile # for the errors of ffmpeg
+import threading # for the progress of the segments encoded at the same time
+import subprocess # for the ffmpeg command execution
+import concurrent.futures # for the pool of segment encoders
+import ffmpeg # for the keyframes of the source
+import print_color # for the colored prints
+import progress # for the progress of the encodings
+import transcode_manifest # for the temporary names of the segments
+import atomic_file # for the checkpoint of the segments
+
+# CONSTANTS
+SEGMENT_DURATION = 120 # seconds of the source in a segment, the cut is on the first keyframe after it
+SEGMENT_THREADS = 2 # threads of every segment encoder when the number of segments encoded at the same time is automatic
+SEEK_MARGIN = 0.001 # seconds the seek starts before the keyframe of a segment, less than a frame, more than the rounding of the times
+SEGMENT_EXTENSION = ".ts" # MPEG-TS keeps the parameters of the encoder in every segment, they can be joined as they are
+SEGMENTS_PREFIX = ".segments_" # folder of the encoded segments, next to the outputs, followed by the key of the transcoding
+CHECKPOINT_FILE_NAME = "checkpoint.json" # in the folder of the segments
+
+
+class Segment:
+    """Frames of the source from start (a keyframe, the first frame for the first segment) to the keyframe at end (excluded), in seconds from the start of the source."""
+
+    def __init__(self, index, start, end):
+        self.index = index
+        self.start = start
+        self.end = end # None for the last segment, up to the end of the source
+        self.progress = None # progress.EncodeProgress while it is encoded
+
+    @property
+    def duration(self):
+        return None if self.end is None else self.end - self.start
+
+    def __repr__(self):
+        return f"Segment({self.index}, {self.start:.3f}, {self.end if self.end is None else round(self.end, 3)})"
+
+
+class SegmentCheckpoint:
+    """
+    Cut points of a transcoding and the segments already encoded, in the folder of its segments.
+
+    A segment is recorded once all its outputs are complete and have their final name, so a segment interrupted by a
+    crash is encoded again. The keyframes of the cuts are kept so that the next run cuts the source at the same times.
+    """
+
+    def __init__(self, segments_directory, source_name):
+        self.path = os.path.join(segments_directory, CHECKPOINT_FILE_NAME)
+        self.source_name = source_name
+        self.starts = None # time of the start of every segment (its keyframe, the first frame for the first one), None before the first run
+        self.done = set() # indexes of the segments encoded
+        self._lock = threading.Lock()
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                checkpoint = json.load(file)
+            self.starts = [float(start) for start in checkpoint["starts"]]
+            self.done = {int(index) for index in checkpoint["done"]}
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            print_color.yellow(f"The segments checkpoint {self.path} can't be read ({e}), all the segments are encoded again.")
+            self.starts = None
+            self.done = set()
+
+    def segments(self):
+        """Segments of the previous run, None if there is none."""
+        if not self.starts:
+            return None
+        segments = [Segment(index, start, end) for index, (start, end) in enumerate(zip(self.starts, self.starts[1:]))]
+        segments.append(Segment(len(self.starts) - 1, self.starts[-1], None))
+        return segments
+
+    def start(self, segments):
+        """Record the cuts, the segments recorded with other cuts are forgotten."""
+        starts = [segment.start for segment in segments]
+        with self._lock:
+            if starts != self.starts:
+                self.starts = starts
+                self.done = set()
+            self._save()
+
+    def is_done(self, segment, segment_paths):
+        return segment.index in self.done and all(os.path.exists(path) for path in segment_paths)
+
+    def mark_done(self, segment):
+        with self._lock:
+            self.done.add(segment.index)
+            self._save()
+
+    # -- internal helpers --
+    def _save(self):
+        atomic_file.write_json(self.path, {"source": self.source_name, "starts": self.starts, "done": sorted(self.done)})
+
+
+# FUNCTIONS
+def video_timeline(input_video_path):
+    """
+    Time of the first frame and times of the keyframes of the first video stream, in seconds from the start of the
+    source (as counted by -ss). The first frame is after 0 when another stream, usually the audio, starts before the video.
+
+    Only the packets are read, nothing is decoded.
+
+    :return: Tuple (time of the first frame, sorted list of the keyframes).
+    """
+    probe = ffmpeg.probe(input_video_path, select_streams='v:0', show_entries='packet=pts_time,flags:format=start_time')
+    start_time = float(probe.get("format", {}).get("start_time") or 0)
+    times = []
+    keyframes = []
+    for packet in probe.get("packets", []):
+        if packet.get("pts_time") in (None, "N/A"):
+            continue
+        times.append(float(packet["pts_time"]) - start_time)
+        if "K" in packet.get("flags", ""):
+            keyframes.append(times[-1])
+    return max(0.0, min(times, default=0.0)), sorted(keyframes)
+
+def source_start_time(input_video_path):
+    """Start of the source in its own timestamps, the times of the segments are counted from it."""
+    probe = ffmpeg.probe(input_video_path)
+    return float(probe.get("format", {}).get("start_time") or 0)
+
+def plan_segments(video_start, keyframes, segment_duration=SEGMENT_DURATION):
+    """Cuts of the source, on the first keyframe after every segment_duration seconds. The first segment starts with the first frame."""
+    segments = [Segment(0, video_start, None)]
+    for keyframe in keyframes:
+        if keyframe - segments[-1].start >= segment_duration:
+            segments[-1].end = keyframe
+            segments.append(Segment(len(segments), keyframe, None))
+    return segments
+
+def split_segment_threads(threads=None, workers=0, outputs=1, max_sessions=None):
+    """
+    Return the number of segments encoded at the same time and the threads of each encoder.
+
+    The segment encoders share the threads of the job, so a segmented job loads the machine like any other job of the scheduler.
+
+    :param threads: Threads of the job, None for all the cores.
+    :param workers: Segments encoded at the same time, 0 for one every SEGMENT_THREADS threads of the job.
+    :param outputs: Outputs written by every segment encoder, each one opens an encoder.
+    :param max_sessions: Encoders the job can open at the same time, its share of the sessions of the backend (see
+                         scheduler.TranscodeScheduler), None if unlimited.
+    """
+    threads = threads or os.cpu_count() or 1
+    if workers <= 0:
+        workers = max(1, threads // SEGMENT_THREADS)
+    if max_sessions:
+        workers = min(workers, max(1, max_sessions // outputs))
+    return workers, max(1, threads // workers)
+
+def transcode_segments(input_video_path, outputs, video_filter, segments_key, input_arguments=(), duration=None, threads=None, workers=0,
+                       segment_duration=SEGMENT_DURATION, in_debug_mode=False, on_progress=None, max_sessions=None):
+    """
+    Transcode a video to several outputs, encoding its segments in parallel.
+
+    :param outputs: List of (output video path, encoder arguments), the outputs are written at these paths.
+    :param video_filter: Filters applied to the video before the encoders (e.g. the deinterlacing).
+    :param segments_key: Key of the source content and of the encode parameters, it names the folder of the segments
+                         so that an interrupted transcoding is resumed only with the same source and parameters.
+    :param input_arguments: ffmpeg arguments before the input (hardware decoding).
+    :param duration: Duration of the source in seconds, for the progress.
+    :param threads: Threads of the job, shared by its segment encoders (see split_segment_threads), None for all the cores.
+    :param workers: Segments encoded at the same time, 0 for automatic.
+    :param on_progress: Called with a progress.EncodeProgress of the whole video, the speed and fps are the sum of the running segments.
+    :param max_sessions: Encoders the job can open at the same time (see split_segment_threads), None if unlimited.
+    :return: True if all the outputs have been written.
+    """
+    output_directory = os.path.dirname(os.path.abspath(outputs[0][0]))
+    segments_directory = os.path.join(output_directory, SEGMENTS_PREFIX + segments_key)
+    source_name = os.path.basename(input_video_path)
+    try:
+        _remove_stale_segments(output_directory, segments_directory, source_name)
+        os.makedirs(segments_directory, exist_ok=True)
+        checkpoint = SegmentCheckpoint(segments_directory, source_name)
+        segments = checkpoint.segments()
+        if segments is None:
+            segments = plan_segments(*video_timeline(input_video_path), segment_duration)
+        checkpoint.start(segments)
+        source_start = source_start_time(input_video_path)
+    except (ffmpeg.Error, OSError, ValueError, KeyError) as e:
+        print_color.red(f"Error preparing the segments of {input_video_path}: {e}")
+        return False
+
+    # the segments encoded by a previous run are kept, with their part of the progress
+    missing_segments = []
+    for segment in segments:
+        if checkpoint.is_done(segment, [segment_path(segments_directory, segment, index) for index in range(len(outputs))]):
+            segment.progress = progress.EncodeProgress(segment.duration)
+            segment.progress.out_time = segment.duration if segment.duration is not None else max(0.0, (duration or 0) - segment.start)
+            segment.progress.finished = True
+        else:
+            missing_segments.append(segment)
+    if len(missing_segments) < len(segments):
+        print_color.yellow(f"{len(segments) - len(missing_segments)} of the {len(segments)} segments of {input_video_path} have already been transcoded, resuming.")
+
+    if missing_segments:
+        workers, segment_threads = split_segment_threads(threads, workers, len(outputs), max_sessions)
+        workers = min(workers, len(missing_segments))
+        print(f"Transcoding {len(missing_segments)} segments of the video, {workers} at the same time with {segment_threads} threads each...")
+        if in_debug_mode:
+            print_color.purple(f"Segments of {input_video_path}: {missing_segments}")
+        if not _encode_segments(input_video_path, segments, missing_segments, outputs, segments_directory, checkpoint, video_filter, input_arguments, duration, segment_threads, workers, in_debug_mode, on_progress):
+            return False # the encoded segments are kept for the next run
+
+    # all the segments are present: join them, then the segments are not needed anymore
+    if not all(_join_segments(input_video_path, segments, segments_directory, index, output_video_path, source_start, in_debug_mode)
+               for index, (output_video_path, _) in enumerate(outputs)):
+        return False
+    shutil.rmtree(segments_directory, ignore_errors=True)
+    return True
+
+def segment_path(segments_directory, segment, output_index):
+    """Path of an encoded segment of an output, ffmpeg writes it under its partial_path."""
+    return os.path.join(segments_directory, f"segment_{segment.index:05d}_{output_index}{SEGMENT_EXTENSION}")
+
+def _encode_segments(input_video_path, segments, missing_segments, outputs, segments_directory, checkpoint, video_filter, input_arguments, duration, threads, workers, in_debug_mode, on_progress):
+    total_progress = progress.EncodeProgress(duration)
+    progress_lock = threading.Lock()
+    failed = threading.Event() # the segments not started yet are skipped after a failure
+
+    def segment_progress(_):
+        with progress_lock:
+            running = [segment.progress for segment in segments if segment.progress and not segment.progress.finished]
+            total_progress.out_time = sum(segment.progress.out_time for segment in segments if segment.progress)
+            total_progress.fps = sum(encode_progress.fps or 0 for encode_progress in running) or None
+            total_progress.speed = sum(encode_progress.speed or 0 for encode_progress in running) or None
+            if on_progress:
+                on_progress(total_progress)
+
+    def encode(segment):
+        if failed.is_set():
+            return False
+        if not _encode_segment(input_video_path, segment, outputs, segments_directory, video_filter, input_arguments, threads, in_debug_mode, segment_progress):
+            failed.set()
+            return False
+        # the segment is final: its outputs take their name, then it is recorded
+        try:
+            for index in range(len(outputs)):
+                os.replace(transcode_manifest.partial_path(segment_path(segments_directory, segment, index)), segment_path(segments_directory, segment, index))
+            checkpoint.mark_done(segment)
+        except OSError as e:
+            print_color.red(f"Error recording the segment {segment.index} of {input_video_path}: {e}")
+            failed.set()
+            return False
+        return True
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(encode, missing_segments))
+    if not all(results):
+        return False
+
+    total_progress.finished = True
+    if on_progress:
+        on_progress(total_progress)
+    return True
+
+def _encode_segment(input_video_path, segment, outputs, segments_directory, video_filter, input_arguments, threads, in_debug_mode, on_progress):
+    # accurate seek: the source is decoded from the keyframe and the frames before the cut are dropped
+    command = ['ffmpeg', '-y', *progress.PROGRESS_ARGUMENTS, *input_arguments]
+    # both input options, so that they cut the source for all the outputs: from just before the keyframe of the segment
+    # to just before the keyframe of the next one, -t counts from the seek. The first segment is also cut at its first
+    # frame: ffmpeg would fill the time before it with copies of that frame (constant frame rate of MPEG-TS)
+    seek = max(0.0, segment.start - SEEK_MARGIN)
+    if seek:
+        command += ['-ss', f"{seek:.6f}"]
+    if segment.end is not None:
+        command += ['-t', f"{segment.end - SEEK_MARGIN - seek:.6f}"]
+    command += ['-i', input_video_path]
+
+    split_labels = "".join(f"[v{index}]" for index in range(len(outputs)))
+    command += ['-filter_complex', f"[0:v]{video_filter},split={len(outputs)}{split_labels}"]
+    for index, (_, encoder_arguments) in enumerate(outputs):
+        command += ['-map', f"[v{index}]", '-an', *encoder_arguments]
+        if threads:
+            command += ['-threads', str(threads)]
+        command += ['-f', 'mpegts', transcode_manifest.partial_path(segment_path(segments_directory, segment, index))]
+    if not in_debug_mode:
+        command[1:1] = ['-loglevel', 'error']
+
+    segment.progress = progress.EncodeProgress(segment.duration)
+    try:
+        with tempfile.TemporaryFile() as error_file:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=None if in_debug_mode else error_file, text=True)
+            with process.stdout:
+                progress.read_progress(process.stdout, segment.progress, on_progress)
+            returncode = process.wait()
+            error_file.seek(0)
+            errors = error_file.read().decode('utf-8', errors='replace')
+    except OSError as e:
+        print_color.red(f"Error during the transcoding of the segment {segment.index} of {input_video_path}: {e}")
+        return False
+
+    if returncode != 0:
+        print_color.red(f"Error during the transcoding of the segment {segment.index} of {input_video_path}: {errors or f'ffmpeg exited with code {returncode}'}")
+        return False
+    segment.progress.finished = True
+    return True
+
+def _remove_stale_segments(output_directory, segments_directory, source_name):
+    # segments of the same source encoded with other parameters (or cut points) can't be resumed anymore
+    with os.scandir(output_directory) as entries:
+        for entry in entries:
+            if not entry.name.startswith(SEGMENTS_PREFIX) or entry.path == segments_directory or not entry.is_dir():
+                continue
+            try:
+                with open(os.path.join(entry.path, CHECKPOINT_FILE_NAME), 'r', encoding='utf-8') as file:
+                    stale_source_name = json.load(file).get("source")
+            except (OSError, ValueError, AttributeError):
+                continue
+            if stale_source_name == source_name:
+                print_color.yellow(f"The segments in {entry.path} have been encoded with other parameters, they are removed.")
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+def _join_segments(input_video_path, segments, segments_directory, output_index, output_video_path, source_start, in_debug_mode):
+    # the first frame of every segment is put at the end of the previous one, and a segment lasts exactly the time
+    # between its keyframe and the next one: every frame keeps its time of the source, once the joined video is delayed
+    # by the time of the first frame (the concat demuxer starts it at 0)
+    list_path = os.path.join(segments_directory, f"segments_{output_index}.txt")
+    with open(list_path, 'w', encoding='utf-8') as file:
+        for segment in segments:
+            escaped_path = segment_path(segments_directory, segment, output_index).replace("'", "'\\''")
+            file.write(f"file '{escaped_path}'\n")
+            if segment.duration is not None:
+                file.write(f"duration {segment.duration:.6f}\n")
+
+    # -copyts with explicit offsets: without it, ffmpeg would start the source at its first audio packet, as its video is
+    # not used, and an audio starting after the video would lose its delay
+    command = [
+        'ffmpeg', '-y', '-copyts',
+        '-itsoffset', f"{segments[0].start:.6f}",
+        '-f', 'concat', '-safe', '0', '-i', list_path, # the encoded segments
+        '-itsoffset', f"{-source_start:.6f}",
+        '-i', input_video_path,                     # the source, for its audio
+        '-map', '0:v', '-map', '1:a?',
+        '-c', 'copy',                               # no re-encoding, the segments and the audio are copied
+        output_video_path,
+    ]
+    if not in_debug_mode:
+        command[1:1] = ['-loglevel', 'error']
+
+    try:
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=None if in_debug_mode else subprocess.PIPE, text=True)
+    except OSError as e:
+        print_color.red(f"Error joining the segments of {output_video_path}: {e}")
+        return False
+    if result.returncode != 0:
+        print_color.red(f"Error joining the segments of {output_video_path}: {result.stderr or f'ffmpeg exited with code {result.returncode}'}")
+        return False
+    return True
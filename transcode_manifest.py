@@ -0,0 +1,122 @@
+import os # for the files paths and other useful stuffs
+import json # for the manifest file
+import hashlib # for the keys of the outputs
+import threading # for the outputs recorded by several transcoding jobs
+import atomic_file # for the manifest file written by several processes
+import print_color # for the colored prints
+
+# CONSTANTS
+MANIFEST_FILE_NAME = "transcode_manifest.json" # in every output directory, next to the transcoded videos
+PARTIAL_SUFFIX = ".partial" # added before the extension of an output while ffmpeg is writing it
+
+# one manifest per output directory, shared by all the jobs of the process
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+class TranscodeManifest:
+    """
+    Outputs of an output directory that ffmpeg has completed, with the key of their source and encode parameters.
+
+    An output is recorded only after ffmpeg exited successfully and the file took its final name, so a half written
+    video, or a video encoded with other parameters, is never taken for a completed one. A renamed source keeps its
+    fingerprint, so its outputs are found again under their old name.
+    """
+
+    def __init__(self, output_directory, in_debug_mode=False):
+        self.output_directory = output_directory
+        self.path = os.path.join(output_directory, MANIFEST_FILE_NAME)
+        self.in_debug_mode = in_debug_mode
+        self._outputs = {} # file name of the output -> {"key": key, "size": bytes, "source": file name of the source}
+        self._lock = threading.Lock()
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                self._outputs = json.load(file)
+            if not isinstance(self._outputs, dict):
+                raise ValueError("not a JSON object")
+        except FileNotFoundError:
+            self._outputs = {}
+        except ValueError as e:
+            print_color.yellow(f"The transcode manifest {self.path} can't be read ({e}), the videos of {output_directory} are transcoded again.")
+            self._outputs = {}
+
+    def completed_output(self, key, output_video_path):
+        """
+        Find a completed output for the key, preferably the one at output_video_path.
+
+        :return: Tuple (path of the output, file name of its source), None if no output with this key is complete.
+                 The path is another one when the source has been renamed since (or has a copy with the same content).
+        """
+        with self._lock:
+            outputs = dict(self._outputs)
+        expected_name = os.path.basename(output_video_path)
+        names = [expected_name] + [name for name in outputs if name != expected_name]
+        for name in names:
+            output = outputs.get(name)
+            if not output or output.get("key") != key:
+                continue
+            path = os.path.join(self.output_directory, name)
+            try:
+                if os.path.getsize(path) == output["size"]:
+                    return path, output["source"]
+            except OSError:
+                pass # deleted or moved by the user, transcoded again
+        return None
+
+    def record(self, key, output_video_path, source_name, replaced_video_path=None):
+        """
+        Record a completed output, to be called once it has its final name.
+
+        :param replaced_video_path: Output moved to output_video_path, its record is removed.
+        """
+        with self._lock:
+            if replaced_video_path:
+                self._outputs.pop(os.path.basename(replaced_video_path), None)
+            self._outputs[os.path.basename(output_video_path)] = {
+                "key": key,
+                "size": os.path.getsize(output_video_path),
+                "source": source_name,
+            }
+            self._save(replaced_video_path)
+
+        if self.in_debug_mode:
+            print_color.purple(f"Transcoded video {os.path.basename(output_video_path)} recorded in {self.path}")
+
+    # -- internal helpers --
+    def _save(self, replaced_video_path=None):
+        # the outputs recorded by another process are kept, a concurrent writer can only make a video be transcoded again
+        outputs = atomic_file.read_json_object(self.path)
+        if replaced_video_path:
+            outputs.pop(os.path.basename(replaced_video_path), None)
+        outputs.update(self._outputs)
+        self._outputs = outputs
+
+        try:
+            atomic_file.write_json(self.path, outputs, indent=1)
+        except OSError as e:
+            print_color.red(f"Error saving the transcode manifest {self.path}: {e}")
+
+
+# FUNCTIONS
+def manifest_for(output_directory, in_debug_mode=False):
+    """The manifest of an output directory, loaded once per process."""
+    key = os.path.normcase(os.path.abspath(output_directory))
+    with _manifests_lock:
+        if key not in _manifests:
+            _manifests[key] = TranscodeManifest(output_directory, in_debug_mode)
+        return _manifests[key]
+
+def output_key(source_fingerprint, encode_parameters):
+    """
+    Key of an output in the manifest.
+
+    :param source_fingerprint: Fingerprint of the content of the source video (see video.calculate_sampled_hash), it doesn't depend on its name.
+    :param encode_parameters: ffmpeg arguments that decide the content of the output (filters, encoder, bitrate or CRF, preset).
+    """
+    return hashlib.blake2b(json.dumps([source_fingerprint, list(encode_parameters)]).encode('utf-8'), digest_size=16).hexdigest()
+
+def partial_path(output_video_path):
+    """Temporary path written by ffmpeg, with the same extension so that ffmpeg picks the same format."""
+    file_name, extension = os.path.splitext(output_video_path)
+    return f"{file_name}{PARTIAL_SUFFIX}{extension}"
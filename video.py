@@ -1,70 +1,130 @@
 import print_color # for the colored prints
 import hashlib # for generating file hashs
 import os # for the files paths and other useful stuffs
-import shutil # for copying files
-import filecmp # for checking if two files are identycal
+import file_copy # for the streaming copy with the content digest
 import datetime # for the date and time
+import tempfile # for the private list of the files to concatenate
+import shutil # for the outputs of the sources with the same content
+import contextlib # for the names given by the destination catalog without the global lock
 import ffmpeg # for the video concatenation
 import subprocess # for the ffmpeg command execution
+import re # for the numbered names of a video
 import threading
-
-
-def calculate_file_hash(file_path):
+import queue # for the videos waiting to be transcoded
+import scheduler # for the pool running the transcoding jobs
+import encoders # for the encoders available on this machine
+import metrics # for the timing of the stages
+import progress # for the progress of the encodings
+import card_scan # for the single pass scan of the card
+import transcode_manifest # for the outputs already transcoded
+import segments # for the long recordings encoded in parallel segments
+
+# CONSTANTS
+FINGERPRINT_METADATA = "metadata" # key of the copied files: size and modification date
+FINGERPRINT_SAMPLED = "sampled" # key of the copied files: size and digest of the head, middle and tail of the content
+FINGERPRINT_MODES = [FINGERPRINT_METADATA, FINGERPRINT_SAMPLED]
+PROFILES = ["H264_low", "H264_high", "H265_VBR"] # the transcode profiles of the preferences
+
+# the free names of the destination folder are probed and taken by one worker at a time, also by the transfers of several cards
+_naming_lock = threading.Lock()
+
+
+def calculate_file_hash(file_path, file_size=None, modification_timestamp=None):
     """
     Calculate the hash based on file lenght and modification timestamp.
 
     :param file_path: Path of the file to calculate the hash.
+    :param file_size: Size of the file if already known (e.g. from the scan of the card), to avoid reading it again.
+    :param modification_timestamp: Modification timestamp of the file if already known.
     :return: Concatenation of file length and modification timestamp as a string.
     """
     
-    # Get the file size
-    file_size = os.path.getsize(file_path)
+    # Get the file size and the last modification timestamp with a single stat, if they are not known
+    if file_size is None or modification_timestamp is None:
+        file_stat = os.stat(file_path)
+        file_size, modification_timestamp = file_stat.st_size, file_stat.st_mtime
 
-    # Get the last modification date of the file
-    formatted_modification_date = obtain_modification_date(file_path)
+    # Format the last modification date of the file
+    formatted_modification_date = format_recording_date(datetime.datetime.fromtimestamp(modification_timestamp))
 
     # Concatenate the file size and the formatted modification date
     hash_value = f"{file_size}_{formatted_modification_date}"
 
     return hash_value
 
+def calculate_sampled_hash(file_path, file_size=None):
+    """
+    Calculate the hash based on file length and the content of its head, middle and tail.
+
+    It doesn't depend on the modification timestamp, the read has the same cost for every file whatever its length.
+    """
+    if file_size is None:
+        file_size = os.path.getsize(file_path)
+    return f"{file_size}_{file_copy.sampled_digest(file_path, file_size)}"
+
+def calculate_fingerprint(file_path, fingerprint_mode=FINGERPRINT_METADATA, file_size=None, modification_timestamp=None):
+    """
+    Calculate the key of a file in the copied files log.
+
+    :param fingerprint_mode: FINGERPRINT_METADATA (size and modification timestamp) or FINGERPRINT_SAMPLED (size and sampled content).
+    """
+    if fingerprint_mode == FINGERPRINT_SAMPLED:
+        return calculate_sampled_hash(file_path, file_size)
+    return calculate_file_hash(file_path, file_size, modification_timestamp)
+
 def files_in(directory, extension):
-    list_of_files = []
-    for file_name in os.listdir(directory):
-        # Build the complete file path
-        complete_path = os.path.join(directory, file_name)
+    # a single pass on the directory, sorted: the order of the clips is needed to recognize the splitted videos
+    return [scanned_file.path for scanned_file in card_scan.scan_directory(directory, extension)]
+
+def copy_file(source, destination_dir, hash_file, copied_files_ledger, in_secure_mode=True, in_debug_mode=False, queue_wait=None, fingerprint_mode=FINGERPRINT_METADATA, on_copy_progress=None, staging_name=None, copy_options=None):
+    """
+    Copy a file of the camcorder to the destination folder and add its hash to the copied files ledger.
 
-        # Check if it is a file and has the desired extension
-        if os.path.isfile(complete_path) and file_name.endswith(extension):
-            list_of_files.append(complete_path)
-    return list_of_files
+    In secure mode the copy calculates the digest of the source, otherwise the kernel copies the file without the program reading it.
 
-def copy_file(source, destination_dir, hash_file, copied_files_log_file, in_secure_mode=True, in_debug_mode=False):
+    :param staging_name: Name of the copy in the destination folder, None for the name of the source.
+    :param copy_options: Keyword arguments of file_copy.stream_copy (copy_method, chunk_size, readahead, drop_cache).
+    :return: True if the file has been copied (and verified in secure mode).
+    """
     has_been_copied = False
     # copy the file to the destination_dir folder
     try:
         # Create the destination directory if it doesn't exist
         if not os.path.exists(destination_dir):
             os.makedirs(destination_dir)
-        # Copy the file while preserving metadata
-        shutil.copy2(source, destination_dir)
+        destination_file_path = os.path.join(destination_dir, staging_name or os.path.basename(source))
+        file_size = os.path.getsize(source)
+
+        copy_options = copy_options or {}
+
+        # Copy the file in a single pass while calculating the digest of its content (an interrupted copy is resumed)
+        with metrics.stage("copy", os.path.basename(source), file_size, queue_wait):
+            source_digest = file_copy.stream_copy(source, destination_file_path, in_debug_mode=in_debug_mode, on_progress=on_copy_progress, with_digest=in_secure_mode, **copy_options)
         print_color.green("File copied successfully!")
         has_been_copied = True
-        
+
         if in_secure_mode:
-            # Verify if the files are identical
-            destination_file_path = os.path.join(destination_dir, os.path.basename(source))
-            if filecmp.cmp(source, destination_file_path, shallow=True): # check if the two files are identical based on metadata
-                # check if the hash passed to the function and the hash of the copied file are identical
-                if hash_file == calculate_file_hash(destination_file_path):
+            if in_debug_mode:
+                print_color.purple(f"The BLAKE2b digest of the file {os.path.basename(source)} is: {source_digest}")
+
+            with metrics.stage("verify", os.path.basename(source), file_size) as verify_record:
+                # Verify the copy re-reading only the destination, the source digest has been calculated during the copy
+                # (its pages have left the cache after the copy, so the bytes are read back from the disk)
+                if file_copy.file_digest(destination_file_path, copy_options.get("chunk_size", file_copy.CHUNK_SIZE), copy_options.get("drop_cache", False)) != source_digest:
+                    print_color.red("Error: The files content (checked with the digest) are not identical after copying.")
+                    verify_record.fail("content")
+                    has_been_copied = False
+                # check if the hash passed to the function and the hash of the copied file are identical (size and modification date or sampled content)
+                elif hash_file != calculate_fingerprint(destination_file_path, fingerprint_mode):
+                    print_color.red("Error: The files metadata are not identical after copying.")
+                    verify_record.fail("metadata")
+                    has_been_copied = False
+                else:
                     print_color.green("Copy verification successful, the files are identical.")
                     has_been_copied = True
-                else:
-                    print_color.red("Error: The files content (checked with the ash) are not identical after copying.")
-                    has_been_copied = False
-            else:
-                print_color.red("Error: The files metadata are not identical after copying.")
-                has_been_copied = False
+                if not has_been_copied:
+                    # nothing is recorded for a wrong copy, the clip is copied again at the next transfer
+                    os.remove(destination_file_path)
 
     except FileNotFoundError:
         print_color.red(f"Error: The file {source} does not exist.")
@@ -76,12 +136,11 @@ def copy_file(source, destination_dir, hash_file, copied_files_log_file, in_secu
         print_color.red(f"An error occurred: {e}")
         has_been_copied = False
 
-    # add the file ash to the copied_files_log_file file if the copy happened succesfully
+    # add the file ash to the copied files ledger if the copy happened succesfully
     if has_been_copied:
-        with open(copied_files_log_file, 'a') as file:
-            file.write(hash_file + "\n")
-            if in_debug_mode:
-                print_color.purple(f"The hash {hash_file} has been added to the copied files log")
+        copied_files_ledger.add(hash_file)
+
+    return has_been_copied
 
 
 def obtain_modification_date(file_path):
@@ -103,12 +162,112 @@ def check_file_existence(file_path):
     else:
         return False
 
-def rename_copied_file(file_name, destination_folder, in_debug_mode=True, keep_old_name=False):
+def format_recording_date(recording_date):
+    # Transform the date of a recording into a string formatted as 'YYYY-MM-DD_HH-MM-SS'
+    return recording_date.strftime('%Y-%m-%d_%H-%M-%S')
+
+def free_file_name(destination_folder, file_name, extension):
+    """Return file_name + extension, or with a number added if a file already has that name (e.g. 2021-01-01_12-00-00_1.MTS)."""
+    new_file_name = file_name
+    number = 0
+    while check_file_existence(os.path.join(destination_folder, f"{new_file_name}{extension}")):
+        number += 1
+        new_file_name = f"{file_name}_{number}"
+    return f"{new_file_name}{extension}"
+
+def move_without_overwrite(source, destination):
+    """
+    Move a file to destination, raise FileExistsError if a file already has that name.
+
+    Unlike os.replace, a file created at destination by another process after the name has been chosen is never overwritten.
+    """
+    if os.name == "nt":
+        os.rename(source, destination) # never overwrites on Windows
+        return
+    try:
+        os.link(source, destination)
+    except FileExistsError:
+        raise
+    except OSError:
+        # no hard links on this file system (e.g. exFAT): the name is claimed with an empty file, then the file is moved over it
+        os.close(os.open(destination, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        try:
+            os.replace(source, destination)
+        except OSError:
+            os.remove(destination)
+            raise
+        return
+    os.remove(source)
+
+def move_to_free_name(source, destination_folder, file_name, extension, destination_catalog=None, fingerprints=()):
+    """
+    Move a file to file_name + extension in the destination folder, or with a number added if the name is taken.
+
+    Without destination_catalog the caller must hold _naming_lock.
+    :return: Path of the moved file.
+    """
+    # a move interrupted between the link and the removal of the source (a crash) has already given the file its name
+    linked_file_path = _linked_name(source, destination_folder, file_name, extension)
+    if linked_file_path:
+        os.remove(source)
+        if destination_catalog:
+            destination_catalog.record(os.path.basename(linked_file_path), fingerprints)
+        return linked_file_path
+
+    while True:
+        if destination_catalog:
+            new_file_name = destination_catalog.reserve_name(file_name, extension)
+        else:
+            new_file_name = free_file_name(destination_folder, file_name, extension)
+        new_file_path = os.path.join(destination_folder, new_file_name)
+        try:
+            move_without_overwrite(source, new_file_path)
+        except FileExistsError:
+            # taken since the catalog has been loaded (another process writing in the same folder), the next number is tried
+            if destination_catalog:
+                destination_catalog.mark_taken(new_file_name)
+            continue
+        except OSError:
+            if destination_catalog:
+                destination_catalog.release(new_file_name)
+            raise
+        if destination_catalog:
+            destination_catalog.record(new_file_name, fingerprints)
+        return new_file_path
+
+def _linked_name(source, destination_folder, file_name, extension):
+    """Path of file_name + extension (or a numbered one) in the destination folder if it is a hard link of source, otherwise None."""
+    source_stat = os.stat(source)
+    if source_stat.st_nlink < 2:
+        return None # the usual case, the folder is not listed
+    numbered_name = re.compile(rf"^{re.escape(file_name)}(?:_\d+)?{re.escape(extension)}$")
+    with os.scandir(destination_folder) as entries:
+        for entry in entries:
+            if numbered_name.match(entry.name) and os.path.samestat(source_stat, entry.stat()):
+                return entry.path
+    return None
+
+def rename_copied_file(file_name, destination_folder, in_debug_mode=True, keep_old_name=False, recording_date=None, destination_catalog=None, fingerprints=()):
+    """
+    Rename a copied file after the date and time of its recording (YYYY-MM-DD_HH-MM-SS.MTS).
+
+    :param destination_catalog: catalog.DestinationCatalog of the destination folder, it gives the free name without probing
+                                the folder and records the video. None to probe the folder.
+    :param fingerprints: Keys of the video in the copied files log, recorded in the catalog.
+    :return: Path of the renamed file.
+    """
+    with metrics.stage("rename", file_name), (contextlib.nullcontext() if destination_catalog else _naming_lock):
+        return _rename_copied_file(file_name, destination_folder, in_debug_mode, keep_old_name, recording_date, destination_catalog, fingerprints)
+
+def _rename_copied_file(file_name, destination_folder, in_debug_mode, keep_old_name, recording_date, destination_catalog, fingerprints):
     # Build the complete path of the copied file
     copied_file_path = os.path.join(destination_folder, file_name)
 
-    # Obtain the modification date of the copied file
-    modification_date = obtain_modification_date(copied_file_path)
+    # Use the start of the recording when it is known (AVCHD index), otherwise the modification date of the copied file
+    if recording_date:
+        modification_date = format_recording_date(recording_date)
+    else:
+        modification_date = obtain_modification_date(copied_file_path)
 
     # Split the file name and the extension
     file_name, extension = os.path.splitext(file_name)
@@ -119,243 +278,396 @@ def rename_copied_file(file_name, destination_folder, in_debug_mode=True, keep_o
     else:
         new_file_name = f"{modification_date}"
 
-    # if there is already a file with the same name in the destination folder, add a number to the new file name to avoid conflicts (e.g. 2021-01-01_12-00-00_1.MTS)
-    if check_file_existence(os.path.join(destination_folder, f"{new_file_name}{extension}")):
-        number = 1
-        while check_file_existence(os.path.join(destination_folder, f"{new_file_name}_{number}")):
-            number += 1
-        new_file_name = f"{new_file_name}_{number}"
+    # Rename the copied file, if there is already a file with the same name in the destination folder add a number to the new file name to avoid conflicts (e.g. 2021-01-01_12-00-00_1.MTS)
+    new_file_path = move_to_free_name(copied_file_path, destination_folder, new_file_name, extension, destination_catalog, fingerprints)
 
-    # add the extension to the new file name
-    new_file_name = f"{new_file_name}{extension}"
+    if in_debug_mode:
+        print_color.green(f"The file has been renamed to {os.path.basename(new_file_path)}")
 
-    # Build the complete path of the new file
-    new_file_path = os.path.join(destination_folder, new_file_name)
+    return new_file_path
 
-    # Rename the copied file
-    os.rename(copied_file_path, new_file_path)
 
-    if in_debug_mode:
-        print_color.green(f"The file has been renamed to {new_file_name}")
 
-    return new_file_path
+def concat(video_files, output_directory, hash_to_be_concatenated, copied_files_ledger, in_debug_mode=False, recording_date=None, queue_wait=None, staging_prefix="", on_concatenated=None, destination_catalog=None):
+    """
+    Concatenate the parts of a splitted video into the output directory.
 
+    The list of the parts is written to a private temporary file, so several concatenations can run at the same time.
+    The output is written under a temporary name and the hashes are added to the ledger only if ffmpeg succeeded.
 
+    :param recording_date: Start of the recording (from the AVCHD index) used for the name, None for the modification date of the last part.
+    :param queue_wait: Seconds the parts waited for the copy slots, for the metrics.
+    :param staging_prefix: Prefix of the temporary name of the output, so that the transfers of several cards never write the same file.
+    :param on_concatenated: Called with the path of the temporary output once ffmpeg succeeded, before it takes its final name.
+    :param destination_catalog: catalog.DestinationCatalog of the output directory, None to probe the folder for a free name.
+    :return: Path of the concatenated video, None if the concatenation failed.
+    """
+    with metrics.stage("concat", os.path.basename(video_files[0]), sum(os.path.getsize(video_file) for video_file in video_files), queue_wait) as concat_record:
+        concatenated_video = _concat(video_files, output_directory, hash_to_be_concatenated, copied_files_ledger, in_debug_mode, recording_date, staging_prefix, on_concatenated, destination_catalog)
+        if concatenated_video is None:
+            concat_record.fail("ffmpeg")
+        return concatenated_video
 
-def concat(video_files, output_directory, hash_to_be_concatenated, copied_files_log_file, in_debug_mode=False):
-    if in_debug_mode:
-        print_color.purple(f"Video files to concatenate: {video_files}")
+def concat_file_names(video_files, recording_date=None, staging_prefix=""):
+    """
+    Names of the output of a concatenation.
 
+    :return: Tuple (name of the concatenated video, name of the temporary output written by ffmpeg).
+    """
     extension = os.path.splitext(video_files[0])[1]
 
-    # Get the output file name from the last modification date of the last file in the list of files to concatenate
-    output_file_name = obtain_modification_date(video_files[-1]) + extension
+    # Get the output file name from the start of the recording if known, otherwise from the last modification date of the last file in the list of files to concatenate
+    if recording_date:
+        output_file_name = format_recording_date(recording_date) + extension
+    else:
+        output_file_name = obtain_modification_date(video_files[-1]) + extension
+    partial_file_name = f"{staging_prefix}{os.path.splitext(output_file_name)[0]}.partial{extension}" # same extension, ffmpeg picks the format from it
+    return output_file_name, partial_file_name
 
-    # Create a temporary text file
-    with open('filelist.txt', 'w') as f:
-        for video_file in video_files:
-            # Write each input file to the text file
-            f.write(f"file '{video_file}'\n")
+def publish_concatenated(partial_file_path, output_directory, output_file_name, destination_catalog=None, fingerprints=()):
+    """Give its final name to a complete concatenation, numbered like the renamed videos if the name is taken."""
+    with contextlib.nullcontext() if destination_catalog else _naming_lock:
+        return move_to_free_name(partial_file_path, output_directory, *os.path.splitext(output_file_name), destination_catalog, fingerprints)
 
-    print("Concatenating the videos...")
-    # Use ffmpeg to concatenate the videos listed in the text file
+def _concat(video_files, output_directory, hash_to_be_concatenated, copied_files_ledger, in_debug_mode, recording_date, staging_prefix, on_concatenated, destination_catalog):
     if in_debug_mode:
-        print_color.purple("Output of the ffmpeg command:")
-        (
-            ffmpeg
-            .input('filelist.txt', format='concat', safe=0)
-            .output(os.path.join(output_directory, output_file_name), c='copy')  # Use direct copy of codecs
-            .run(overwrite_output=True)
-        )
-        print_color.purple("End of the output of ffmpeg command:")
-    else:
-        (
-            ffmpeg
-            .input('filelist.txt', format='concat', safe=0)
-            .output(os.path.join(output_directory, output_file_name), c='copy')  # Use direct copy of codecs
-            .run(overwrite_output=True, quiet=True)
-        )
-
-    # Remove the temporary text file
-    os.remove('filelist.txt')
+        print_color.purple(f"Video files to concatenate: {video_files}")
 
+    output_file_name, partial_file_name = concat_file_names(video_files, recording_date, staging_prefix)
+    partial_file_path = os.path.join(output_directory, partial_file_name)
 
-    print_color.green(f"The videos have been concatenated into {os.path.join(output_directory, output_file_name)}")
+    # Create a temporary text file, unique for this concatenation
+    with tempfile.NamedTemporaryFile('w', prefix="concat_", suffix=".txt", delete=False, encoding='utf-8') as f:
+        filelist_path = f.name
+        for video_file in video_files:
+            # Write each input file to the text file (absolute path, the list is not in the working directory, quotes escaped)
+            escaped_path = os.path.abspath(video_file).replace("'", "'\\''")
+            f.write(f"file '{escaped_path}'\n")
 
-    # add the hashes of the concatenated files to the copied_files_log_file
-    with open(copied_files_log_file, 'a') as file:
-        for hash_file in hash_to_be_concatenated:
-            file.write(hash_file + "\n")
-            if in_debug_mode:
-                print_color.purple(f"The hash {hash_file} has been added to the copied files log")
+    print("Concatenating the videos...")
+    # Use ffmpeg to concatenate the videos listed in the text file
+    try:
+        if in_debug_mode:
+            print_color.purple("Output of the ffmpeg command:")
+            (
+                ffmpeg
+                .input(filelist_path, format='concat', safe=0)
+                .output(partial_file_path, c='copy')  # Use direct copy of codecs
+                .run(overwrite_output=True)
+            )
+            print_color.purple("End of the output of ffmpeg command:")
+        else:
+            (
+                ffmpeg
+                .input(filelist_path, format='concat', safe=0)
+                .output(partial_file_path, c='copy')  # Use direct copy of codecs
+                .run(overwrite_output=True, quiet=True)
+            )
+    except ffmpeg.Error as e:
+        # ffmpeg exited with an error: nothing is recorded, the parts will be concatenated again at the next transfer
+        print_color.red(f"Error during the concatenation of {video_files}: {e.stderr.decode('utf-8') if e.stderr else e}")
+        if os.path.exists(partial_file_path):
+            os.remove(partial_file_path)
+        return None
+    finally:
+        # Remove the temporary text file
+        os.remove(filelist_path)
+
+    if on_concatenated:
+        on_concatenated(partial_file_path)
+
+    # the concatenated video takes its final name only when it is complete
+    output_file_path = publish_concatenated(partial_file_path, output_directory, output_file_name, destination_catalog, hash_to_be_concatenated)
+
+    print_color.green(f"The videos have been concatenated into {output_file_path}")
+
+    # add the hashes of the concatenated files to the copied files ledger
+    copied_files_ledger.add_many(hash_to_be_concatenated)
     
-    return os.path.join(output_directory, output_file_name)
+    return output_file_path
 
 
 
 ############################################################################################################
 
 
-def transcode_H264_fixed(input_video_path, output_directory, bitrate='8M', in_debug_mode=False, overwrite=False):
-    # Get the file name and the extension
-    file_name = os.path.basename(input_video_path)
-    file_name, extension = os.path.splitext(file_name)
+DEINTERLACE_FILTER = 'yadif=0:-1:0' # Deinterlacing filter (now not with CUDA)
 
-    # Get the output file name
-    suffix = f"_H264_{bitrate}bps"
-    output_file_name = f"{file_name}{suffix}.mp4"
 
-    # Get the output file path
-    output_video_path = os.path.join(output_directory, output_file_name)
+def H264_fixed_output(input_video_path, output_directory, bitrate='8M', backend=None, preset=None):
+    """Return the output path and the ffmpeg encoder arguments of the H264 fixed bitrate profile."""
+    file_name = os.path.splitext(os.path.basename(input_video_path))[0]
+    output_video_path = os.path.join(output_directory, f"{file_name}_H264_{bitrate}bps.mp4")
+    encoder_arguments = encoders.encoder_arguments(backend or encoders.select_backend(), "h264", bitrate=bitrate, preset=preset)
+    return output_video_path, encoder_arguments
 
-    if in_debug_mode:
-        print_color.purple(f"Output video path: {output_video_path}")
+def H265_CRF_output(input_video_path, output_directory, crf=23, backend=None, preset=None):
+    """Return the output path and the ffmpeg encoder arguments of the H265 variable bitrate profile."""
+    file_name = os.path.splitext(os.path.basename(input_video_path))[0]
+    output_video_path = os.path.join(output_directory, f"{file_name}_H265_CRF{crf}.mp4")
+    encoder_arguments = encoders.encoder_arguments(backend or encoders.select_backend(), "h265", crf=crf, preset=preset)
+    return output_video_path, encoder_arguments
 
-    # Check if file exists and handle overwrite logic
-    if not overwrite and os.path.exists(output_video_path):
-        print_color.yellow(f"File already exists: {output_video_path}. Skipping transcoding.")
-        return
 
-    # ffmpeg command
-    command = [
-        'ffmpeg',
-        '-hwaccel', 'cuda',             # Use CUDA for hardware acceleration (it should fall back to CPU if CUDA is not available)
-        '-i', input_video_path,         # Input video file
-        '-vf', 'yadif=0:-1:0',          # Deinterlacing filter (now not with CUDA)
-        '-c:v', 'h264_nvenc',           # Use NVIDIA GPU encoder
-        '-b:v', bitrate,                # Set video bitrate
-        '-preset', 'p4',                # Use NVENC preset (e.g., p1 to p7, p4 is "medium")
-        '-c:a', 'copy',                 # Copy audio without re-encoding
-        output_video_path
-    ]
+def transcode_H264_fixed(input_video_path, output_directory, bitrate='8M', in_debug_mode=False, overwrite=False, threads=None, backend=None, segment_options=None):
+    backend = backend or encoders.select_backend(in_debug_mode=in_debug_mode)
+    return transcode_multi_output(input_video_path, [H264_fixed_output(input_video_path, output_directory, bitrate, backend)], in_debug_mode, overwrite, threads, backend, segment_options=segment_options)
 
-    # Set the log level to suppress stdout only if not in debug mode
-    if not in_debug_mode:
-        command.insert(1, '-loglevel')
-        command.insert(2, 'error')
-
-    print("Transcoding the video...")
-    try:
-        # Use subprocess.run to suppress only stdout
-        with open(os.devnull, 'w') as devnull:
-            result = subprocess.run(command, stdout=devnull, stderr=None if in_debug_mode else subprocess.PIPE)
-
-        if result.returncode == 0:
-            print_color.green(f"The video has been transcoded successfully to: {output_video_path}.")
-        else:
-            print_color.red(f"Error during video transcoding: {result.stderr.decode('utf-8')}")
-    except subprocess.CalledProcessError as e:
-        print_color.red(f"Error during video transcoding: {e}")
 
+def transcode_H265_CRF(input_video_path, output_directory, crf=23, in_debug_mode=False, overwrite=False, threads=None, backend=None, segment_options=None):
+    backend = backend or encoders.select_backend(in_debug_mode=in_debug_mode)
+    return transcode_multi_output(input_video_path, [H265_CRF_output(input_video_path, output_directory, crf, backend)], in_debug_mode, overwrite, threads, backend, segment_options=segment_options)
 
-def transcode_H265_CRF(input_video_path, output_directory, crf=23, in_debug_mode=False, overwrite=False):
-    # Get the file name and the extension
-    file_name = os.path.basename(input_video_path)
-    file_name, extension = os.path.splitext(file_name)
 
-    # Get the output file name
-    suffix = f"_H265_CRF{crf}"
-    output_file_name = f"{file_name}{suffix}.mp4"
+def video_duration(video_path):
+    """Duration of a video in seconds, None if ffprobe can't read it."""
+    try:
+        return float(ffmpeg.probe(video_path)["format"]["duration"])
+    except (ffmpeg.Error, OSError, KeyError, ValueError, TypeError):
+        return None
 
-    # Get the output file path
-    output_video_path = os.path.join(output_directory, output_file_name)
 
+def transcode_multi_output(input_video_path, outputs, in_debug_mode=False, overwrite=False, threads=None, backend=None, on_progress=None, segment_options=None, max_sessions=None):
+    """
+    Transcode a video to several outputs with a single ffmpeg process.
+
+    The source is decoded and deinterlaced once, then the frames are split between the encoders of the outputs. With
+    segment_options enabled, a recording of at least min_duration seconds is cut on its keyframes and its segments are
+    encoded by several ffmpeg processes at the same time (see segments.transcode_segments).
+    Every output is written under a temporary name, it takes its final name and is recorded in the transcode manifest of
+    its directory only when ffmpeg succeeded. An output is skipped only if the manifest has it for the same source
+    content and encode parameters, so a half written video or a video encoded with other parameters is transcoded again.
+
+    :param outputs: List of (output video path, encoder arguments), as returned by H264_fixed_output and H265_CRF_output.
+    :param backend: Name of the encoders backend the outputs have been built for, it decides the hardware decoding.
+    :param on_progress: Called with a progress.EncodeProgress (position, fps, speed, ETA) about twice per second.
+    :param segment_options: The segment_transcode preferences: enabled, min_duration, segment_duration and workers.
+                            The segmented transcoding is resumed by the next run after an interruption.
+    :param max_sessions: Encoders this transcoding can open at the same time, its share of the limit of the backend when
+                         other transcodings run at the same time. None for the whole limit of the backend.
+    :return: True if all the outputs are available.
+    """
     if in_debug_mode:
-        print_color.purple(f"Output video path: {output_video_path}")
+        for output_video_path, _ in outputs:
+            print_color.purple(f"Output video path: {output_video_path}")
 
-    # Check if file exists and handle overwrite logic
-    if not overwrite and os.path.exists(output_video_path):
-        print_color.yellow(f"File already exists: {output_video_path}. Skipping transcoding.")
-        return
+    try:
+        # the content of the source, not its modification date: two clips of the same size can be recorded in the same second
+        source_fingerprint = calculate_sampled_hash(input_video_path)
+    except OSError as e:
+        print_color.red(f"Error during video transcoding: {e}")
+        return False
 
-    # ffmpeg command
+    # Skip the outputs already completed for this source and these parameters, unless they are overwritten
+    pending_outputs = [] # (output video path, encoder arguments, manifest, key)
+    for output_video_path, encoder_arguments in outputs:
+        manifest = transcode_manifest.manifest_for(os.path.dirname(output_video_path), in_debug_mode)
+        key = transcode_manifest.output_key(source_fingerprint, [DEINTERLACE_FILTER, *encoder_arguments])
+        completed_output = None if overwrite else manifest.completed_output(key, output_video_path)
+        if completed_output:
+            completed_video_path, completed_source_name = completed_output
+            if completed_video_path != output_video_path:
+                if os.path.exists(os.path.join(os.path.dirname(input_video_path), completed_source_name)):
+                    # another source with the same content, it keeps its output
+                    shutil.copyfile(completed_video_path, transcode_manifest.partial_path(output_video_path))
+                    os.replace(transcode_manifest.partial_path(output_video_path), output_video_path)
+                    manifest.record(key, output_video_path, os.path.basename(input_video_path))
+                else:
+                    # the source has been renamed since, the output follows its new name
+                    os.replace(completed_video_path, output_video_path)
+                    manifest.record(key, output_video_path, os.path.basename(input_video_path), replaced_video_path=completed_video_path)
+            print_color.yellow(f"File already transcoded: {output_video_path}. Skipping transcoding.")
+            continue
+        if os.path.exists(output_video_path) and not overwrite:
+            print_color.yellow(f"File {output_video_path} is incomplete or has been encoded with other parameters, it is transcoded again.")
+        pending_outputs.append((output_video_path, encoder_arguments, manifest, key))
+    if not pending_outputs:
+        return True
+    # ffmpeg writes the outputs under their temporary name
+    partial_outputs = [(transcode_manifest.partial_path(output_video_path), encoder_arguments) for output_video_path, encoder_arguments, _, _ in pending_outputs]
+    output_names = ", ".join(output_video_path for output_video_path, _, _, _ in pending_outputs)
+    segment_options = segment_options or {}
+    backend = backend or encoders.select_backend()
+    input_arguments = encoders.input_arguments(backend)
+    duration = video_duration(input_video_path) if on_progress or segment_options.get("enabled") else None
+
+    if segment_options.get("enabled") and duration and duration >= segment_options.get("min_duration", 0):
+        # long recording: its segments are encoded in parallel, then joined with the audio of the source. The segments
+        # already encoded for the same source and outputs by an interrupted run are kept
+        segment_duration = segment_options.get("segment_duration", segments.SEGMENT_DURATION)
+        segments_key = transcode_manifest.output_key(source_fingerprint, [*(key for _, _, _, key in pending_outputs), segment_duration])
+        transcoded = segments.transcode_segments(input_video_path, partial_outputs, DEINTERLACE_FILTER, segments_key, input_arguments, duration, threads,
+                                                 segment_options.get("workers", 0), segment_duration, in_debug_mode, on_progress,
+                                                 max_sessions or encoders.BACKENDS[backend]["max_sessions"])
+    else:
+        transcoded = _transcode_once(input_video_path, partial_outputs, input_arguments, duration, threads, in_debug_mode, on_progress)
+
+    if transcoded:
+        try:
+            # the outputs are complete: give them their final name, then record them
+            for output_video_path, _, manifest, key in pending_outputs:
+                os.replace(transcode_manifest.partial_path(output_video_path), output_video_path)
+                manifest.record(key, output_video_path, os.path.basename(input_video_path))
+            print_color.green(f"The video has been transcoded successfully to: {output_names}.")
+            return True
+        except OSError as e:
+            print_color.red(f"Error during video transcoding: {e}")
+
+    # nothing is recorded, the temporary outputs are removed and the video will be transcoded again at the next run
+    for partial_video_path, _ in partial_outputs:
+        if os.path.exists(partial_video_path):
+            os.remove(partial_video_path)
+    return False
+
+def _transcode_once(input_video_path, outputs, input_arguments, duration, threads, in_debug_mode, on_progress):
+    # ffmpeg command: decode and deinterlace once, then split the frames between the outputs
+    split_labels = "".join(f"[v{index}]" for index in range(len(outputs)))
     command = [
         'ffmpeg',
-        '-hwaccel', 'cuda',             # Use CUDA for hardware acceleration (it should fall back to CPU if CUDA is not available)
+        '-y',                           # Overwrite the temporary outputs left by an interrupted run
+        *progress.PROGRESS_ARGUMENTS,   # Machine-readable progress on stdout
+        *input_arguments,               # Hardware decoding of the backend, if available
         '-i', input_video_path,         # Input video file
-        '-vf', 'yadif=0:-1:0',          # Deinterlacing filter (now not with CUDA)
-        '-c:v', 'hevc_nvenc',           # Use NVIDIA GPU encoder for H.265
-        '-crf', str(crf),               # Set CRF value
-        '-preset', 'p4',                # Use NVENC preset (e.g., p1 to p7, p4 is "medium")
-        '-c:a', 'copy',                 # Copy audio without re-encoding
-        output_video_path
+        '-filter_complex', f"[0:v]{DEINTERLACE_FILTER},split={len(outputs)}{split_labels}",
     ]
+    for index, (output_video_path, encoder_arguments) in enumerate(outputs):
+        command += [
+            '-map', f"[v{index}]",      # Deinterlaced frames for this output
+            '-map', '0:a?',             # Audio of the source, if present
+            *encoder_arguments,
+            '-c:a', 'copy',             # Copy audio without re-encoding
+        ]
+        # Limit the threads of ffmpeg to its share of the thread budget
+        if threads:
+            command += ['-threads', str(threads)]
+        command.append(output_video_path)
 
     # Set the log level to suppress stdout only if not in debug mode
     if not in_debug_mode:
         command.insert(1, '-loglevel')
         command.insert(2, 'error')
 
+    encode_progress = progress.EncodeProgress(duration)
     print("Transcoding the video...")
     try:
-        # Use subprocess.run to suppress only stdout
-        with open(os.devnull, 'w') as devnull:
-            result = subprocess.run(command, stdout=devnull, stderr=None if in_debug_mode else subprocess.PIPE)
-
-        if result.returncode == 0:
-            print_color.green(f"The video has been transcoded successfully to: {output_video_path}.")
-        else:
-            print_color.red(f"Error during video transcoding: {result.stderr.decode('utf-8')}")
-    except subprocess.CalledProcessError as e:
+        # the errors go to a temporary file, so a full pipe can't block ffmpeg while its progress is read
+        with tempfile.TemporaryFile() as error_file:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=None if in_debug_mode else error_file, text=True)
+            with process.stdout:
+                progress.read_progress(process.stdout, encode_progress, on_progress)
+            returncode = process.wait()
+            error_file.seek(0)
+            errors = error_file.read().decode('utf-8', errors='replace')
+
+        if returncode == 0:
+            return True
+        print_color.red(f"Error during video transcoding: {errors or f'ffmpeg exited with code {returncode}'}")
+    except (subprocess.CalledProcessError, OSError) as e:
         print_color.red(f"Error during video transcoding: {e}")
+    return False
 
 
-def transcode_list_of_videos(list_of_videos, preferences, update_H264_low_progress=None, update_H264_high_progress=None, update_H265_progress=None, overwrite=False, in_debug_mode=False):
-    
+def transcode_list_of_videos(list_of_videos, preferences, update_H264_low_progress=None, update_H264_high_progress=None, update_H265_progress=None, overwrite=False, in_debug_mode=False, on_job_status=None, on_job_progress=None):
+    # put all the videos in a queue and close it, the transcoding starts immediately
+    video_queue = queue.Queue()
+    for video in list_of_videos:
+        video_queue.put(video)
+    video_queue.put(None)
+
+    return transcode_queue_of_videos(video_queue, preferences, update_H264_low_progress, update_H264_high_progress, update_H265_progress, overwrite, in_debug_mode, on_job_status, on_job_progress)
+
+
+def transcode_queue_of_videos(video_queue, preferences, update_H264_low_progress=None, update_H264_high_progress=None, update_H265_progress=None, overwrite=False, in_debug_mode=False, on_job_status=None, on_job_progress=None):
+    """
+    Transcode the videos while they are put in the queue, so the transcoding can overlap with the transfer.
+
+    Every (video, profile) couple is a job of a scheduler.TranscodeScheduler, that runs them on a pool sized on the thread budget.
+    With the multi_output preference a video has a single job writing all the enabled profiles.
+
+    :param video_queue: Queue of the paths of the videos to transcode, None marks the end of the videos.
+    The update_*_progress callbacks are called with the percentage of the profile, also while a video is being encoded,
+    and the keyword arguments fps (of the running encoding) and eta (seconds left for the videos submitted so far).
+
+    :param on_job_status: Called with the scheduler.TranscodeJob every time its status changes.
+    :param on_job_progress: Called with the scheduler.TranscodeJob every time ffmpeg reports its progress (job.progress).
+    :return: List of the jobs that failed.
+    """
+
     # Get the preferences
     bitrate_H264_low = preferences["H264_low"]["bitrate"]
     bitrate_H264_high = preferences["H264_high"]["bitrate"]
     crf_H265 = preferences["H265_VBR"]["CRF"]
-    
-    
-    def transcode_H264_fixed_videos(videos, bitrate, update_progress=None):
-        source_directory = os.path.dirname(videos[0])
-        sub_directory = os.path.join("transcoded_videos", f"H264_{bitrate}bps")
-        output_directory = os.path.join(source_directory, sub_directory)
-        if not os.path.exists(output_directory):
-            os.makedirs(output_directory)
-
-        for video in videos:
-            transcode_H264_fixed(video, output_directory, bitrate, in_debug_mode, overwrite)
-            if update_progress:
-                current_progress = ((videos.index(video) + 1) / len(videos)) * 100
-                update_progress(current_progress)
-
-    def transcode_H265_videos(videos, CRF, update_progress=None):
-        source_directory = os.path.dirname(videos[0])
-        sub_directory = os.path.join("transcoded_videos", f"H265_CRF{CRF}")
-        output_directory = os.path.join(source_directory, sub_directory)
-        if not os.path.exists(output_directory):
-            os.makedirs(output_directory)
-
-        for video in videos:
-            transcode_H265_CRF(video, output_directory, CRF, in_debug_mode, overwrite)
-            if update_progress:
-                current_progress = ((videos.index(video) + 1) / len(videos)) * 100
-                update_progress(current_progress)
 
-    if preferences["H264_low"]["enabled"]:
-        thread_H264_low = threading.Thread(target=transcode_H264_fixed_videos, args=(list_of_videos, bitrate_H264_low, update_H264_low_progress))
-    if preferences["H264_high"]["enabled"]:
-        thread_H264_high = threading.Thread(target=transcode_H264_fixed_videos, args=(list_of_videos, bitrate_H264_high, update_H264_high_progress))
-    if preferences["H265_VBR"]["enabled"]:
-        thread_H265 = threading.Thread(target=transcode_H265_videos, args=(list_of_videos, crf_H265, update_H265_progress))
+    # the encoders are probed once, then every profile is translated for the chosen backend
+    backend = encoders.select_backend(preferences["encoder_backend"], in_debug_mode)
+    preset = preferences["encoder_presets"].get(backend) or None
 
-    if preferences["H264_low"]["enabled"]:
-        thread_H264_low.start()
-    if preferences["H264_high"]["enabled"]:
-        thread_H264_high.start()
-    if preferences["H265_VBR"]["enabled"]:
-        thread_H265.start()
 
+    def output_directory_for(video, sub_directory):
+        output_directory = os.path.join(os.path.dirname(video), "transcoded_videos", sub_directory)
+        os.makedirs(output_directory, exist_ok=True)
+        return output_directory
+
+    # enabled profiles: name -> function returning the output path and the encoder arguments for a video
+    profile_outputs = {}
+    progress_callbacks = {}
     if preferences["H264_low"]["enabled"]:
-        thread_H264_low.join()
+        profile_outputs["H264_low"] = lambda video: H264_fixed_output(video, output_directory_for(video, f"H264_{bitrate_H264_low}bps"), bitrate_H264_low, backend, preset)
+        progress_callbacks["H264_low"] = update_H264_low_progress
     if preferences["H264_high"]["enabled"]:
-        thread_H264_high.join()
+        profile_outputs["H264_high"] = lambda video: H264_fixed_output(video, output_directory_for(video, f"H264_{bitrate_H264_high}bps"), bitrate_H264_high, backend, preset)
+        progress_callbacks["H264_high"] = update_H264_high_progress
     if preferences["H265_VBR"]["enabled"]:
-        thread_H265.join()
+        profile_outputs["H265_VBR"] = lambda video: H265_CRF_output(video, output_directory_for(video, f"H265_CRF{crf_H265}"), crf_H265, backend, preset)
+        progress_callbacks["H265_VBR"] = update_H265_progress
+
+    # with multi_output all the enabled profiles of a video are a single job, that decodes and deinterlaces the source once
+    if preferences["multi_output"]:
+        profile_groups = [list(profile_outputs)] if profile_outputs else []
+    else:
+        profile_groups = [[profile] for profile in profile_outputs]
+
+    def job_run(video, profile_group):
+        return lambda threads, on_progress=None, max_sessions=None: transcode_multi_output(video, [profile_outputs[profile](video) for profile in profile_group], in_debug_mode, overwrite, threads, backend, on_progress,
+                                                                                       preferences["segment_transcode"], max_sessions)
+
+    def profile_progress(job_profile, percentage, fps=None, eta=None):
+        # the profile of a multi output job is the enabled profiles joined by "+"
+        for profile in job_profile.split("+"):
+            if progress_callbacks[profile]:
+                progress_callbacks[profile](percentage, fps=fps, eta=eta)
+
+    transcode_scheduler = scheduler.TranscodeScheduler(
+        thread_budget=preferences["transcode_thread_budget"],
+        workers=preferences["transcode_workers"],
+        threads_per_job=preferences["encoder_threads_per_job"].get(backend, 0),
+        priority=preferences["transcode_priority"],
+        on_job_status=on_job_status,
+        on_profile_progress=profile_progress,
+        on_job_progress=on_job_progress,
+        in_debug_mode=in_debug_mode,
+        # every job opens an encoder per output, all of them must fit in the sessions of a hardware encoder
+        max_sessions=encoders.BACKENDS[backend]["max_sessions"],
+        outputs_per_job=max((len(profile_group) for profile_group in profile_groups), default=1),
+    )
+
+    # submit a job for every enabled profile as soon as a video arrives
+    while True:
+        video = video_queue.get()
+        if video is None:
+            break
+        for profile_group in profile_groups:
+            transcode_scheduler.submit(scheduler.TranscodeJob(video, "+".join(profile_group), job_run(video, profile_group)))
+
+    transcode_scheduler.close()
+    transcode_scheduler.join()
+
+    if transcode_scheduler.failed_jobs:
+        print_color.red(f"{len(transcode_scheduler.failed_jobs)} transcoding jobs failed: {transcode_scheduler.failed_jobs}")
+    else:
+        print_color.green("All the videos have been transcoded successfully.")
 
-    print_color.green("All the videos have been transcoded successfully.")
+    return transcode_scheduler.failed_jobs
 
 
 
@@ -366,12 +678,12 @@ if __name__ == "__main__":
         "tests_py\\v_3.MTS",
     ]
 
-    def update_H264_low_progress(progress):
-        print_color.purple(f"H264 low: {progress:.2f}%")
-    def update_H264_high_progress(progress):
-        print_color.purple(f"H264 high: {progress:.2f}%")
-    def update_H265_progress(progress):
-        print_color.purple(f"H265: {progress:.2f}%")
+    def update_H264_low_progress(percentage, fps=None, eta=None):
+        print_color.purple(f"H264 low: {percentage:.2f}% ({fps} fps, ETA {progress.format_eta(eta)})")
+    def update_H264_high_progress(percentage, fps=None, eta=None):
+        print_color.purple(f"H264 high: {percentage:.2f}% ({fps} fps, ETA {progress.format_eta(eta)})")
+    def update_H265_progress(percentage, fps=None, eta=None):
+        print_color.purple(f"H265: {percentage:.2f}% ({fps} fps, ETA {progress.format_eta(eta)})")
     transcode_list_of_videos(to_be_transcoded, update_H264_low_progress=update_H264_low_progress, update_H264_high_progress=update_H264_high_progress, update_H265_progress=update_H265_progress, in_debug_mode=False)
     
     # Example usage